@@ -0,0 +1,118 @@
+# admission.py
+# Load shedding for the synchronous analysis endpoints: at most
+# `max_concurrent` analyses run at once, up to `max_queue` more wait for a
+# slot, and everything beyond that is turned away immediately with a
+# Retry-After hint instead of piling up behind the others.
+import math
+import threading
+import time
+
+from config import (ADMISSION_MAX_CONCURRENT, ADMISSION_MAX_QUEUE, ADMISSION_QUEUE_TIMEOUT_S,
+                    DEADLINE_INITIAL_FRAME_COST_S)
+
+
+class Overloaded(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"server busy, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    def __init__(self, max_concurrent=ADMISSION_MAX_CONCURRENT, max_queue=ADMISSION_MAX_QUEUE,
+                 queue_timeout=ADMISSION_QUEUE_TIMEOUT_S):
+        self.max_concurrent = max(1, int(max_concurrent))
+        self.max_queue = max(0, int(max_queue))
+        self.queue_timeout = queue_timeout
+        self._cond = threading.Condition()
+        self._active = 0
+        self._waiting = 0
+        self._avg_service_s = None  # EWMA of slot hold times
+
+        # Statistics
+        self._admitted = 0
+        self._rejected = 0
+        self._timed_out = 0
+
+    def retry_after(self):
+        # Roughly how long until the queue ahead of a new request drains
+        service = self._avg_service_s or 1.0
+        return max(1, math.ceil(service * (self._waiting + 1) / self.max_concurrent))
+
+    def acquire(self, deadline=None):
+        """
+        Takes one analysis slot and returns a token for release(). Raises
+        Overloaded when the wait queue is full, or when no slot frees up
+        before the queue timeout (or the request's own `deadline`).
+        """
+        with self._cond:
+            if self._active >= self.max_concurrent:
+                if self._waiting >= self.max_queue:
+                    self._rejected += 1
+                    raise Overloaded(self.retry_after())
+                limit = time.monotonic() + self.queue_timeout
+                if deadline is not None:
+                    limit = min(limit, deadline)
+                self._waiting += 1
+                try:
+                    while self._active >= self.max_concurrent:
+                        remaining = limit - time.monotonic()
+                        if remaining <= 0:
+                            self._timed_out += 1
+                            raise Overloaded(self.retry_after())
+                        self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+            self._active += 1
+            self._admitted += 1
+        return time.monotonic()
+
+    def release(self, token):
+        held = time.monotonic() - token
+        with self._cond:
+            self._active -= 1
+            self._avg_service_s = held if self._avg_service_s is None else 0.8 * self._avg_service_s + 0.2 * held
+            self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "active": self._active,
+                "waiting": self._waiting,
+                "max_concurrent": self.max_concurrent,
+                "max_queue": self.max_queue,
+                "admitted": self._admitted,
+                "rejected": self._rejected,
+                "timed_out": self._timed_out,
+                "avg_service_s": self._avg_service_s,
+            }
+
+
+# --------------------------
+# Per-frame cost estimate for deadlines
+# --------------------------
+class FrameCostEstimator:
+    """
+    EWMA of the wall time per analyzed frame (decode + inference) for each
+    model, used to size a request to the time it has left.
+    """
+    def __init__(self, initial=DEADLINE_INITIAL_FRAME_COST_S, alpha=0.2):
+        self.initial = initial
+        self.alpha = alpha
+        self._costs = {}
+        self._lock = threading.Lock()
+
+    def get(self, model_name):
+        with self._lock:
+            return self._costs.get(model_name, self.initial)
+
+    def update(self, model_name, seconds, frames):
+        if frames <= 0:
+            return
+        cost = seconds / frames
+        with self._lock:
+            old = self._costs.get(model_name)
+            self._costs[model_name] = cost if old is None else (1 - self.alpha) * old + self.alpha * cost
+
+    def stats(self):
+        with self._lock:
+            return dict(self._costs)
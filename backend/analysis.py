@@ -0,0 +1,103 @@
+# analysis.py
+# Scoring of one video, shared by the HTTP endpoints.
+import math
+import time
+
+from config import SAMPLE_EVERY_N_FRAMES, MAX_FRAMES, SAMPLING_MODE, EARLY_EXIT_BATCH
+from config import DEADLINE_MIN_FRAMES, DEADLINE_SAFETY
+from parallel_decode import iter_frames_parallel
+from pipeline import PipelineStats, stream_scored_batches
+from sequential import make_rule
+
+
+class VideoAnalysis:
+    """
+    Result of analyze_video: per-frame scores in video order, the sampled
+    frame indices they belong to and how many frames were decoded.
+    `degraded` is set when a deadline cut the analysis short.
+    """
+    def __init__(self):
+        self.indices = []
+        self.scores = []
+        self.frames_decoded = 0
+        self.settled = False
+        self.degraded = False
+        self.decode_seconds = 0.0
+        self.preprocess_seconds = 0.0
+
+    @property
+    def frames_used(self):
+        return len(self.scores)
+
+
+def frames_within(remaining_s, frame_cost_s, max_frames, min_frames=DEADLINE_MIN_FRAMES,
+                  safety=DEADLINE_SAFETY):
+    """
+    How many frames fit into `remaining_s` at `frame_cost_s` each (keeping a
+    safety margin), between min_frames and max_frames.
+    """
+    if frame_cost_s <= 0 or remaining_s == math.inf:
+        return max_frames
+    affordable = int(max(0.0, remaining_s) * safety / frame_cost_s)
+    return max(min(min_frames, max_frames), min(max_frames, affordable))
+
+
+def analyze_video(video_path, sched, early_exit=False, thumbnails=None, on_batch=None,
+                  every_n=SAMPLE_EVERY_N_FRAMES, max_frames=MAX_FRAMES, spread=None,
+                  deadline=None, frame_cost=None):
+    """
+    Runs the streaming decode -> preprocess -> inference pipeline over
+    video_path, scoring through `sched` (an InferenceScheduler).
+    With `early_exit`, frames are scored in EARLY_EXIT_BATCH batches and the
+    pipeline (decoding included) stops once the verdict is settled.
+    Scored frames are offered to `thumbnails` (a ThumbnailCollector), which
+    encodes the ones it keeps while later batches are still being scored.
+    `on_batch(batch, result)` is called after every scored batch.
+    With a `deadline` (time.monotonic()) and an estimated `frame_cost` in
+    seconds, fewer frames are sampled, spread over the whole video, when
+    the full MAX_FRAMES would not fit, and scoring stops before a batch that
+    would overrun it; either way the result is marked degraded.
+    """
+    det = sched.detector
+    if spread is None:
+        spread = SAMPLING_MODE == "spread"
+    rule = make_rule() if early_exit else None
+    stats = PipelineStats()
+    result = VideoAnalysis()
+    batch_size = EARLY_EXIT_BATCH if early_exit else det.batch_size
+
+    if deadline is not None and frame_cost:
+        affordable = frames_within(deadline - time.monotonic(), frame_cost, max_frames)
+        if affordable < max_frames:
+            # Fewer, sparser frames that still cover the whole video
+            max_frames, spread = affordable, True
+            result.degraded = True
+
+    # Long videos are decoded segment-parallel; runs lazily in the
+    # pipeline's decode thread
+    frame_source = iter_frames_parallel(video_path, every_n=every_n, max_frames=max_frames,
+                                        resize=det.input_size, spread=spread)
+    stream = stream_scored_batches(video_path, det, score_fn=sched.predict_preprocessed,
+                                   batch_size=batch_size, stats=stats, frame_source=frame_source)
+    try:
+        for batch in stream:
+            if thumbnails is not None:
+                thumbnails.add_batch(len(result.scores), batch.indices, batch.frames, batch.scores)
+            result.indices.extend(batch.indices)
+            result.scores.extend(batch.scores)
+            result.frames_decoded = stats.frames_decoded
+            if on_batch is not None:
+                on_batch(batch, result)
+            if rule is not None and rule.settled(result.scores):
+                result.settled = True
+                break
+            if deadline is not None and frame_cost and time.monotonic() + frame_cost * batch_size > deadline:
+                # The next batch would miss the deadline; return what we have
+                result.degraded = True
+                break
+    finally:
+        stream.close()
+    result.frames_decoded = stats.frames_decoded
+    result.decode_seconds = stats.decode_seconds
+    result.preprocess_seconds = stats.preprocess_seconds
+    return result
@@ -1,92 +1,693 @@
+# Heavy dependencies (torch, the engines, cv2) are imported on first use,
+# so the server answers /health right away while models load behind it.
+from startup import startup
+import math
 import os
-import uuid
+import time
 import traceback
-from flask import Flask, request, jsonify
+from contextlib import contextmanager
+from flask import Flask, request, jsonify, Response
 from flask_cors import CORS
+from werkzeug.exceptions import HTTPException
 from werkzeug.utils import secure_filename
-from config import UPLOAD_DIR, ALLOWED_EXTENSIONS, SAMPLE_EVERY_N_FRAMES, MAX_FRAMES, MODEL_NAMES, MODEL_PATHS
-from video_utils import allowed_file, sample_frames, frame_to_base64_bgr
-from detector import DeepfakeDetector
-import torch
+from config import ALLOWED_EXTENSIONS, SAMPLE_EVERY_N_FRAMES, MAX_FRAMES, MODEL_NAMES, MODEL_PATHS
+from config import SAMPLING_MODE
+from config import PRELOAD_MODELS, MODEL_MEMORY_BUDGET_MB, EARLY_EXIT
+from config import EARLY_EXIT_METHOD, EARLY_EXIT_DELTA, EARLY_EXIT_MIN_FRAMES, EARLY_EXIT_BATCH
+from config import RESULT_CACHE_ENABLED, RESULT_CACHE_DIR, RESULT_CACHE_MEMORY_ENTRIES, RESULT_CACHE_DISK_MB
+from config import ANALYZE_DEADLINE_S
+from config import ENSEMBLE_MODELS, ENSEMBLE_RULE, ENSEMBLE_WEIGHTS
+from config import BATCH_WORKERS, BATCH_ALLOWED_ROOT, BATCH_MANIFEST_DIR
+from config import THUMBNAIL_COUNT, THUMBNAIL_SELECTION, THUMBNAIL_FORMAT, THUMBNAIL_SIZE, THUMBNAIL_QUALITY, THUMBNAIL_MODE
+from video_utils import allowed_file, to_data_uri
+from analysis import analyze_video
+from model_loader import load_scheduler
+from registry import ModelRegistry
+from result_cache import ResultCache, checkpoint_version, make_key
+from uploads import UploadRequest, upload_to_disk, upload_reaper, release
+from thumbnails import ThumbnailCollector, ThumbnailStore
+from jobs import JobManager
+from streaming import STREAM_FORMATS, STREAM_MIMETYPES, EventStream
+from procstats import child_pids, memory_report, rss_only
+from admission import AdmissionController, FrameCostEstimator, Overloaded
+from metrics import metrics, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from metrics import (UPLOAD_SECONDS, DECODE_SECONDS, PREPROCESS_SECONDS, AGGREGATE_SECONDS, THUMBNAIL_SECONDS,
+                     REQUEST_SECONDS, FRAMES_DECODED, REQUESTS, IN_FLIGHT)
+from ensemble import ENSEMBLE_RULES, analyze_ensemble
+from batch import RunManifest, file_key, file_sha256, resolve_under, run_batch
+startup.record("imports", startup.elapsed())
 
 
 app = Flask(__name__)
+app.request_class = UploadRequest
 CORS(app)
 app.config['MAX_CONTENT_LENGTH'] = 2 * 1024 * 1024 * 1024  # 2GB max upload
 
-# Lazy load detectors dictionary for all models
-detectors = {}
+# Detectors are loaded once per model and wrapped in a micro-batching
+# scheduler; the registry evicts least recently used models when
+# MODEL_MEMORY_BUDGET_MB is exceeded.
+registry = ModelRegistry(
+    # The checkpoint version is taken before loading, so a file replaced
+    # mid-load is picked up on the next load rather than mislabelled
+    loader=lambda name: load_scheduler(name, version=model_version(name)),
+    size_of=lambda sched: sched.detector.memory_bytes(),
+    memory_budget_bytes=MODEL_MEMORY_BUDGET_MB * 1024 * 1024,
+    on_evict=lambda sched: sched.close(),
+)
+
+def get_scheduler(model_name):
+    if model_name not in MODEL_PATHS:
+        raise ValueError(f"Unknown model '{model_name}'. Available: {MODEL_NAMES}")
+    return registry.get(model_name)
 
 def get_detector(model_name):
-    global detectors
-    if model_name not in detectors:
-        if model_name not in MODEL_PATHS:
-            raise ValueError(f"Unknown model '{model_name}'. Available: {MODEL_NAMES}")
-        detectors[model_name] = DeepfakeDetector(
-            model_path=MODEL_PATHS[model_name]["path"], 
-            device="cuda" if torch.cuda.is_available() else "cpu"
-        )
-    return detectors[model_name]
+    return get_scheduler(model_name).detector
+
+
+# Finished /analyze responses, keyed by upload hash, model, checkpoint
+# version and sampling parameters
+result_cache = ResultCache(RESULT_CACHE_DIR, RESULT_CACHE_MEMORY_ENTRIES,
+                           RESULT_CACHE_DISK_MB * 1024 * 1024) if RESULT_CACHE_ENABLED else None
+
+def model_version(model_name):
+    cfg = MODEL_PATHS[model_name]
+    engine = cfg.get("engine", "torch")
+    path = cfg["onnx_path"] if engine == "onnx" else cfg["path"]
+    return f'{engine}:{cfg.get("runtime", "eager")}:{checkpoint_version(path)}'
+
+def served_version(model_name):
+    """
+    Version of the weights that will answer a request: the loaded model's
+    (recorded when the registry loaded it), else the checkpoint on disk,
+    which is what a load would pick up. Results are cached under this, so a
+    checkpoint replaced on disk does not relabel a stale model's results.
+    """
+    sched = registry.peek(model_name)
+    return sched.version if sched is not None else model_version(model_name)
+
+def analysis_cache_key(upload_hash, model_name, version, early_exit):
+    early_exit_params = (EARLY_EXIT_METHOD, EARLY_EXIT_DELTA, EARLY_EXIT_MIN_FRAMES, EARLY_EXIT_BATCH) if early_exit else None
+    return make_key(upload_hash, model_name, version,
+                    every_n=SAMPLE_EVERY_N_FRAMES, max_frames=MAX_FRAMES,
+                    sampling=SAMPLING_MODE, early_exit=early_exit_params,
+                    thumbnails=(THUMBNAIL_COUNT, THUMBNAIL_SELECTION, THUMBNAIL_FORMAT,
+                                tuple(THUMBNAIL_SIZE), THUMBNAIL_QUALITY, THUMBNAIL_MODE))
+
+
+# Encoded thumbnails behind /thumbnails/<id> (THUMBNAIL_MODE "url")
+thumbnail_store = ThumbnailStore()
+
+def thumbnail_entries(collector):
+    entries = []
+    for t in collector.results():
+        entry = {"index": t["index"], "frame_index": t["frame_index"], "score": t["score"]}
+        if THUMBNAIL_MODE == "url":
+            entry["url"] = f'/thumbnails/{thumbnail_store.put(t["data"], t["format"])}'
+        else:
+            entry["img_b64"] = to_data_uri(t["data"], t["format"])
+        entries.append(entry)
+    return entries
+
+def cached_result(cache_key):
+    """
+    Cached response under cache_key, or None. In "url" mode a response
+    whose thumbnails were evicted from the store is treated as a miss, so
+    the analysis runs again and re-creates them.
+    """
+    cached = result_cache.get(cache_key)
+    if cached is not None and THUMBNAIL_MODE == "url" and \
+            not all(thumbnail_store.contains(t["url"].rsplit("/", 1)[1]) for t in cached["thumbnails"]):
+        return None
+    return cached
+
+
+# Concurrency cap for the synchronous endpoints, and per-model frame cost
+# estimates for sizing requests to their deadline
+admission = AdmissionController()
+frame_costs = FrameCostEstimator()
+
+def run_analysis(saved_path, upload_hash, model_name, early_exit, on_batch=None, deadline=None):
+    """
+    Analyzes an upload already on disk and returns the /analyze response
+    (without filename) and whether it came from the result cache, or
+    (None, False) if no frames could be extracted. With a `deadline`
+    (time.monotonic()), the analysis is cut down to fit and marked
+    "degraded"; degraded results are not cached.
+    """
+    # Same video, model, checkpoint and parameters -> stored response
+    cache_key = None
+    if result_cache is not None:
+        cache_key = analysis_cache_key(upload_hash, model_name, served_version(model_name), early_exit)
+        cached = cached_result(cache_key)
+        if cached is not None:
+            return dict(cached, degraded=False), True
+
+    # Decode, preprocess and score as a pipeline; frames are sampled
+    # straight at the model input size
+    sched = get_scheduler(model_name)
+    det = sched.detector
+    if cache_key is not None:
+        # Store under the version of the model that actually ran
+        cache_key = analysis_cache_key(upload_hash, model_name, sched.version, early_exit)
+    collector = ThumbnailCollector()
+    t0 = time.monotonic()
+    result = analyze_video(saved_path, sched, early_exit=early_exit, thumbnails=collector, on_batch=on_batch,
+                           deadline=deadline, frame_cost=frame_costs.get(model_name))
+    frame_costs.update(model_name, time.monotonic() - t0, result.frames_used)
+    DECODE_SECONDS.observe(result.decode_seconds, model_name)
+    PREPROCESS_SECONDS.observe(result.preprocess_seconds, model_name)
+    FRAMES_DECODED.inc(result.frames_decoded, model_name)
+    if not result.scores:
+        return None, False
+    scores = result.scores
+    t0 = time.perf_counter()
+    agg = det.aggregate(scores)
+    AGGREGATE_SECONDS.observe(time.perf_counter() - t0, model_name)
+
+    # Compact JPEG/WebP thumbnails of the top-scoring (or first) frames,
+    # encoded in the background while the video was being scored
+    thumbnails = thumbnail_entries(collector)
+    THUMBNAIL_SECONDS.observe(collector.encode_seconds, model_name)
+
+    response = {
+        "model_used": model_name,
+        "num_frames": result.frames_decoded,
+        "frames_used": result.frames_used,
+        "early_exit": result.settled,
+        "degraded": result.degraded,
+        "frame_scores": scores,
+        "aggregate": agg,
+        "thumbnails": thumbnails
+    }
+    if cache_key is not None and not result.degraded:
+        result_cache.put(cache_key, response)
+    return response, False
+
+
+@contextmanager
+def track_request(endpoint, model_name, started=None):
+    """
+    Counts an analysis as in flight and records its total time and outcome;
+    the body may set outcome["status"] (default "ok", "error" on exceptions).
+    """
+    started = started if started is not None else time.perf_counter()
+    outcome = {"status": "ok"}
+    IN_FLIGHT.inc(1, endpoint)
+    try:
+        yield outcome
+    except Exception:
+        outcome["status"] = "error"
+        raise
+    finally:
+        IN_FLIGHT.dec(1, endpoint)
+        REQUEST_SECONDS.observe(time.perf_counter() - started, model_name, endpoint)
+        REQUESTS.inc(1, model_name, endpoint, outcome["status"])
+
+
+def request_deadline(arrived, read_form=True):
+    """
+    Absolute deadline (time.monotonic()) from the "deadline_s" query/form
+    field or ANALYZE_DEADLINE_S, or None. Reading the form parses the upload,
+    so admission only looks at the query string.
+    """
+    value = request.args.get("deadline_s")
+    if value is None and read_form:
+        value = request.form.get("deadline_s")
+    budget = float(value) if value else ANALYZE_DEADLINE_S
+    if value and not (math.isfinite(budget) and budget > 0):
+        # float() also accepts "inf" and "nan"
+        raise ValueError(f"invalid deadline_s {value!r}")
+    return arrived + budget if budget else None
+
+
+def overloaded_response(e):
+    return jsonify({"error": str(e), "retry_after": e.retry_after}), 429, {"Retry-After": str(e.retry_after)}
+
+
+def http_error_response(e):
+    # e.g. 413/507 raised while the upload streams to disk, which would
+    # otherwise end up as a 500 in the handlers' catch-all
+    return jsonify({"error": e.description}), e.code
+
+
+def form_flag(name, default):
+    value = request.form.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
 
 
 @app.route("/health", methods=["GET"])
 def health():
-    return jsonify({"status": "ok"}), 200
+    if not registry.is_ready():
+        return jsonify({"status": "warming", "models_loaded": registry.stats()["loaded"]}), 503
+    return jsonify({
+        "status": "ok",
+        "models_loaded": registry.stats()["loaded"],
+        "preload_errors": registry.preload_errors,
+    }), 200
+
+@app.route("/stats/startup", methods=["GET"])
+def startup_stats():
+    return jsonify(startup.stats()), 200
+
+@app.route("/stats/scheduler", methods=["GET"])
+def scheduler_stats():
+    return jsonify({name: s.stats() for name, s in registry.loaded()}), 200
+
+@app.route("/stats/models", methods=["GET"])
+def model_stats():
+    return jsonify(registry.stats()), 200
+
+@app.route("/stats/uploads", methods=["GET"])
+def upload_stats():
+    return jsonify(upload_reaper.stats()), 200
+
+# --------------------------
+# Prometheus metrics
+# --------------------------
+metrics.gauge("deepfake_scheduler_queue_depth", "Frames waiting in a model's inference queue.", ["model_name"],
+              collect=lambda: [((name,), s.stats()["queue_depth"]) for name, s in registry.loaded()])
+metrics.gauge("deepfake_models_loaded", "Detectors currently loaded.",
+              collect=lambda: [((), len(registry.loaded()))])
+metrics.gauge("deepfake_model_memory_bytes", "Approximate memory of a loaded model.", ["model_name"],
+              collect=lambda: [((name,), nbytes) for name, nbytes in registry.sizes().items()])
+metrics.gauge("deepfake_jobs", "Background jobs by state.", ["state"],
+              collect=lambda: [((state,), n) for state, n in job_manager.stats()["jobs"].items()])
+metrics.gauge("process_resident_memory_bytes", "Resident memory size of this process.",
+              collect=lambda: [((), (rss_only() or {}).get("rss_bytes", 0))])
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    return Response(metrics.render(), content_type=METRICS_CONTENT_TYPE)
+
+@app.route("/stats/memory", methods=["GET"])
+def memory_stats():
+    # Under serve.py: the master and all of its workers
+    master = int(os.environ.get("SERVE_MASTER_PID", 0))
+    pids = [master] + child_pids(master) if master else [os.getpid()]
+    return jsonify(dict(memory_report(pids), pid=os.getpid())), 200
+
+@app.route("/stats/admission", methods=["GET"])
+def admission_stats():
+    return jsonify(dict(admission.stats(), frame_cost_s=frame_costs.stats())), 200
+
+@app.route("/stats/cache", methods=["GET"])
+def cache_stats():
+    return jsonify(result_cache.stats() if result_cache else {"enabled": False}), 200
+
+@app.route("/stats/thumbnails", methods=["GET"])
+def thumbnail_stats():
+    return jsonify(thumbnail_store.stats()), 200
+
+@app.route("/thumbnails/<thumb_id>", methods=["GET"])
+def thumbnail(thumb_id):
+    item = thumbnail_store.get(thumb_id)
+    if item is None:
+        return jsonify({"error": "unknown or expired thumbnail"}), 404
+    data, mime = item
+    # Ids are content hashes, so the bytes behind a URL never change
+    return Response(data, mimetype=mime, headers={"Cache-Control": "public, max-age=31536000, immutable"})
+
+def validate_upload():
+    """
+    Checks the uploaded file and the requested model; returns
+    (file, model_name, None) or (None, None, error response).
+    """
+    if 'file' not in request.files:
+        return None, None, (jsonify({"error": "no file part"}), 400)
+
+    file = request.files['file']
+    if file.filename == '':
+        return None, None, (jsonify({"error": "no selected file"}), 400)
+
+    if not allowed_file(file.filename, ALLOWED_EXTENSIONS):
+        return None, None, (jsonify({"error": f"allowed extensions: {ALLOWED_EXTENSIONS}"}), 400)
+
+    # Get selected model from request form, default to first model
+    model_name = request.form.get("model_name", MODEL_NAMES[0])
+    if model_name not in MODEL_PATHS:
+        return None, None, (jsonify({"error": f"Unknown model '{model_name}'. Available: {MODEL_NAMES}"}), 400)
+    return file, model_name, None
+
 
 @app.route("/analyze", methods=["POST"])
 def analyze():
+    arrived = time.monotonic()
     try:
-        if 'file' not in request.files:
-            return jsonify({"error": "no file part"}), 400
+        # Turn requests away before their upload is read
+        token = admission.acquire(request_deadline(arrived, read_form=False))
+    except Overloaded as e:
+        return overloaded_response(e)
+    except ValueError:
+        return jsonify({"error": "deadline_s must be a positive number of seconds"}), 400
+
+    try:
+        started = time.perf_counter()
+        file, model_name, error = validate_upload()
+        if error is not None:
+            return error
+        early_exit = form_flag("early_exit", EARLY_EXIT)
+        try:
+            deadline = request_deadline(arrived)
+        except ValueError:
+            return jsonify({"error": "deadline_s must be a positive number of seconds"}), 400
+
+        with track_request("analyze", model_name, started) as outcome:
+            # Already streamed to UPLOAD_DIR and hashed by UploadRequest; the
+            # file is deleted when the request finishes
+            filename = secure_filename(file.filename)
+            saved_path, upload_hash, _ = upload_to_disk(file)
+            UPLOAD_SECONDS.observe(time.perf_counter() - started, model_name)
+
+            response, cached = run_analysis(saved_path, upload_hash, model_name, early_exit, deadline=deadline)
+            if response is None:
+                outcome["status"] = "no_frames"
+                return jsonify({"error": "no frames extracted"}), 400
+            outcome["status"] = "cached" if cached else ("degraded" if response["degraded"] else "ok")
+            return jsonify(dict(response, filename=filename, cached=cached)), 200
+
+    except HTTPException as e:
+        return http_error_response(e)
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
+    finally:
+        admission.release(token)
 
-        file = request.files['file']
-        if file.filename == '':
-            return jsonify({"error": "no selected file"}), 400
 
+@app.route("/analyze/stream", methods=["POST"])
+def analyze_stream():
+    """
+    Same analysis as /analyze, streamed: a "batch" event per scored batch
+    (sampled frame indices, their scores and the running aggregate), then a
+    "result" event with the /analyze payload. SSE by default, NDJSON with
+    format=ndjson. Admission and deadlines work as for /analyze; the slot
+    is held until the stream ends.
+    """
+    arrived = time.monotonic()
+    try:
+        token = admission.acquire(request_deadline(arrived, read_form=False))
+    except Overloaded as e:
+        return overloaded_response(e)
+    except ValueError:
+        return jsonify({"error": "deadline_s must be a positive number of seconds"}), 400
+
+    try:
+        file, model_name, error = validate_upload()
+        if error is not None:
+            admission.release(token)
+            return error
+        fmt = request.values.get("format", "sse").lower()
+        if fmt not in STREAM_FORMATS:
+            admission.release(token)
+            return jsonify({"error": f"Unknown format '{fmt}'. Available: {STREAM_FORMATS}"}), 400
+        early_exit = form_flag("early_exit", EARLY_EXIT)
+        try:
+            deadline = request_deadline(arrived)
+        except ValueError:
+            admission.release(token)
+            return jsonify({"error": "deadline_s must be a positive number of seconds"}), 400
+        filename = secure_filename(file.filename)
+        saved_path, upload_hash, _ = upload_to_disk(file)
+        # The response outlives the request handler; the producer releases
+        # the upload (and the admission slot) when it is done
+        file.stream.detach()
+    except HTTPException as e:
+        admission.release(token)
+        return http_error_response(e)
+    except Exception as e:
+        admission.release(token)
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
+
+    def produce(emit):
+        try:
+            det = get_detector(model_name)
+
+            def on_batch(batch, result):
+                emit("batch", {
+                    "indices": batch.indices,
+                    "scores": batch.scores,
+                    "frames_decoded": result.frames_decoded,
+                    "frames_scored": result.frames_used,
+                    "aggregate": det.aggregate(result.scores),
+                })
+
+            with track_request("analyze_stream", model_name) as outcome:
+                response, cached = run_analysis(saved_path, upload_hash, model_name, early_exit,
+                                                on_batch=on_batch, deadline=deadline)
+                if response is None:
+                    outcome["status"] = "no_frames"
+                    emit("error", {"error": "no frames extracted"})
+                    return
+                outcome["status"] = "cached" if cached else ("degraded" if response["degraded"] else "ok")
+                emit("result", dict(response, filename=filename, cached=cached))
+        finally:
+            release(saved_path)
+            admission.release(token)
+
+    return Response(EventStream(produce, fmt), mimetype=STREAM_MIMETYPES[fmt],
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.route("/analyze_ensemble", methods=["POST"])
+def analyze_ensemble_route():
+    """
+    Scores one upload with several models ("models", comma separated,
+    default ENSEMBLE_MODELS) from a single decode and returns per-model and
+    combined scores and aggregates ("rule": weighted_mean, max or vote;
+    weights from ENSEMBLE_WEIGHTS).
+    """
+    try:
+        token = admission.acquire(request_deadline(time.monotonic(), read_form=False))
+    except Overloaded as e:
+        return overloaded_response(e)
+    except ValueError:
+        return jsonify({"error": "deadline_s must be a positive number of seconds"}), 400
+
+    try:
+        if 'file' not in request.files or request.files['file'].filename == '':
+            return jsonify({"error": "no file part"}), 400
+        file = request.files['file']
         if not allowed_file(file.filename, ALLOWED_EXTENSIONS):
             return jsonify({"error": f"allowed extensions: {ALLOWED_EXTENSIONS}"}), 400
+        names = [n.strip() for n in request.form.get("models", ",".join(ENSEMBLE_MODELS)).split(",") if n.strip()]
+        unknown = [n for n in names if n not in MODEL_PATHS]
+        if not names or unknown:
+            return jsonify({"error": f"Unknown models {unknown}. Available: {MODEL_NAMES}"}), 400
+        names = list(dict.fromkeys(names))
+        rule = request.form.get("rule", ENSEMBLE_RULE)
+        if rule not in ENSEMBLE_RULES:
+            return jsonify({"error": f"Unknown rule '{rule}'. Available: {ENSEMBLE_RULES}"}), 400
+        weights = {n: ENSEMBLE_WEIGHTS.get(n, 1.0) for n in names}
+
+        filename = secure_filename(file.filename)
+        saved_path, upload_hash, _ = upload_to_disk(file)
+        label = "+".join(names)
+
+        def ensemble_cache_key(versions):
+            return make_key(upload_hash, f"ensemble:{label}", ",".join(versions),
+                            rule=rule, weights=sorted(weights.items()),
+                            every_n=SAMPLE_EVERY_N_FRAMES, max_frames=MAX_FRAMES, sampling=SAMPLING_MODE,
+                            thumbnails=(THUMBNAIL_COUNT, THUMBNAIL_SELECTION, THUMBNAIL_FORMAT,
+                                        tuple(THUMBNAIL_SIZE), THUMBNAIL_QUALITY, THUMBNAIL_MODE))
 
-        # Get selected model from request form, default to first model
+        cache_key = None
+        if result_cache is not None:
+            cache_key = ensemble_cache_key(served_version(n) for n in names)
+            cached = cached_result(cache_key)
+            if cached is not None:
+                return jsonify(dict(cached, filename=filename, cached=True)), 200
+
+        with track_request("analyze_ensemble", label) as outcome:
+            scheds = {n: get_scheduler(n) for n in names}
+            if cache_key is not None:
+                cache_key = ensemble_cache_key(scheds[n].version for n in names)
+            collector = ThumbnailCollector()
+            result = analyze_ensemble(saved_path, scheds, weights=weights, rule=rule, thumbnails=collector)
+            DECODE_SECONDS.observe(result.decode_seconds, label)
+            PREPROCESS_SECONDS.observe(result.preprocess_seconds, label)
+            FRAMES_DECODED.inc(result.frames_decoded, label)
+            if not result.combined:
+                outcome["status"] = "no_frames"
+                return jsonify({"error": "no frames extracted"}), 400
+
+            aggregate = scheds[names[0]].aggregate
+            response = {
+                "models_used": names,
+                "rule": rule,
+                "weights": weights,
+                "num_frames": result.frames_decoded,
+                "frames_used": result.frames_used,
+                "frame_indices": result.indices,
+                "frame_scores": result.combined,
+                "aggregate": aggregate(result.combined),
+                "per_model": {n: {"frame_scores": result.per_model[n], "aggregate": aggregate(result.per_model[n])}
+                              for n in names},
+                "thumbnails": thumbnail_entries(collector),
+            }
+            if cache_key is not None:
+                result_cache.put(cache_key, response)
+            return jsonify(dict(response, filename=filename, cached=False)), 200
+
+    except HTTPException as e:
+        return http_error_response(e)
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
+    finally:
+        admission.release(token)
+
+
+@app.route("/analyze_batch", methods=["POST"])
+def analyze_batch():
+    """
+    Analyzes several uploaded files ("files") and/or server-side paths under
+    BATCH_ALLOWED_ROOT ("paths") and streams one JSON line per video as it
+    finishes, then a "summary" line. With a "run_id", finished videos are
+    recorded in a manifest and skipped when the same run is posted again.
+    The whole batch holds one admission slot until the stream ends.
+    """
+    try:
+        token = admission.acquire(request_deadline(time.monotonic(), read_form=False))
+    except Overloaded as e:
+        return overloaded_response(e)
+    except ValueError:
+        return jsonify({"error": "deadline_s must be a positive number of seconds"}), 400
+
+    handed_off = False  # the producer releases the slot from here on
+    try:
         model_name = request.form.get("model_name", MODEL_NAMES[0])
+        if model_name not in MODEL_PATHS:
+            return jsonify({"error": f"Unknown model '{model_name}'. Available: {MODEL_NAMES}"}), 400
+        early_exit = form_flag("early_exit", EARLY_EXIT)
+        fmt = request.values.get("format", "ndjson").lower()
+        if fmt not in STREAM_FORMATS:
+            return jsonify({"error": f"Unknown format '{fmt}'. Available: {STREAM_FORMATS}"}), 400
 
-        filename = secure_filename(file.filename)
-        uid = str(uuid.uuid4())[:8]
-        saved_name = f"{uid}_{filename}"
-        saved_path = os.path.join(UPLOAD_DIR, saved_name)
-        file.save(saved_path)
-
-        # Sample frames
-        frames = sample_frames(saved_path, every_n=SAMPLE_EVERY_N_FRAMES, max_frames=MAX_FRAMES, resize=(256,256))
-        if not frames:
-            return jsonify({"error": "no frames extracted"}), 400
-
-        # Get detector for the chosen model
-        det = get_detector(model_name)
-        scores = det.predict_frames(frames)
-        agg = det.aggregate(scores)
-
-        # Prepare sample thumbnails (first 6 frames)
-        thumbnails = []
-        for i, f in enumerate(frames[:6]):
-            thumbnails.append({
-                "index": i,
-                "img_b64": frame_to_base64_bgr(f),
-                "score": scores[i] if i < len(scores) else None
-            })
-
-        response = {
-            "filename": filename,
-            "model_used": model_name,
-            "num_frames": len(frames),
-            "frame_scores": scores,
-            "aggregate": agg,
-            "thumbnails": thumbnails
-        }
-        return jsonify(response), 200
+        items = []
+        for path in request.values.getlist("paths"):
+            full = resolve_under(BATCH_ALLOWED_ROOT, path) if BATCH_ALLOWED_ROOT else None
+            if full is None or not os.path.isfile(full) or not allowed_file(full, ALLOWED_EXTENSIONS):
+                return jsonify({"error": f"path not allowed: {path}"}), 400
+            items.append({"key": file_key(full), "name": path, "path": full, "hash": None})
+        for file in request.files.getlist("files"):
+            if file.filename == '' or not allowed_file(file.filename, ALLOWED_EXTENSIONS):
+                return jsonify({"error": f"allowed extensions: {ALLOWED_EXTENSIONS}"}), 400
+            saved_path, upload_hash, _ = upload_to_disk(file)
+            items.append({"key": upload_hash, "name": secure_filename(file.filename),
+                          "path": saved_path, "hash": upload_hash, "upload": file.stream})
+        if not items:
+            return jsonify({"error": "no files or paths given"}), 400
+
+        manifest = None
+        run_id = secure_filename(request.values.get("run_id", ""))
+        if run_id:
+            os.makedirs(BATCH_MANIFEST_DIR, exist_ok=True)
+            manifest = RunManifest(os.path.join(BATCH_MANIFEST_DIR, f"{run_id}.{model_name}.jsonl"))
+
+        # Uploads are processed after this handler returns; released below
+        for item in items:
+            if "upload" in item:
+                item.pop("upload").detach()
+        handed_off = True
+    except HTTPException as e:
+        return http_error_response(e)
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
+    finally:
+        if not handed_off:
+            admission.release(token)
+
+    def analyze_item(item):
+        upload_hash = item["hash"] or file_sha256(item["path"])
+        response, cached = run_analysis(item["path"], upload_hash, model_name, early_exit)
+        if response is None:
+            raise ValueError("no frames extracted")
+        return dict(response, filename=item["name"], cached=cached)
 
+    def produce(emit):
+        try:
+            counts = run_batch(items, analyze_item, lambda record: emit("video", record),
+                               workers=BATCH_WORKERS, manifest=manifest)
+            emit("summary", {"model_used": model_name, "videos": len(items), **counts})
+        finally:
+            for item in items:
+                if item["hash"] is not None:
+                    release(item["path"])
+            admission.release(token)
+
+    return Response(EventStream(produce, fmt), mimetype=STREAM_MIMETYPES[fmt],
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+# --------------------------
+# Asynchronous jobs
+# --------------------------
+job_manager = JobManager()
+
+@app.route("/jobs", methods=["POST"])
+def submit_job():
+    try:
+        file, model_name, error = validate_upload()
+        if error is not None:
+            return error
+        early_exit = form_flag("early_exit", EARLY_EXIT)
+        filename = secure_filename(file.filename)
+        saved_path, upload_hash, _ = upload_to_disk(file)
+        # Keep the upload past this request; the job releases it when done
+        file.stream.detach()
+    except HTTPException as e:
+        return http_error_response(e)
     except Exception as e:
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
 
+    def run(job):
+        def on_batch(batch, result):
+            job.update(frames_decoded=result.frames_decoded, frames_scored=result.frames_used)
+            job.check_cancelled()
+
+        with track_request("jobs", model_name) as outcome:
+            response, cached = run_analysis(saved_path, upload_hash, model_name, early_exit, on_batch=on_batch)
+            outcome["status"] = "cached" if cached else "ok"
+        if response is None:
+            raise ValueError("no frames extracted")
+        job.update(frames_decoded=response["num_frames"], frames_scored=response["frames_used"])
+        return dict(response, filename=filename, cached=cached)
+
+    job = job_manager.submit(run, meta={"filename": filename, "model_name": model_name},
+                             on_finish=lambda job: release(saved_path))
+    return jsonify({"job_id": job.id, "state": job.state, "status_url": f"/jobs/{job.id}"}), 202
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def job_status(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": "unknown or expired job"}), 404
+    return jsonify(job), 200
+
+@app.route("/jobs/<job_id>", methods=["DELETE"])
+def cancel_job(job_id):
+    job = job_manager.cancel(job_id)
+    if job is None:
+        return jsonify({"error": "unknown or expired job"}), 404
+    return jsonify(job), 200
+
+@app.route("/stats/jobs", methods=["GET"])
+def job_stats():
+    return jsonify(job_manager.stats()), 200
+
+startup.mark("app_initialized")
+
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=8000, debug=True)
+    debug = True
+    # Load and warm up configured models in the background; /health
+    # answers 503 until they are ready. With the reloader only the child
+    # process (WERKZEUG_RUN_MAIN) serves requests.
+    if not debug or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        registry.preload_async(PRELOAD_MODELS, on_done=lambda: startup.mark("models_ready"))
+        upload_reaper.start()
+    app.run(host="0.0.0.0", port=8000, debug=debug)
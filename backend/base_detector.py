@@ -0,0 +1,145 @@
+# base_detector.py
+# Engine-independent part of the detectors: preprocessing, batching and
+# aggregation. Kept free of torch so that non-PyTorch engines
+# (onnx_detector.py) do not need it in the request path.
+import threading
+import numpy as np
+from typing import List
+
+from config import BATCH_SIZE
+
+
+# --------------------------
+# Preprocessing helpers
+# --------------------------
+def preprocess_frames_into(frames, out, target_size=(224,224), scratch=None, normalize=None):
+    """
+    Fused BGR uint8 -> normalized RGB float32 NCHW preprocessing.
+    Writes len(frames) samples into the preallocated `out` buffer of shape
+    (N,3,H,W) and returns the filled view out[:len(frames)].
+    Frames that already have the target size are not resized again.
+    `normalize` is an optional (mean, std) pair of per-channel RGB values
+    applied after scaling to 0..1.
+    """
+    import cv2
+    w, h = target_size
+    if scratch is None:
+        scratch = np.empty((h, w, 3), dtype=np.uint8)
+    for i, f in enumerate(frames):
+        src = f if f.shape[:2] == (h, w) else cv2.resize(f, target_size, dst=scratch)
+        # BGR->RGB and HWC->CHW are views; this assignment is the only copy
+        out[i] = src[:, :, ::-1].transpose(2, 0, 1)
+    batch = out[:len(frames)]
+    np.divide(batch, 255.0, out=batch)
+    if normalize is not None:
+        mean, std = normalize
+        batch -= np.asarray(mean, dtype=np.float32).reshape(1, 3, 1, 1)
+        batch /= np.asarray(std, dtype=np.float32).reshape(1, 3, 1, 1)
+    return batch
+
+
+class FrameBuffer:
+    """
+    Reusable float32 NCHW batch buffer plus a uint8 resize scratch image.
+    """
+    def __init__(self, batch_size, target_size=(224,224), normalize=None):
+        w, h = target_size
+        self.target_size = target_size
+        self.normalize = normalize
+        self.batch = np.empty((batch_size, 3, h, w), dtype=np.float32)
+        self.scratch = np.empty((h, w, 3), dtype=np.uint8)
+
+    def fill(self, frames):
+        return preprocess_frames_into(frames, self.batch, self.target_size, self.scratch, self.normalize)
+
+
+# --------------------------
+# BaseDetector class
+# --------------------------
+class BaseDetector:
+    """
+    Batching and aggregation shared by all detector engines. Subclasses set
+    `model_path` and `num_outputs` and implement score_batch().
+    """
+    def __init__(self, batch_size=BATCH_SIZE, input_size=(224,224), normalize=None):
+        self.batch_size = max(1, int(batch_size))
+        self.input_size = tuple(input_size)
+        self.normalize = normalize
+        self._local = threading.local()
+
+    def frame_buffer(self, batch_size=None) -> FrameBuffer:
+        """
+        Per-thread preprocessing buffer, reallocated only when a larger
+        batch is requested.
+        """
+        batch_size = batch_size or self.batch_size
+        buf = getattr(self._local, "buffer", None)
+        if buf is None or buf.batch.shape[0] < batch_size:
+            buf = FrameBuffer(batch_size, self.input_size, self.normalize)
+            self._local.buffer = buf
+        return buf
+
+    def memory_bytes(self) -> int:
+        return 0
+
+    def warmup(self, iterations=1):
+        """
+        Runs full-size dummy batches so the first real request does not pay
+        for lazy allocations and kernel selection.
+        """
+        w, h = self.input_size
+        dummy = [np.zeros((h, w, 3), dtype=np.uint8)] * self.batch_size
+        for _ in range(iterations):
+            self.predict_frames(dummy)
+
+    # --------------------------
+    # Predict frames
+    # --------------------------
+    def score_batch(self, batch: np.ndarray):
+        """
+        Scores one preprocessed NCHW float32 batch. Returns per-frame "fake"
+        probabilities in whatever container the engine produces; they are
+        only moved to the host in collect_scores().
+        """
+        raise NotImplementedError
+
+    def collect_scores(self, outputs) -> List[float]:
+        return np.concatenate(outputs).astype(np.float32).tolist()
+
+    def predict_frames(self, frames: List[np.ndarray], batch_size=None) -> List[float]:
+        """
+        Predict deepfake scores for a list of BGR frames.
+        Frames are scored in NCHW batches of `batch_size` (defaults to
+        self.batch_size) and copied back to the host once at the end.
+        Returns list of float scores per frame (0..1).
+        """
+        if len(frames) == 0:
+            return []
+        batch_size = max(1, int(batch_size or self.batch_size))
+
+        buf = self.frame_buffer(batch_size)
+        outputs = []
+        for start in range(0, len(frames), batch_size):
+            outputs.append(self.score_batch(buf.fill(frames[start:start + batch_size])))
+        return self.collect_scores(outputs)
+
+    def predict_preprocessed(self, batch: np.ndarray) -> List[float]:
+        """
+        Scores an already preprocessed NCHW float32 batch in one forward pass.
+        """
+        if len(batch) == 0:
+            return []
+        return self.collect_scores([self.score_batch(batch)])
+
+    # --------------------------
+    # Aggregate scores
+    # --------------------------
+    def aggregate(self, scores: List[float]) -> dict:
+        """
+        Aggregate frame-level predictions to video-level metrics.
+        """
+        arr = np.array(scores)
+        mean_score = float(np.mean(arr)) if arr.size > 0 else 0.0
+        median_score = float(np.median(arr)) if arr.size > 0 else 0.0
+        majority_ratio = float((arr > 0.5).sum() / arr.size) if arr.size > 0 else 0.0
+        return {"mean": mean_score, "median": median_score, "majority_ratio": majority_ratio}
@@ -0,0 +1,170 @@
+# batch.py
+# Bulk analysis shared by /analyze_batch and batch_analyze.py: videos are
+# spread over a thread pool, every worker scores through the same
+# InferenceScheduler (so frames of different videos share inference
+# batches), results are emitted as soon as each video is done, and a
+# JSON Lines manifest records finished videos so an interrupted run can be
+# resumed.
+import hashlib
+import json
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from config import BATCH_WORKERS, ALLOWED_EXTENSIONS
+from analysis import analyze_video
+from video_utils import allowed_file
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_key(path):
+    """
+    Manifest key of a video on disk: its absolute path plus size and mtime,
+    so a file that changed since the last run is analyzed again.
+    """
+    st = os.stat(path)
+    return f"{os.path.abspath(path)}:{st.st_size}:{st.st_mtime_ns}"
+
+
+def collect_videos(paths, allowed_ext=ALLOWED_EXTENSIONS):
+    """
+    Video files among `paths`, directories expanded recursively, in a
+    stable order.
+    """
+    videos = []
+    for p in paths:
+        if os.path.isdir(p):
+            for root, dirs, files in os.walk(p):
+                dirs.sort()
+                videos.extend(os.path.join(root, f) for f in sorted(files) if allowed_file(f, allowed_ext))
+        elif os.path.isfile(p) and allowed_file(p, allowed_ext):
+            videos.append(p)
+    return videos
+
+
+def resolve_under(root, path):
+    """
+    Absolute path of `path` (relative to `root` or absolute) if it lies
+    inside `root`, else None.
+    """
+    root = os.path.realpath(root)
+    full = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([root, full]) != root:
+        return None
+    return full
+
+
+def summarize_video(video_path, sched, early_exit=False):
+    """
+    Scores and aggregate of one video, without thumbnails.
+    """
+    result = analyze_video(video_path, sched, early_exit=early_exit)
+    if not result.scores:
+        raise ValueError("no frames extracted")
+    return {
+        "num_frames": result.frames_decoded,
+        "frames_used": result.frames_used,
+        "early_exit": result.settled,
+        "frame_scores": result.scores,
+        "aggregate": sched.aggregate(result.scores),
+    }
+
+
+# --------------------------
+# Resume manifest
+# --------------------------
+class RunManifest:
+    """
+    Append-only JSON Lines file of {"key", "status"} records. Keys recorded
+    as "done" are skipped when the run is started again; failed ones are
+    retried.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._done = set()
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        continue  # torn last line of an interrupted run
+                    if rec.get("status") == "done":
+                        self._done.add(rec["key"])
+                    else:
+                        self._done.discard(rec.get("key"))
+
+    def is_done(self, key):
+        return key in self._done
+
+    def record(self, key, status):
+        with self._lock:
+            with open(self.path, "a") as f:
+                f.write(json.dumps({"key": key, "status": status, "time": time.time()}) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            if status == "done":
+                self._done.add(key)
+
+
+# --------------------------
+# Runner
+# --------------------------
+def run_batch(items, analyze_fn, emit, workers=BATCH_WORKERS, manifest=None):
+    """
+    Runs analyze_fn(item) for every item ({"key", "name", ...}) on `workers`
+    threads and calls emit(record) once per item, in completion order, with
+    {"name", "status": "done"|"failed"|"skipped", "result"|"error"}.
+    Items already done in `manifest` are skipped. Returns counts per status.
+    """
+    counts = {"done": 0, "failed": 0, "skipped": 0}
+    emit_lock = threading.Lock()
+
+    def report(record):
+        with emit_lock:
+            counts[record["status"]] += 1
+            emit(record)
+
+    todo = []
+    for item in items:
+        if manifest is not None and manifest.is_done(item["key"]):
+            report({"name": item["name"], "status": "skipped"})
+        else:
+            todo.append(item)
+
+    def run_one(item):
+        try:
+            record = {"name": item["name"], "status": "done", "result": analyze_fn(item)}
+        except Exception as e:
+            traceback.print_exc()
+            record = {"name": item["name"], "status": "failed", "error": str(e)}
+        # Emitted (written out) before it is marked done in the manifest
+        report(record)
+        if manifest is not None:
+            manifest.record(item["key"], record["status"])
+
+    if todo:
+        with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="batch") as pool:
+            futures = [pool.submit(run_one, item) for item in todo]
+            try:
+                for f in as_completed(futures):
+                    f.result()
+            except BaseException:
+                # emit() failed (e.g. the client went away): drop videos
+                # that have not started yet
+                for f in futures:
+                    f.cancel()
+                raise
+    return counts
@@ -0,0 +1,64 @@
+"""
+Analyzes many videos in one run and writes one JSON line per video as
+soon as it is scored. Videos are processed BATCH_WORKERS at a time through
+a single scheduler, so frames of different videos share inference batches.
+A manifest (default: <output>.manifest) records finished videos; running
+the same command again skips them and appends to the output.
+
+Usage:
+python batch_analyze.py <videos or folders...> -o results.jsonl
+    [-m efficientnet_ffpp] [--workers 4] [--early_exit]
+"""
+import argparse
+import json
+import sys
+import time
+
+from config import MODEL_NAMES, BATCH_WORKERS, SCHEDULER_MAX_BATCH
+from batch import RunManifest, collect_videos, file_key, run_batch, summarize_video
+from model_loader import load_scheduler
+
+
+def main(args):
+    videos = collect_videos(args.paths)
+    if not videos:
+        print("[WARN] no videos found")
+        return 1
+
+    manifest = RunManifest(args.manifest or args.output + ".manifest")
+    sched = load_scheduler(args.model_name, max_batch_size=args.batch_size)
+    items = [{"key": file_key(v), "name": v} for v in videos]
+    print(f"[INFO] {len(items)} videos, model {args.model_name}, {args.workers} workers")
+
+    t0 = time.perf_counter()
+    with open(args.output, "a") as out:
+        def emit(record):
+            if record["status"] == "skipped":
+                return
+            record = dict(record, model_used=args.model_name)
+            out.write(json.dumps(record) + "\n")
+            out.flush()
+            verdict = record["result"]["aggregate"]["mean"] if record["status"] == "done" else record["error"]
+            print(f'[INFO] {record["status"]}: {record["name"]} ({verdict})')
+
+        counts = run_batch(items, lambda item: summarize_video(item["name"], sched, args.early_exit),
+                           emit, workers=args.workers, manifest=manifest)
+    sched.close()
+
+    elapsed = time.perf_counter() - t0
+    print(f'[INFO] done {counts["done"]}, failed {counts["failed"]}, skipped {counts["skipped"]} '
+          f'in {elapsed:.1f}s; scheduler: {sched.stats()}')
+    return 1 if counts["failed"] else 0
+
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    p.add_argument('paths', nargs='+', help='video files and/or folders (searched recursively)')
+    p.add_argument('--output', '-o', type=str, required=True, help='JSON Lines results file (appended)')
+    p.add_argument('--manifest', type=str, default=None, help='resume manifest (default: <output>.manifest)')
+    p.add_argument('--model_name', '-m', type=str, default=MODEL_NAMES[0], choices=MODEL_NAMES)
+    p.add_argument('--workers', '-w', type=int, default=BATCH_WORKERS)
+    p.add_argument('--batch_size', '-b', type=int, default=SCHEDULER_MAX_BATCH,
+                   help='largest inference batch formed across videos')
+    p.add_argument('--early_exit', action='store_true')
+    sys.exit(main(p.parse_args()))
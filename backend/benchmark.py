@@ -0,0 +1,296 @@
+"""
+Reproducible benchmarks for the detection pipeline, runnable offline:
+synthetic videos are generated locally and the model is a randomly
+initialised efficientnet_b0, so no data or weights need downloading.
+
+    run      microbenchmarks of sample_frames, preprocess_frame_for_model,
+             predict_frames, aggregate and frame_to_base64_bgr, plus a load
+             test of /analyze through the Flask test client at several
+             concurrency levels; reports throughput and p50/p95/p99 latency
+             and writes everything to a JSON file
+    compare  compares two result files and flags regressions (exit code 1)
+
+Usage:
+python benchmark.py run -o bench.json [--width 640 --height 360 --seconds 10 --codec mp4v]
+    [--concurrency 1 2 4 8] [--requests 16] [--repeats 20]
+python benchmark.py compare baseline.json bench.json [--threshold 0.10]
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import cv2
+import numpy as np
+
+import config
+from config import MODEL_NAMES, MAX_FRAMES, SAMPLE_EVERY_N_FRAMES
+
+
+# --------------------------
+# Fixtures
+# --------------------------
+def make_synthetic_video(path, width=640, height=360, seconds=10, fps=30, codec="mp4v", seed=0):
+    """
+    Writes a clip of moving shapes over a drifting gradient with noise, so
+    the encoder (and later the decoder) has realistic work to do.
+    """
+    rng = np.random.default_rng(seed)
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*codec), fps, (width, height))
+    if not writer.isOpened():
+        raise RuntimeError(f"codec '{codec}' is not available in this OpenCV build")
+    xs = np.linspace(0, 255, width, dtype=np.float32)[None, :]
+    ys = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    try:
+        for i in range(int(seconds * fps)):
+            base = ((xs + ys + 3 * i) % 256).astype(np.uint8)
+            frame = cv2.merge([base, np.roll(base, i, axis=1), 255 - base])
+            cx = int((width / 2) + (width / 3) * np.sin(i / 15.0))
+            cy = int((height / 2) + (height / 3) * np.cos(i / 20.0))
+            cv2.circle(frame, (cx, cy), max(8, height // 8), (40, 200, 80), -1)
+            cv2.rectangle(frame, (cy % width, cx % height), (cy % width + width // 10, cx % height + height // 10),
+                          (220, 60, 30), -1)
+            noise = rng.integers(0, 16, frame.shape, dtype=np.uint8)
+            writer.write(cv2.add(frame, noise))
+    finally:
+        writer.release()
+    return path
+
+
+def make_random_checkpoint(path, num_classes=2, seed=0):
+    """
+    State dict of a randomly initialised efficientnet_b0 with the repo's
+    classifier head, loadable by detector.load_efficientnet.
+    """
+    import torch
+    import torch.nn as nn
+    from torchvision.models import efficientnet_b0
+
+    torch.manual_seed(seed)
+    model = efficientnet_b0(weights=None)
+    model.classifier[1] = nn.Linear(model.classifier[1].in_features, num_classes)
+    torch.save(model.state_dict(), path)
+    return path
+
+
+# --------------------------
+# Measurement
+# --------------------------
+def summarize(latencies, items_per_call=1, wall_s=None):
+    """
+    Latency percentiles (ms) and throughput (items/s). Throughput uses the
+    wall time of the whole run when given (concurrent calls), else the sum
+    of the latencies.
+    """
+    arr = np.asarray(latencies, dtype=np.float64)
+    total = wall_s if wall_s is not None else float(arr.sum())
+    return {
+        "calls": int(arr.size),
+        "p50_ms": float(np.percentile(arr, 50) * 1000),
+        "p95_ms": float(np.percentile(arr, 95) * 1000),
+        "p99_ms": float(np.percentile(arr, 99) * 1000),
+        "mean_ms": float(arr.mean() * 1000),
+        "throughput_per_s": float(arr.size * items_per_call / total) if total > 0 else 0.0,
+    }
+
+
+def bench(fn, repeats, warmup=2, items_per_call=1):
+    for _ in range(warmup):
+        fn()
+    latencies = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - t0)
+    return summarize(latencies, items_per_call)
+
+
+def run_micro(video_path, model_name, repeats):
+    from detector import DeepfakeDetector, preprocess_frame_for_model
+    from video_utils import sample_frames, frame_to_base64_bgr, encode_thumbnail
+
+    det = DeepfakeDetector(config.MODEL_PATHS[model_name]["path"], device="cpu")
+    frames = sample_frames(video_path, every_n=SAMPLE_EVERY_N_FRAMES, max_frames=MAX_FRAMES,
+                           resize=det.input_size)
+    if not frames:
+        raise RuntimeError(f"no frames decoded from {video_path}")
+    scores = det.predict_frames(frames)
+    frame = frames[0]
+    results = {}
+    print(f"[INFO] Microbenchmarks on {len(frames)} frames, {repeats} repeats each")
+
+    results["sample_frames"] = bench(
+        lambda: sample_frames(video_path, every_n=SAMPLE_EVERY_N_FRAMES, max_frames=MAX_FRAMES,
+                              resize=det.input_size),
+        max(3, repeats // 4), warmup=1, items_per_call=len(frames))
+    results["preprocess_frame_for_model"] = bench(lambda: preprocess_frame_for_model(frame, det.input_size), repeats * 10)
+    results["predict_frames"] = bench(lambda: det.predict_frames(frames), max(3, repeats // 2),
+                                      items_per_call=len(frames))
+    results["aggregate"] = bench(lambda: det.aggregate(scores), repeats * 10)
+    results["frame_to_base64_bgr"] = bench(lambda: frame_to_base64_bgr(frame), repeats)
+    results["encode_thumbnail"] = bench(lambda: encode_thumbnail(frame), repeats)
+    for name, r in results.items():
+        print(f'[INFO] {name:28s} p50 {r["p50_ms"]:9.3f} ms  p95 {r["p95_ms"]:9.3f} ms  '
+              f'{r["throughput_per_s"]:10.1f}/s')
+    return results
+
+
+def run_load(video_path, model_name, concurrency_levels, requests_per_level):
+    """
+    POSTs the clip to /analyze from `c` threads (one test client each) until
+    `requests_per_level` requests are done, for each level c.
+    """
+    import app as server
+
+    with open(video_path, "rb") as f:
+        payload = f.read()
+    server.get_scheduler(model_name)  # load and warm up outside the timings
+    results = {}
+    for c in concurrency_levels:
+        latencies, statuses = [], {}
+        lock = threading.Lock()
+        remaining = [requests_per_level]
+
+        def worker():
+            from io import BytesIO
+            client = server.app.test_client()
+            while True:
+                with lock:
+                    if remaining[0] <= 0:
+                        return
+                    remaining[0] -= 1
+                t0 = time.perf_counter()
+                resp = client.post("/analyze", data={"file": (BytesIO(payload), "bench.mp4"),
+                                                     "model_name": model_name},
+                                   content_type="multipart/form-data")
+                elapsed = time.perf_counter() - t0
+                with lock:
+                    statuses[resp.status_code] = statuses.get(resp.status_code, 0) + 1
+                    if resp.status_code == 200:
+                        latencies.append(elapsed)
+
+        threads = [threading.Thread(target=worker) for _ in range(c)]
+        t0 = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        wall = time.perf_counter() - t0
+        r = summarize(latencies, wall_s=wall) if latencies else {"calls": 0}
+        r["status_codes"] = {str(k): v for k, v in sorted(statuses.items())}
+        results[str(c)] = r
+        print(f'[INFO] /analyze x{c:<3d} p50 {r.get("p50_ms", 0):9.1f} ms  p95 {r.get("p95_ms", 0):9.1f} ms  '
+              f'p99 {r.get("p99_ms", 0):9.1f} ms  {r.get("throughput_per_s", 0):6.2f} req/s  {r["status_codes"]}')
+    return results
+
+
+def environment():
+    import torch
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {"python": platform.python_version(), "platform": platform.platform(), "cpu_count": os.cpu_count(),
+            "torch": torch.__version__, "torch_threads": torch.get_num_threads(), "opencv": cv2.__version__,
+            "git_commit": commit}
+
+
+def cmd_run(args):
+    workdir = args.workdir or tempfile.mkdtemp(prefix="deepfake-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    ext = "avi" if args.codec.upper() in ("MJPG", "XVID") else "mp4"
+    video_path = make_synthetic_video(os.path.join(workdir, f"synthetic_{args.width}x{args.height}.{ext}"),
+                                      args.width, args.height, args.seconds, args.fps, args.codec)
+    ckpt_path = make_random_checkpoint(os.path.join(workdir, "efficientnet_b0_random.pt"))
+
+    # Point the model at the random checkpoint and keep the result cache
+    # from answering repeated uploads of the same clip
+    model_name = MODEL_NAMES[0]
+    config.MODEL_PATHS[model_name].update(path=ckpt_path, engine="torch", runtime="eager")
+    config.RESULT_CACHE_ENABLED = False
+
+    results = {
+        "environment": environment(),
+        "params": {"width": args.width, "height": args.height, "seconds": args.seconds, "fps": args.fps,
+                   "codec": args.codec, "repeats": args.repeats, "concurrency": args.concurrency,
+                   "requests": args.requests, "max_frames": MAX_FRAMES, "every_n": SAMPLE_EVERY_N_FRAMES},
+        "micro": run_micro(video_path, model_name, args.repeats),
+    }
+    if not args.no_load:
+        results["load"] = run_load(video_path, model_name, args.concurrency, args.requests)
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"[INFO] Results written to {args.output}")
+    return 0
+
+
+# --------------------------
+# Compare
+# --------------------------
+def _flatten(results):
+    rows = {}
+    for name, r in results.get("micro", {}).items():
+        rows[f"micro/{name}"] = r
+    for level, r in results.get("load", {}).items():
+        rows[f"load/c={level}"] = r
+    return rows
+
+
+def cmd_compare(args):
+    with open(args.baseline) as f:
+        old = _flatten(json.load(f))
+    with open(args.candidate) as f:
+        new = _flatten(json.load(f))
+
+    regressions = 0
+    print(f'{"benchmark":36s} {"metric":8s} {"baseline":>11s} {"candidate":>11s} {"change":>8s}')
+    for key in sorted(set(old) & set(new)):
+        for metric in ("p50_ms", "p95_ms", "p99_ms"):
+            if metric not in old[key] or metric not in new[key] or old[key][metric] <= 0:
+                continue
+            change = new[key][metric] / old[key][metric] - 1.0
+            flag = ""
+            # p99 of short runs is noisy; only p50/p95 count as regressions
+            if change > args.threshold and metric != "p99_ms":
+                flag = "  REGRESSION"
+                regressions += 1
+            elif change < -args.threshold:
+                flag = "  faster"
+            print(f"{key:36s} {metric:8s} {old[key][metric]:11.3f} {new[key][metric]:11.3f} {change:+8.1%}{flag}")
+    for key in sorted(set(old) ^ set(new)):
+        print(f"{key:36s} only in {'baseline' if key in old else 'candidate'}")
+    print(f"[INFO] {regressions} regression(s) above {args.threshold:.0%}")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    sub = p.add_subparsers(dest="command", required=True)
+
+    r = sub.add_parser("run", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    r.add_argument('--output', '-o', type=str, required=True)
+    r.add_argument('--workdir', type=str, default=None, help='where to put the synthetic clip and checkpoint')
+    r.add_argument('--width', type=int, default=640)
+    r.add_argument('--height', type=int, default=360)
+    r.add_argument('--seconds', type=float, default=10)
+    r.add_argument('--fps', type=int, default=30)
+    r.add_argument('--codec', type=str, default='mp4v', help='FourCC, e.g. mp4v, avc1, MJPG, XVID')
+    r.add_argument('--repeats', type=int, default=20)
+    r.add_argument('--concurrency', type=int, nargs='+', default=[1, 2, 4, 8])
+    r.add_argument('--requests', type=int, default=16, help='requests per concurrency level')
+    r.add_argument('--no_load', action='store_true', help='skip the /analyze load test')
+
+    c = sub.add_parser("compare", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    c.add_argument('baseline', type=str)
+    c.add_argument('candidate', type=str)
+    c.add_argument('--threshold', type=float, default=0.10, help='relative slowdown flagged as a regression')
+
+    args = p.parse_args()
+    sys.exit(cmd_run(args) if args.command == "run" else cmd_compare(args))
@@ -0,0 +1,126 @@
+"""
+Compares the CPU runtime modes of a configured model against eager
+float32 execution on a reference clip, so a faster runtime can be proven
+(accuracy and latency) before it is switched on in config.MODEL_PATHS.
+
+Usage:
+python check_runtimes.py -m efficientnet_ffpp -v <reference clip>
+    [-c <calibration clip>] [-r eager channels_last torchscript int8] [--json results.json]
+
+int8 is calibrated on a different clip than the one it is checked on
+(--calibration_video, default the model's "calibration_video"), so the
+check does not measure the calibration data itself.
+"""
+import os
+import argparse
+import json
+import sys
+import time
+
+import numpy as np
+
+from config import (MODEL_PATHS, MODEL_NAMES, SAMPLE_EVERY_N_FRAMES, MAX_FRAMES, BATCH_SIZE,
+                    CALIBRATION_FRAMES, RUNTIME_REFERENCE_VIDEO, RUNTIME_MAX_ABS_DIFF)
+from detector import DeepfakeDetector, RUNTIMES
+from video_utils import sample_frames
+
+
+def time_batches(det, frames, repeats):
+    """
+    Median wall time of one batched predict_frames() call over the clip.
+    """
+    det.predict_frames(frames)  # warmup
+    times = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        det.predict_frames(frames)
+        times.append(time.perf_counter() - t0)
+    return float(np.median(times))
+
+
+def check_model(model_name, video_path, runtimes, repeats=5, tolerance=RUNTIME_MAX_ABS_DIFF,
+                calibration_video=None):
+    cfg = MODEL_PATHS[model_name]
+    calibration_video = calibration_video or cfg.get("calibration_video")
+    calibration = None
+    if "int8" in runtimes:
+        if not calibration_video:
+            raise ValueError("int8 needs a calibration clip (--calibration_video or the model's "
+                             "\"calibration_video\") separate from the reference clip")
+        if os.path.abspath(calibration_video) == os.path.abspath(video_path):
+            raise ValueError("the calibration clip must differ from the reference clip")
+        calibration = sample_frames(calibration_video, every_n=SAMPLE_EVERY_N_FRAMES,
+                                    max_frames=CALIBRATION_FRAMES, resize=(224,224))
+        if not calibration:
+            raise ValueError(f"no frames extracted from {calibration_video}")
+    frames = sample_frames(video_path, every_n=SAMPLE_EVERY_N_FRAMES, max_frames=MAX_FRAMES, resize=(224,224))
+    if not frames:
+        raise ValueError(f"no frames extracted from {video_path}")
+
+    eager = DeepfakeDetector(cfg["path"], device="cpu", batch_size=BATCH_SIZE)
+    ref = np.array(eager.predict_frames(frames))
+    ref_time = time_batches(eager, frames, repeats)
+
+    results = []
+    for runtime in runtimes:
+        if runtime == "eager":
+            det, scores, latency = eager, ref, ref_time
+        else:
+            det = DeepfakeDetector(cfg["path"], device="cpu", batch_size=BATCH_SIZE,
+                                   runtime=runtime, calibration_frames=calibration)
+            scores = np.array(det.predict_frames(frames))
+            latency = time_batches(det, frames, repeats)
+        diff = np.abs(scores - ref)
+        results.append({
+            "model": model_name,
+            "runtime": runtime,
+            "frames": len(frames),
+            "max_abs_diff": float(diff.max()),
+            "mean_abs_diff": float(diff.mean()),
+            "verdict_flips": int(((scores > 0.5) != (ref > 0.5)).sum()),
+            "mean_score": float(scores.mean()),
+            "eager_mean_score": float(ref.mean()),
+            "latency_s": latency,
+            "ms_per_frame": 1000.0 * latency / len(frames),
+            "speedup": ref_time / latency if latency > 0 else 0.0,
+            "memory_mb": det.memory_bytes() / (1024 * 1024),
+            "passed": bool(diff.max() <= tolerance),
+        })
+    return results
+
+
+def main():
+    p = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    p.add_argument('--model_name', '-m', type=str, default=MODEL_NAMES[0], choices=MODEL_NAMES)
+    p.add_argument('--video_path', '-v', type=str, default=RUNTIME_REFERENCE_VIDEO)
+    p.add_argument('--calibration_video', '-c', type=str, default=None,
+                   help='clip for int8 calibration (default: the model\'s "calibration_video")')
+    p.add_argument('--runtimes', '-r', nargs='+', default=list(RUNTIMES), choices=RUNTIMES)
+    p.add_argument('--repeats', type=int, default=5)
+    p.add_argument('--tolerance', type=float, default=RUNTIME_MAX_ABS_DIFF)
+    p.add_argument('--json', type=str, default=None, help='write results to this file')
+    args = p.parse_args()
+    if not args.video_path:
+        p.error('a reference clip is required (--video_path or config.RUNTIME_REFERENCE_VIDEO)')
+
+    try:
+        results = check_model(args.model_name, args.video_path, args.runtimes, args.repeats, args.tolerance,
+                              args.calibration_video)
+    except ValueError as e:
+        p.error(str(e))
+
+    print('{:<14} {:>10} {:>10} {:>6} {:>10} {:>8} {:>9}  {}'.format(
+        'runtime', 'max_diff', 'mean_diff', 'flips', 'ms/frame', 'speedup', 'mem_MB', 'status'))
+    for r in results:
+        print('{runtime:<14} {max_abs_diff:>10.5f} {mean_abs_diff:>10.5f} {verdict_flips:>6d} '
+              '{ms_per_frame:>10.2f} {speedup:>7.2f}x {memory_mb:>9.1f}  '.format(**r)
+              + ('PASS' if r['passed'] else 'FAIL'))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 0 if all(r['passed'] for r in results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -7,21 +7,138 @@ BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
 PROJECT_ROOT = os.path.abspath(os.path.join(BACKEND_DIR, ".."))
 
 UPLOAD_DIR = os.path.join(BACKEND_DIR, "uploads")
+# Uploads are deleted when their request finishes; the reaper also removes
+# orphans older than UPLOAD_ORPHAN_TTL_S and keeps the directory under
+# UPLOAD_DIR_MAX_MB (0 = no budget)
+UPLOAD_DIR_MAX_MB = 10 * 1024
+UPLOAD_ORPHAN_TTL_S = 3600
+UPLOAD_REAPER_INTERVAL_S = 60
 
 # Folder containing .pt models
 PT_MODELS_DIR = os.path.join(PROJECT_ROOT, "model", "pt_models")
 PT_MODELS_DIR = os.path.abspath(PT_MODELS_DIR)
 
 # Define models (only EfficientNet now)
+# "engine":  "torch" (detector.DeepfakeDetector) or "onnx"
+#            (onnx_detector.OnnxDeepfakeDetector, reads "onnx_path"; export
+#            with export_onnx.py).
+# "runtime": torch engine only, one of detector.RUNTIMES ("eager", "channels_last",
+#            "torchscript", "int8"); verify with check_runtimes.py first.
+# "calibration_video": clip whose frames calibrate the int8 runtime.
 MODEL_PATHS = {
     "efficientnet_ffpp": {
         "path": os.path.join(PT_MODELS_DIR, "efficientnet_ffpp.pt"),  # ✅ matches your file
         "arch": "efficientnet",
+        "engine": "torch",
+        "onnx_path": os.path.join(PT_MODELS_DIR, "efficientnet_ffpp.onnx"),
+        "runtime": "eager",
+        "calibration_video": None,
     }
 }
 
 ALLOWED_EXTENSIONS = {"mp4", "mov", "avi", "mkv"}
 SAMPLE_EVERY_N_FRAMES = 15
 MAX_FRAMES = 40
+# "stride": every SAMPLE_EVERY_N_FRAMES-th frame from the start;
+# "spread": MAX_FRAMES frames spread evenly over the whole video
+SAMPLING_MODE = "stride"
+# Gaps of at least this many frames are crossed by seeking (keyframe jump)
+# instead of grabbing every frame in between; ~ one GOP of typical encodes
+SEEK_MIN_GAP = 250
+# Segment-parallel decoding (parallel_decode.py) for videos whose sampled
+# frames span at least PARALLEL_DECODE_MIN_SPAN frames; <= 1 disables it
+DECODE_WORKERS = 4
+PARALLEL_DECODE_MIN_SPAN = 3000
 BATCH_SIZE = 8
+# Cross-request micro-batching (scheduler.InferenceScheduler)
+SCHEDULER_MAX_BATCH = BATCH_SIZE
+SCHEDULER_MAX_WAIT_MS = 5
 MODEL_NAMES = list(MODEL_PATHS.keys())  # ["efficientnet_ffpp"]
+
+# Streaming decode -> preprocess -> inference pipeline (pipeline.py):
+# batches buffered between stages
+PIPELINE_QUEUE_BATCHES = 2
+
+# Early-exit sequential scoring (sequential.py); /analyze can override
+# EARLY_EXIT with the "early_exit" form field.
+EARLY_EXIT = False
+EARLY_EXIT_METHOD = "hoeffding"     # "hoeffding" or "sprt"
+EARLY_EXIT_DELTA = 0.05             # Hoeffding miscoverage / SPRT error rates
+EARLY_EXIT_MIN_FRAMES = 8
+EARLY_EXIT_BATCH = 4
+
+# Model registry (registry.ModelRegistry)
+PRELOAD_MODELS = MODEL_NAMES        # loaded and warmed up at startup
+WARMUP_ITERATIONS = 2
+MODEL_MEMORY_BUDGET_MB = 0          # 0 = never evict
+
+# Result cache for /analyze (result_cache.ResultCache)
+RESULT_CACHE_ENABLED = True
+RESULT_CACHE_DIR = os.path.join(BACKEND_DIR, "cache")
+RESULT_CACHE_MEMORY_ENTRIES = 256
+RESULT_CACHE_DISK_MB = 512
+
+# int8 calibration / runtime accuracy check (check_runtimes.py)
+CALIBRATION_FRAMES = 64
+RUNTIME_REFERENCE_VIDEO = None
+RUNTIME_MAX_ABS_DIFF = 0.02
+
+# ONNX Runtime engine threads (0 = let ONNX Runtime decide)
+ONNX_INTRA_OP_THREADS = 0
+ONNX_INTER_OP_THREADS = 1
+
+# /analyze thumbnails (thumbnails.py): the THUMBNAIL_COUNT highest-scoring
+# ("top") or first ("first") frames, encoded while inference runs.
+# THUMBNAIL_MODE "inline" embeds data URIs, "url" returns /thumbnails/<id>
+# links served from THUMBNAIL_STORE_DIR, an LRU of THUMBNAIL_STORE_MB shared
+# by all serve.py workers.
+THUMBNAIL_COUNT = 6
+THUMBNAIL_SELECTION = "top"
+THUMBNAIL_FORMAT = "jpeg"           # "jpeg" or "webp"
+THUMBNAIL_SIZE = (128, 128)
+THUMBNAIL_QUALITY = 80
+THUMBNAIL_MODE = "inline"
+THUMBNAIL_ENCODE_WORKERS = 2
+THUMBNAIL_STORE_MB = 64
+THUMBNAIL_STORE_DIR = os.path.join(BACKEND_DIR, "thumbnail_store")
+
+# Background analysis jobs (/jobs, jobs.JobManager)
+JOB_WORKERS = 2
+JOB_TTL_S = 3600                    # finished jobs are kept this long
+JOB_DIR = os.path.join(BACKEND_DIR, "job_state")  # job records, shared by serve.py workers
+
+# Bulk analysis (/analyze_batch, batch_analyze.py)
+BATCH_WORKERS = 4                   # videos analyzed concurrently
+BATCH_ALLOWED_ROOT = None           # server-side paths allowed under this dir; None disables them
+BATCH_MANIFEST_DIR = os.path.join(BACKEND_DIR, "batch_runs")
+
+# Pre-fork production server (serve.py)
+SERVE_HOST = "0.0.0.0"
+SERVE_PORT = 8000
+SERVE_WORKERS = 4
+SERVE_TORCH_THREADS = 0             # per worker; 0 = cores / SERVE_WORKERS
+SERVE_GRACEFUL_TIMEOUT_S = 30       # in-flight requests/jobs get this long on restart/stop
+SERVE_MEMORY_REPORT_S = 0           # log per-worker RSS/PSS this often; 0 = only on SIGUSR1
+SERVE_METRICS_DIR = os.path.join(BACKEND_DIR, "metrics_state")  # per-worker metrics, summed by /metrics
+METRICS_FLUSH_S = 5                 # how often each worker writes its metrics there
+
+# Admission control for /analyze, /analyze/stream, /analyze_ensemble and
+# /analyze_batch (admission.py):
+# requests beyond the wait queue get 429 + Retry-After right away
+ADMISSION_MAX_CONCURRENT = 4
+ADMISSION_MAX_QUEUE = 16
+ADMISSION_QUEUE_TIMEOUT_S = 30
+# Per-request time budget (seconds, None = unlimited); the "deadline_s"
+# form field overrides it. Requests short on time sample fewer frames and
+# return a partial, "degraded" result instead of timing out.
+ANALYZE_DEADLINE_S = None
+DEADLINE_MIN_FRAMES = 4
+DEADLINE_SAFETY = 0.8               # share of the remaining budget planned for frames
+DEADLINE_INITIAL_FRAME_COST_S = 0.05
+
+# Ensemble analysis (/analyze_ensemble, ensemble.py): one decode and one
+# preprocessing pass per input size/normalization shared by all models
+ENSEMBLE_MODELS = MODEL_NAMES       # default selection
+ENSEMBLE_WEIGHTS = {}               # model name -> weight (default 1.0)
+ENSEMBLE_RULE = "weighted_mean"     # "weighted_mean", "max" or "vote"
+ENSEMBLE_WORKERS = 0                # concurrent forward passes; 0 = CPU count
@@ -0,0 +1,47 @@
+"""
+Converts a pickled EfficientNet checkpoint to .safetensors, so servers
+start by memory-mapping the weights instead of unpickling them. The
+"module." prefix normalization and the classifier-size detection happen
+here, once; the results are stored in the file's metadata.
+
+Usage:
+python convert_checkpoint.py -c <checkpoint.pt | MODEL_PATHS name> [-o <model.safetensors>]
+
+Point "path" in config.MODEL_PATHS at the output file to use it.
+"""
+import argparse
+import os
+
+from config import MODEL_PATHS
+from detector import load_state_dict
+
+
+def convert(checkpoint, output):
+    from safetensors.torch import save_file
+
+    state_dict, num_outputs = load_state_dict(checkpoint, device="cpu")
+    # safetensors wants contiguous tensors that do not share storage
+    tensors = {k: v.detach().contiguous().clone() for k, v in state_dict.items()}
+    metadata = {"format": "pt", "normalized": "1", "source": os.path.basename(checkpoint)}
+    if num_outputs:
+        metadata["num_outputs"] = str(num_outputs)
+
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    save_file(tensors, output, metadata=metadata)
+    print(f"[INFO] Wrote {len(tensors)} tensors ({num_outputs or 'unknown'} classifier outputs) to {output}")
+    return output
+
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    p.add_argument('--checkpoint', '-c', type=str, required=True,
+                   help='checkpoint path, or a config.MODEL_PATHS name')
+    p.add_argument('--output', '-o', type=str, default=None,
+                   help='defaults to the checkpoint path with a .safetensors extension')
+    args = p.parse_args()
+
+    checkpoint = args.checkpoint
+    if checkpoint in MODEL_PATHS:
+        checkpoint = MODEL_PATHS[checkpoint]["path"]
+    convert(checkpoint, args.output or os.path.splitext(checkpoint)[0] + ".safetensors")
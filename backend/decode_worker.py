@@ -0,0 +1,66 @@
+# decode_worker.py
+# Entry point of a parallel_decode worker process. It is started as a plain
+# script (not through multiprocessing, whose children re-run the parent's
+# __main__), so it imports only cv2, numpy and video_utils. Tasks arrive as
+# one JSON line each on stdin; the worker decodes the segment into the
+# named shared-memory array and answers {"written": n} or {"error": ...}.
+import json
+import sys
+from multiprocessing import resource_tracker, shared_memory
+
+import cv2
+import numpy as np
+
+from video_utils import iter_frames_at
+
+
+def _attach(name):
+    # The parent owns (and unlinks) the segment; this process's own
+    # resource tracker must not remove it when the worker exits
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)  # Python 3.13+
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+def decode_segment(video_path, indices, resize, shm_name, total, slot, seek_min_gap):
+    """
+    Decodes `indices` of video_path into slots slot.. of the shared
+    (total, H, W, 3) uint8 array. Returns how many frames were written.
+    """
+    w, h = resize
+    shm = _attach(shm_name)
+    cap = cv2.VideoCapture(video_path)
+    written = 0
+    try:
+        out = np.ndarray((total, h, w, 3), dtype=np.uint8, buffer=shm.buf)
+        start = 0
+        if indices[0] > 0 and cap.set(cv2.CAP_PROP_POS_FRAMES, indices[0]):
+            start = indices[0]
+        for _, frame in iter_frames_at(cap, indices, resize=None, seek_min_gap=seek_min_gap,
+                                       start_pos=start, max_frames=len(indices)):
+            cv2.resize(frame, tuple(resize), dst=out[slot + written])
+            written += 1
+        del out
+    finally:
+        cap.release()
+        shm.close()
+    return written
+
+
+def main():
+    # One process per segment already; keep OpenCV from oversubscribing
+    cv2.setNumThreads(1)
+    for line in sys.stdin:
+        try:
+            reply = {"written": decode_segment(**json.loads(line))}
+        except Exception as e:
+            reply = {"error": f"{type(e).__name__}: {e}"}
+        sys.stdout.write(json.dumps(reply) + "\n")
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
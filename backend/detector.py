@@ -1,9 +1,14 @@
 import os
+import copy
+import pickle
 import numpy as np
 import torch
 import torch.nn as nn
 from typing import List
 
+from config import BATCH_SIZE
+from base_detector import BaseDetector, FrameBuffer, preprocess_frames_into
+
 # --------------------------
 # Preprocessing helper
 # --------------------------
@@ -23,6 +28,60 @@ def preprocess_frame_for_model(frame_bgr, target_size=(224,224)):
 # --------------------------
 # Load EfficientNet model
 # --------------------------
+def normalize_state_dict(state_dict):
+    # Remove DataParallel "module." prefix if present (without copying the
+    # dict when there is none)
+    if any("module." in k for k in state_dict):
+        return {k.replace("module.", ""): v for k, v in state_dict.items()}
+    return state_dict
+
+
+def classifier_outputs(state_dict):
+    """
+    Number of classifier outputs (1 or 2) a checkpoint was trained with, or
+    None when it has no classifier.1 weights.
+    """
+    ckpt_out = state_dict.get("classifier.1.weight", None)
+    if ckpt_out is not None and ckpt_out.shape[0] in (1, 2):
+        return int(ckpt_out.shape[0])
+    return None
+
+
+def load_state_dict(path, device="cpu"):
+    """
+    Reads a checkpoint's tensors. Returns (state_dict, num_outputs).
+
+    .safetensors files (written by convert_checkpoint.py) are memory-mapped
+    and already normalized, with the classifier size in their metadata.
+    Pickled checkpoints are loaded with mmap=True, weights_only=True, so
+    pages are read lazily and no arbitrary objects are unpickled; torch
+    versions or checkpoint formats that cannot do that fall back to a
+    plain torch.load.
+    """
+    if path.endswith(".safetensors"):
+        try:
+            from safetensors import safe_open
+        except ImportError:
+            raise ImportError("Loading .safetensors checkpoints requires the 'safetensors' package")
+        with safe_open(path, framework="pt", device=str(device)) as f:
+            meta = f.metadata() or {}
+            state_dict = {k: f.get_tensor(k) for k in f.keys()}
+        if meta.get("normalized") != "1":
+            state_dict = normalize_state_dict(state_dict)
+        num_outputs = int(meta["num_outputs"]) if meta.get("num_outputs") else classifier_outputs(state_dict)
+        return state_dict, num_outputs
+
+    try:
+        state_dict = torch.load(path, map_location=device, mmap=True, weights_only=True)
+    except (TypeError, RuntimeError, pickle.UnpicklingError) as e:
+        # TypeError: torch < 2.1; RuntimeError: legacy (non-zip) format;
+        # UnpicklingError: the checkpoint pickles more than tensors
+        print(f"[WARN] Memory-mapped load of {path} failed ({type(e).__name__}); using a full torch.load.")
+        state_dict = torch.load(path, map_location=device)
+    state_dict = normalize_state_dict(state_dict)
+    return state_dict, classifier_outputs(state_dict)
+
+
 def load_efficientnet(path, device="cpu"):
     if not os.path.exists(path):
         raise FileNotFoundError(f"Model file not found: {path}")
@@ -32,82 +91,162 @@ def load_efficientnet(path, device="cpu"):
     # Base model
     model = efficientnet_b0(weights=None)
 
-    # Replace classifier (we'll adjust based on checkpoint later)
-    in_features = model.classifier[1].in_features
-    model.classifier[1] = nn.Linear(in_features, 2)  # default 2-class
-
     # Load checkpoint
-    state_dict = torch.load(path, map_location=device)
+    state_dict, num_outputs = load_state_dict(path, device)
 
-    # Check if mismatch between checkpoint and current classifier
-    ckpt_out = state_dict.get("classifier.1.weight", None)
-    if ckpt_out is not None:
-        if ckpt_out.shape[0] == 1:  # checkpoint trained with 1 output
-            model.classifier[1] = nn.Linear(in_features, 1)
-        elif ckpt_out.shape[0] == 2:  # checkpoint trained with 2 outputs
-            model.classifier[1] = nn.Linear(in_features, 2)
-
-    # Remove DataParallel "module." prefix if present
-    new_state_dict = {k.replace("module.", ""): v for k, v in state_dict.items()}
+    # Size the classifier to match the checkpoint (default 2-class)
+    in_features = model.classifier[1].in_features
+    model.classifier[1] = nn.Linear(in_features, num_outputs or 2)
 
     # Load (ignore mismatch if last layer differs)
-    model.load_state_dict(new_state_dict, strict=False)
+    model.load_state_dict(state_dict, strict=False)
 
     model.to(device)
     model.eval()
     return model
 
 
+# --------------------------
+# CPU runtime modes
+# --------------------------
+RUNTIMES = ("eager", "channels_last", "torchscript", "int8")
+
+
+def _quantized_engine():
+    engines = torch.backends.quantized.supported_engines
+    for name in ("x86", "fbgemm", "qnnpack"):
+        if name in engines:
+            return name
+    raise RuntimeError(f"No int8 quantization engine available (supported: {engines})")
+
+
+def optimize_for_runtime(model, runtime="eager", example_batch=None, calibration_batches=None):
+    """
+    Prepares an eval-mode model for one of the RUNTIMES:
+      eager          - unchanged float32 module
+      channels_last  - weights (and inputs, see _to_tensor) in NHWC layout
+      torchscript    - traced with `example_batch` and frozen
+      int8           - FX post-training static quantization, calibrated on
+                       `calibration_batches` (CPU only)
+    """
+    if runtime not in RUNTIMES:
+        raise ValueError(f"Unknown runtime '{runtime}'. Available: {RUNTIMES}")
+    if runtime == "eager":
+        return model
+
+    if runtime == "channels_last":
+        return model.to(memory_format=torch.channels_last)
+
+    if runtime == "torchscript":
+        with torch.no_grad():
+            traced = torch.jit.trace(model, example_batch)
+        return torch.jit.freeze(traced.eval())
+
+    # int8: activation scales come from the calibration data, so it must be
+    # real footage
+    if not calibration_batches:
+        raise ValueError("int8 runtime needs calibration batches of real frames")
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+    engine = _quantized_engine()
+    torch.backends.quantized.engine = engine
+    prepared = prepare_fx(copy.deepcopy(model).cpu().eval(),
+                          get_default_qconfig_mapping(engine),
+                          example_inputs=(example_batch.cpu(),))
+    with torch.no_grad():
+        for batch in calibration_batches:
+            prepared(batch.cpu())
+    return convert_fx(prepared)
+
+
+def _state_dict_bytes(model):
+    tensors = [t for t in model.state_dict().values() if isinstance(t, torch.Tensor)]
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
 # --------------------------
 # DeepfakeDetector class
 # --------------------------
-class DeepfakeDetector:
+class DeepfakeDetector(BaseDetector):
     """
     Deepfake detector using EfficientNet backbone.
     """
-    def __init__(self, model_path, device="cpu"):
+    def __init__(self, model_path, device="cpu", batch_size=BATCH_SIZE, runtime="eager", calibration_frames=None):
+        if runtime == "int8" and device != "cpu":
+            raise ValueError("int8 runtime is only supported on CPU")
+        super().__init__(batch_size=batch_size, input_size=(224,224))
         self.device = device
         self.model_path = model_path
+        self.runtime = runtime
         self.model = load_efficientnet(self.model_path, device=self.device)
 
-        # Detect classifier type
+        # Detect classifier type (before the module is traced or quantized)
         self.num_outputs = self.model.classifier[1].out_features
         print(f"[INFO] Loaded EfficientNet with {self.num_outputs} output(s).")
 
-    # --------------------------
-    # Predict frames
-    # --------------------------
-    def predict_frames(self, frames: List[np.ndarray]) -> List[float]:
+        # Weight memory, taken before optimization as well: a frozen
+        # torchscript module keeps its weights as graph constants and has
+        # an empty state_dict
+        self._memory_bytes = _state_dict_bytes(self.model)
+        if runtime != "eager":
+            w, h = self.input_size
+            example = np.zeros((self.batch_size, 3, h, w), dtype=np.float32)
+            self.model = optimize_for_runtime(
+                self.model, runtime,
+                example_batch=self._to_tensor(example),
+                calibration_batches=self._calibration_batches(calibration_frames),
+            )
+            print(f"[INFO] Using '{runtime}' runtime.")
+            self._memory_bytes = _state_dict_bytes(self.model) or self._memory_bytes
+
+    def _to_tensor(self, batch: np.ndarray) -> torch.Tensor:
+        tensor = torch.from_numpy(batch).to(self.device)
+        if self.runtime == "channels_last":
+            tensor = tensor.contiguous(memory_format=torch.channels_last)
+        return tensor
+
+    def _calibration_batches(self, frames):
+        if self.runtime != "int8":
+            return None
+        if not frames:
+            # Scales calibrated on anything but real faces are meaningless
+            raise ValueError("int8 runtime requires calibration frames; set \"calibration_video\" "
+                             "for the model in config.MODEL_PATHS")
+        batches = []
+        for start in range(0, len(frames), self.batch_size):
+            # A fresh buffer per batch: all of them are kept until calibration runs
+            buf = FrameBuffer(self.batch_size, self.input_size)
+            batches.append(torch.from_numpy(buf.fill(frames[start:start + self.batch_size])))
+        return batches
+
+    def memory_bytes(self) -> int:
         """
-        Predict deepfake scores for a list of BGR frames.
-        Returns list of float scores per frame (0..1).
+        Approximate memory held by the model's weights (state_dict also
+        covers packed int8 weights, which are not nn.Parameters; frozen
+        torchscript modules report their float32 weights).
         """
-        scores = []
-        for f in frames:
-            img = preprocess_frame_for_model(f, target_size=(224,224))
-            tensor = torch.from_numpy(img).unsqueeze(0).to(self.device).float()
-            with torch.no_grad():
-                out = self.model(tensor)
-
-                if self.num_outputs == 2:
-                    # Softmax: probability of "fake"
-                    prob = torch.softmax(out, dim=1)[0,1].item()
-                else:
-                    # Sigmoid: direct probability
-                    prob = torch.sigmoid(out).item()
-
-            scores.append(prob)
-        return scores
+        return self._memory_bytes
 
     # --------------------------
-    # Aggregate scores
+    # Batched forward pass
     # --------------------------
-    def aggregate(self, scores: List[float]) -> dict:
+    def forward_batch(self, batch: torch.Tensor) -> torch.Tensor:
         """
-        Aggregate frame-level predictions to video-level metrics.
+        Runs one NCHW batch through the model and returns per-frame
+        "fake" probabilities as a 1-D tensor (still on self.device).
         """
-        arr = np.array(scores)
-        mean_score = float(np.mean(arr)) if arr.size > 0 else 0.0
-        median_score = float(np.median(arr)) if arr.size > 0 else 0.0
-        majority_ratio = float((arr > 0.5).sum() / arr.size) if arr.size > 0 else 0.0
-        return {"mean": mean_score, "median": median_score, "majority_ratio": majority_ratio}
+        out = self.model(batch)
+        if self.num_outputs == 2:
+            # Softmax: probability of "fake"
+            return torch.softmax(out, dim=1)[:, 1]
+        # Sigmoid: direct probability
+        return torch.sigmoid(out).reshape(-1)
+
+    def score_batch(self, batch: np.ndarray) -> torch.Tensor:
+        with torch.no_grad():
+            return self.forward_batch(self._to_tensor(batch))
+
+    def collect_scores(self, outputs) -> List[float]:
+        # Single device -> host transfer for the whole call
+        return torch.cat(outputs).cpu().tolist()
@@ -0,0 +1,130 @@
+# ensemble.py
+# Several models over one video for the price of one decode: frames are
+# sampled once (at the largest model input size), preprocessed once per
+# distinct (input size, normalization), and every batch is scored by all
+# selected models concurrently from those shared tensors.
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from config import (SAMPLE_EVERY_N_FRAMES, MAX_FRAMES, SAMPLING_MODE, BATCH_SIZE, ENSEMBLE_RULE,
+                    ENSEMBLE_WEIGHTS, ENSEMBLE_WORKERS)
+from parallel_decode import iter_frames_parallel
+from pipeline import PipelineStats, stream_preprocessed_batches
+
+ENSEMBLE_RULES = ("weighted_mean", "max", "vote")
+
+
+def combine_scores(per_model, weights, rule=ENSEMBLE_RULE):
+    """
+    Per-frame ensemble scores from {model: [scores]} (same frames, same
+    order):
+    - weighted_mean: weighted average of the models' probabilities;
+    - max: the most suspicious model per frame;
+    - vote: weighted share of models calling the frame fake (> 0.5).
+    """
+    if rule not in ENSEMBLE_RULES:
+        raise ValueError(f"Unknown ensemble rule '{rule}'. Available: {ENSEMBLE_RULES}")
+    names = list(per_model)
+    scores = np.array([per_model[n] for n in names], dtype=np.float64)
+    w = np.array([weights.get(n, 1.0) for n in names], dtype=np.float64)[:, None]
+    if rule == "max":
+        combined = scores.max(axis=0)
+    elif rule == "vote":
+        combined = ((scores > 0.5) * w).sum(axis=0) / w.sum()
+    else:
+        combined = (scores * w).sum(axis=0) / w.sum()
+    return combined.tolist()
+
+
+class EnsembleAnalysis:
+    """
+    Result of analyze_ensemble: sampled frame indices, per-model scores and
+    the combined per-frame scores.
+    """
+    def __init__(self, names):
+        self.indices = []
+        self.per_model = {name: [] for name in names}
+        self.combined = []
+        self.frames_decoded = 0
+        self.decode_seconds = 0.0
+        self.preprocess_seconds = 0.0
+
+    @property
+    def frames_used(self):
+        return len(self.combined)
+
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def _pool():
+    # One shared pool, recreated after a fork
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            workers = ENSEMBLE_WORKERS or os.cpu_count() or 1
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ensemble")
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def _target_key(det):
+    return tuple(det.input_size), json.dumps(det.normalize)
+
+
+def analyze_ensemble(video_path, scheds, weights=None, rule=ENSEMBLE_RULE, thumbnails=None,
+                     every_n=SAMPLE_EVERY_N_FRAMES, max_frames=MAX_FRAMES, spread=None,
+                     batch_size=BATCH_SIZE):
+    """
+    Scores video_path with every InferenceScheduler in `scheds`
+    ({model name: scheduler}) from a single decode. Thumbnails (a
+    ThumbnailCollector) are picked by combined score.
+    """
+    weights = ENSEMBLE_WEIGHTS if weights is None else weights
+    if spread is None:
+        spread = SAMPLING_MODE == "spread"
+    names = list(scheds)
+
+    # Models sharing an input size and normalization share one batch
+    keys, targets, target_of = [], [], {}
+    for name in names:
+        det = scheds[name].detector
+        key = _target_key(det)
+        if key not in keys:
+            keys.append(key)
+            targets.append((det.input_size, det.normalize))
+        target_of[name] = keys.index(key)
+
+    # Decode at the largest input size; smaller targets are resized from it
+    decode_size = max((size for size, _ in targets), key=lambda s: s[0] * s[1])
+    stats = PipelineStats()
+    result = EnsembleAnalysis(names)
+    frame_source = iter_frames_parallel(video_path, every_n=every_n, max_frames=max_frames,
+                                        resize=decode_size, spread=spread)
+    stream = stream_preprocessed_batches(frame_source, targets, batch_size, stats=stats)
+    pool = _pool()
+    try:
+        for indices, frames, batches in stream:
+            futures = {name: pool.submit(scheds[name].predict_preprocessed, batches[target_of[name]])
+                       for name in names}
+            scores = {name: f.result() for name, f in futures.items()}
+            combined = combine_scores(scores, weights, rule)
+            if thumbnails is not None:
+                thumbnails.add_batch(len(result.combined), indices, frames, combined)
+            result.indices.extend(indices)
+            for name in names:
+                result.per_model[name].extend(scores[name])
+            result.combined.extend(combined)
+            result.frames_decoded = stats.frames_decoded
+    finally:
+        stream.close()
+    result.frames_decoded = stats.frames_decoded
+    result.decode_seconds = stats.decode_seconds
+    result.preprocess_seconds = stats.preprocess_seconds
+    return result
@@ -0,0 +1,107 @@
+"""
+Exports a detector checkpoint to ONNX with a dynamic batch dimension, for
+use with onnx_detector.OnnxDeepfakeDetector ("engine": "onnx" in
+config.MODEL_PATHS).
+
+Usage:
+python export_onnx.py -c <checkpoint> -o <model.onnx>
+    [-a efficientnet | xception | xception_concat | resnet18] [--num_classes 2]
+
+EfficientNet checkpoints are loaded with detector.load_efficientnet; the
+other architectures with model/network/models.py (TransferModel).
+The preprocessing each graph expects (input size, normalization) is stored
+in the ONNX metadata so the runtime detector can reproduce it.
+"""
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+import torch
+
+from config import PROJECT_ROOT, MODEL_PATHS
+from detector import load_efficientnet
+
+# Input size and (mean, std) each architecture was trained with
+ARCH_PREPROCESSING = {
+    "efficientnet": ((224, 224), None),
+    "xception": ((299, 299), ([0.5] * 3, [0.5] * 3)),
+    "xception_concat": ((299, 299), ([0.5] * 3, [0.5] * 3)),
+    "resnet18": ((224, 224), ([0.5] * 3, [0.5] * 3)),
+}
+
+
+def load_transfer_model(path, arch, num_classes=2):
+    sys.path.insert(0, os.path.join(PROJECT_ROOT, "model"))
+    from network.models import model_selection
+
+    model = model_selection(modelname=arch, num_out_classes=num_classes, dropout=0.5)
+    state_dict = torch.load(path, map_location="cpu")
+    # Remove DataParallel "module." prefix if present
+    state_dict = {k[len("module."):] if k.startswith("module.") else k: v for k, v in state_dict.items()}
+    model.load_state_dict(state_dict)
+    return model.eval()
+
+
+def load_checkpoint(path, arch, num_classes=2):
+    if arch == "efficientnet":
+        return load_efficientnet(path, device="cpu")
+    return load_transfer_model(path, arch, num_classes)
+
+
+def export(checkpoint, output, arch="efficientnet", num_classes=2, opset=17, verify=True):
+    model = load_checkpoint(checkpoint, arch, num_classes)
+    input_size, normalize = ARCH_PREPROCESSING[arch]
+    w, h = input_size
+    dummy = torch.randn(2, 3, h, w)
+
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with torch.no_grad():
+        torch.onnx.export(
+            model, dummy, output,
+            input_names=["input"], output_names=["logits"],
+            dynamic_axes={"input": {0: "batch"}, "logits": {0: "batch"}},
+            opset_version=opset,
+            do_constant_folding=True,
+        )
+
+    import onnx
+    graph = onnx.load(output)
+    for key, value in (("arch", arch),
+                       ("input_size", json.dumps(list(input_size))),
+                       ("normalize", json.dumps(normalize) if normalize else ""),
+                       ("source_checkpoint", os.path.basename(checkpoint))):
+        entry = graph.metadata_props.add()
+        entry.key, entry.value = key, value
+    onnx.checker.check_model(graph)
+    onnx.save(graph, output)
+    print(f"[INFO] Exported {arch} checkpoint to {output}")
+
+    if verify:
+        import onnxruntime as ort
+        sess = ort.InferenceSession(output, providers=["CPUExecutionProvider"])
+        batch = torch.randn(5, 3, h, w)  # different batch size than the export
+        with torch.no_grad():
+            ref = model(batch).numpy()
+        out = sess.run(None, {"input": batch.numpy()})[0]
+        print(f"[INFO] ONNX Runtime max abs logit diff vs PyTorch: {float(np.abs(out - ref).max()):.6f}")
+    return output
+
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    p.add_argument('--checkpoint', '-c', type=str, required=True,
+                   help='checkpoint path, or a config.MODEL_PATHS name')
+    p.add_argument('--output', '-o', type=str, required=True)
+    p.add_argument('--arch', '-a', type=str, default='efficientnet', choices=sorted(ARCH_PREPROCESSING))
+    p.add_argument('--num_classes', type=int, default=2)
+    p.add_argument('--opset', type=int, default=17)
+    p.add_argument('--no_verify', action='store_true')
+    args = p.parse_args()
+
+    checkpoint = args.checkpoint
+    if checkpoint in MODEL_PATHS:
+        checkpoint = MODEL_PATHS[checkpoint]["path"]
+    export(checkpoint, args.output, args.arch, args.num_classes, args.opset, verify=not args.no_verify)
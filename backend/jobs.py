@@ -0,0 +1,280 @@
+# jobs.py
+# Background analysis jobs: POST /jobs queues an upload and returns at once,
+# a small worker pool runs the analyses, and finished jobs are kept for
+# JOB_TTL_S seconds so clients can poll for the result. Job records live in
+# JOB_DIR, so under serve.py any worker can answer for (and cancel) a job
+# that runs in another.
+import json
+import os
+import re
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from config import JOB_WORKERS, JOB_TTL_S, JOB_DIR
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobStore:
+    """
+    One JSON record per job under `root`, replaced atomically on every
+    change. An "<id>.cancel" file asks the process running the job to
+    cancel it.
+    """
+    def __init__(self, root=JOB_DIR):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, job_id, ext=".json"):
+        if not re.fullmatch(r"[0-9a-f]{32}", job_id):
+            return None
+        return os.path.join(self.root, job_id + ext)
+
+    def save(self, record):
+        path = self._path(record["id"])
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(record, f)
+        os.replace(tmp, path)
+
+    def load(self, job_id):
+        path = self._path(job_id)
+        if path is None:
+            return None
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def request_cancel(self, job_id):
+        open(self._path(job_id, ".cancel"), "w").close()
+
+    def cancel_requested(self, job_id):
+        return os.path.exists(self._path(job_id, ".cancel"))
+
+    def remove(self, job_id):
+        for ext in (".json", ".cancel"):
+            try:
+                os.remove(self._path(job_id, ext))
+            except OSError:
+                pass
+
+    def ids(self):
+        try:
+            names = os.listdir(self.root)
+        except OSError:
+            return []
+        return [n[:-5] for n in names if n.endswith(".json")]
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Job:
+    def __init__(self, meta=None, store=None):
+        self.id = uuid.uuid4().hex
+        self.state = QUEUED
+        self.meta = meta or {}
+        self.progress = {"frames_decoded": 0, "frames_scored": 0}
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.cancel_event = threading.Event()
+        self.store = store
+
+    def update(self, **progress):
+        self.progress.update(progress)
+        self.save()
+
+    def save(self):
+        if self.store is None:
+            return
+        try:
+            self.store.save(dict(self.to_dict(), owner=os.getpid()))
+        except OSError as e:
+            print(f"[WARN] Could not save job {self.id}: {e}")
+
+    def cancelled(self):
+        # Cancellations requested through other workers arrive as a file
+        if not self.cancel_event.is_set() and self.store is not None and self.store.cancel_requested(self.id):
+            self.cancel_event.set()
+        return self.cancel_event.is_set()
+
+    def check_cancelled(self):
+        """
+        Called from progress callbacks; unwinds the running analysis once the
+        job is cancelled.
+        """
+        if self.cancelled():
+            raise JobCancelled()
+
+    def to_dict(self):
+        d = {"id": self.id, "state": self.state, "progress": dict(self.progress),
+             "created": self.created, "started": self.started, "finished": self.finished}
+        d.update(self.meta)
+        if self.state == DONE:
+            d["result"] = self.result
+        elif self.state == FAILED:
+            d["error"] = self.error
+        return d
+
+
+class JobManager:
+    """
+    Runs `fn(job)` for submitted jobs on `workers` threads. `on_finish(job)`
+    runs after every job, whatever its outcome (e.g. to release the upload).
+    Finished jobs older than `ttl` seconds are dropped on the next access.
+    Jobs run in the process that accepted them; get() and cancel() also
+    work for jobs of other processes sharing `root`.
+    """
+    def __init__(self, workers=JOB_WORKERS, ttl=JOB_TTL_S, root=JOB_DIR):
+        self.workers = workers
+        self.ttl = ttl
+        self.store = JobStore(root)
+        self._jobs = {}   # jobs running in this process
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        self._swept = 0.0
+
+    def _pool(self):
+        # Created lazily (and again after a fork) so worker threads never
+        # cross a process boundary
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="job")
+            return self._executor
+
+    def _expire_locked(self):
+        cutoff = time.time() - self.ttl
+        for job_id in [j.id for j in self._jobs.values()
+                       if j.state in FINISHED_STATES and j.finished < cutoff]:
+            del self._jobs[job_id]
+            self.store.remove(job_id)
+
+    def _record(self, job_id):
+        """
+        Stored record of another process's job, or None once expired. Jobs
+        whose process died before finishing are reported as failed.
+        """
+        record = self.store.load(job_id)
+        if record is None:
+            return None
+        owner = record.pop("owner", None)
+        if record["state"] not in FINISHED_STATES and owner is not None and not _alive(owner):
+            record.update(state=FAILED, error="the worker running the job exited",
+                          finished=record["started"] or record["created"])
+        if record["state"] in FINISHED_STATES and record["finished"] < time.time() - self.ttl:
+            self.store.remove(job_id)
+            return None
+        return record
+
+    def _sweep(self):
+        # Records are otherwise only expired when read; this drops the ones
+        # nobody asks for again, at most once a minute
+        now = time.time()
+        if now - self._swept < 60:
+            return
+        self._swept = now
+        for job_id in self.store.ids():
+            if job_id not in self._jobs:
+                self._record(job_id)
+
+    def submit(self, fn, meta=None, on_finish=None):
+        job = Job(meta, store=self.store)
+        with self._lock:
+            self._expire_locked()
+            self._jobs[job.id] = job
+        self._sweep()
+        job.save()
+        self._pool().submit(self._run, job, fn, on_finish)
+        return job
+
+    def _run(self, job, fn, on_finish):
+        state = CANCELLED
+        try:
+            if not job.cancelled():
+                job.started = time.time()
+                job.state = RUNNING
+                job.save()
+                job.result = fn(job)
+                state = DONE
+        except JobCancelled:
+            pass
+        except Exception as e:
+            traceback.print_exc()
+            job.error = str(e)
+            state = FAILED
+        finally:
+            # `finished` is set before the state so expiry never sees a
+            # finished job without a timestamp
+            job.finished = time.time()
+            job.state = state
+            job.save()
+            if on_finish is not None:
+                on_finish(job)
+
+    def get(self, job_id):
+        """
+        The job's status dict (see Job.to_dict), or None if unknown.
+        """
+        with self._lock:
+            self._expire_locked()
+            job = self._jobs.get(job_id)
+        return job.to_dict() if job is not None else self._record(job_id)
+
+    def cancel(self, job_id):
+        """
+        Requests cancellation; queued jobs never start, running ones stop at
+        their next progress update. Returns the job's status dict, or None
+        if unknown.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            if job.state not in FINISHED_STATES:
+                job.cancel_event.set()
+            return job.to_dict()
+        record = self._record(job_id)
+        if record is not None and record["state"] not in FINISHED_STATES:
+            self.store.request_cancel(job_id)
+        return record
+
+    def close(self, wait=True):
+        """
+        Stops taking jobs; with `wait`, blocks until running jobs finish.
+        """
+        with self._lock:
+            executor = self._executor if self._pid == os.getpid() else None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+    def stats(self):
+        # All processes' jobs; also drops expired records left by others
+        with self._lock:
+            self._expire_locked()
+        counts = {}
+        for job_id in self.store.ids():
+            record = self._record(job_id)
+            if record is not None:
+                counts[record["state"]] = counts.get(record["state"], 0) + 1
+        return {"workers": self.workers, "ttl_s": self.ttl, "jobs": counts}
@@ -0,0 +1,345 @@
+# metrics.py
+# Minimal Prometheus instrumentation (text exposition format 0.0.4) without
+# a client library. Observing a value is a dict lookup, a bisect and two
+# additions under a lock; gauges that describe server state (queues,
+# loaded models, RSS) are computed only when /metrics is scraped.
+#
+# Under serve.py every worker writes its counters, histograms and gauges to
+# a shared directory (MetricsRegistry.enable_multiprocess) and /metrics,
+# whichever worker answers it, reports their sum, so counters stay monotonic
+# across scrapes. Scrape-time gauges describe the answering process and
+# carry a "pid" label.
+import bisect
+import json
+import math
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: no multiprocess mode (serve.py needs fork anyway)
+    fcntl = None
+
+from config import METRICS_FLUSH_S
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; from single-batch forward passes up to whole long videos
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _number(v):
+    if v == math.inf:
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class _Metric:
+    kind = None
+    shared = True   # summed over processes in multiprocess mode
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+
+    def inc(self, amount=1, *labels):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def state(self):
+        with self._lock:
+            return dict(self._values)
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+    def render(self, values=None):
+        items = sorted((self.state() if values is None else values).items())
+        return self.header() + [f"{self.name}{_labels(self.labelnames, k)} {_number(v)}" for k, v in items]
+
+
+class Gauge(_Metric):
+    """
+    Set/inc/dec gauge, or one whose samples come from `collect()` (an
+    iterable of (label values, value)) at scrape time.
+    """
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), collect=None):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+        self._collect = collect
+
+    def set(self, value, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+    def inc(self, amount=1, *labels):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, amount=1, *labels):
+        self.inc(-amount, *labels)
+
+    @property
+    def shared(self):
+        return self._collect is None
+
+    def state(self):
+        with self._lock:
+            return dict(self._values)
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+    def render(self, values=None, extra=None):
+        if self._collect is not None:
+            items = sorted((tuple(k), v) for k, v in self._collect())
+        else:
+            items = sorted((self.state() if values is None else values).items())
+        return self.header() + [f"{self.name}{_labels(self.labelnames, k, extra)} {_number(v)}" for k, v in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # labels -> [per-bucket counts..., +Inf count, sum]
+
+    def observe(self, value, *labels):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            series[i] += 1
+            series[-1] += value
+
+    def state(self):
+        with self._lock:
+            return {k: list(v) for k, v in self._series.items()}
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+    def render(self, values=None):
+        items = sorted((self.state() if values is None else values).items())
+        lines = self.header()
+        for labels, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), series[:-1]):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, ('le', _number(bound)))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(series[-1])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _add(totals, state, kinds, gauges=True):
+    # state: {metric name: [[label values], value or histogram series]}
+    for name, samples in state.items():
+        kind = kinds.get(name)
+        if kind is None or (kind == "gauge" and not gauges):
+            continue
+        values = totals.setdefault(name, {})
+        for labels, v in samples:
+            labels = tuple(labels)
+            old = values.get(labels)
+            if old is None:
+                values[labels] = v
+            elif isinstance(v, list):
+                values[labels] = [a + b for a, b in zip(old, v)]
+            else:
+                values[labels] = old + v
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+        self._dir = None
+        self._flusher = None
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, *args, **kwargs):
+        return self.register(Counter(*args, **kwargs))
+
+    def gauge(self, *args, **kwargs):
+        return self.register(Gauge(*args, **kwargs))
+
+    def histogram(self, *args, **kwargs):
+        return self.register(Histogram(*args, **kwargs))
+
+    # --------------------------
+    # Multiprocess mode
+    # --------------------------
+    def enable_multiprocess(self, directory):
+        """
+        Called once before forking workers. Clears `directory`; from then
+        on every process keeps `<pid>.json` there up to date (see flush())
+        and render() reports the sum over all of them. Processes that have
+        exited are folded into `retired.json` (without their gauges).
+        Values recorded so far (preload, warmup) are dropped, as every
+        worker would otherwise inherit and report them again.
+        """
+        with self._lock:
+            for m in self._metrics:
+                if m.shared:
+                    m.reset()
+        os.makedirs(directory, exist_ok=True)
+        for name in os.listdir(directory):
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                pass
+        self._dir = directory
+
+    def flush(self):
+        if self._dir is None:
+            return
+        with self._lock:
+            metrics = [m for m in self._metrics if m.shared]
+        state = {m.name: [[list(k), v] for k, v in m.state().items()] for m in metrics}
+        path = os.path.join(self._dir, f"{os.getpid()}.json")
+        with open(path + ".tmp", "w") as f:
+            json.dump(state, f)
+        os.replace(path + ".tmp", path)
+
+    def start_flusher(self, interval=METRICS_FLUSH_S):
+        """
+        Flushes this process's values every `interval` seconds, so workers
+        that are not scraped still show up. Call in each worker after fork.
+        """
+        if self._dir is None or (self._flusher is not None and self._flusher[0] == os.getpid()):
+            return
+
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.flush()
+                except OSError as e:
+                    print(f"[WARN] Could not write metrics: {e}")
+
+        thread = threading.Thread(target=run, name="metrics-flush", daemon=True)
+        self._flusher = (os.getpid(), thread)
+        thread.start()
+
+    def _load(self, path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _combined(self, kinds):
+        self.flush()
+        totals = {}
+        with open(os.path.join(self._dir, ".lock"), "w") as lock:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+            retired_path = os.path.join(self._dir, "retired.json")
+            retired = {}
+            _add(retired, self._load(retired_path) or {}, kinds, gauges=False)
+            folded = []
+            for name in os.listdir(self._dir):
+                stem, ext = os.path.splitext(name)
+                if ext != ".json" or not stem.isdigit():
+                    continue
+                state = self._load(os.path.join(self._dir, name))
+                if state is None:
+                    continue
+                if _alive(int(stem)):
+                    _add(totals, state, kinds)
+                else:
+                    _add(retired, state, kinds, gauges=False)
+                    folded.append(name)
+            if folded:
+                with open(retired_path + ".tmp", "w") as f:
+                    json.dump({n: [[list(k), v] for k, v in values.items()] for n, values in retired.items()}, f)
+                os.replace(retired_path + ".tmp", retired_path)
+                for name in folded:
+                    os.remove(os.path.join(self._dir, name))
+        _add(totals, {n: [[list(k), v] for k, v in values.items()] for n, values in retired.items()}, kinds)
+        return totals
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        combined = None
+        if self._dir is not None:
+            combined = self._combined({m.name: m.kind for m in metrics if m.shared})
+        lines = []
+        for m in metrics:
+            if combined is None:
+                lines.extend(m.render())
+            elif m.shared:
+                lines.extend(m.render(combined.get(m.name, {})))
+            else:
+                lines.extend(m.render(extra=("pid", os.getpid())))
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+# --------------------------
+# Request stages, labelled by model_name
+# --------------------------
+UPLOAD_SECONDS = metrics.histogram("deepfake_upload_seconds", "Time to receive and store an upload.", ["model_name"])
+DECODE_SECONDS = metrics.histogram("deepfake_decode_seconds", "Frame sampling/decoding time per video.", ["model_name"])
+PREPROCESS_SECONDS = metrics.histogram("deepfake_preprocess_seconds", "Preprocessing time per video.", ["model_name"])
+FORWARD_SECONDS = metrics.histogram("deepfake_forward_seconds", "Model forward pass time per inference batch.", ["model_name"])
+AGGREGATE_SECONDS = metrics.histogram("deepfake_aggregate_seconds", "Score aggregation time per video.", ["model_name"])
+THUMBNAIL_SECONDS = metrics.histogram("deepfake_thumbnail_seconds", "Thumbnail encoding time per video.", ["model_name"])
+REQUEST_SECONDS = metrics.histogram("deepfake_request_seconds", "Total analysis request time.", ["model_name", "endpoint"])
+
+FRAMES_DECODED = metrics.counter("deepfake_frames_decoded_total", "Frames decoded.", ["model_name"])
+FRAMES_SCORED = metrics.counter("deepfake_frames_scored_total", "Frames scored by a model.", ["model_name"])
+BATCHES = metrics.counter("deepfake_inference_batches_total", "Inference batches run.", ["model_name"])
+REQUESTS = metrics.counter("deepfake_requests_total", "Analysis requests by outcome.", ["model_name", "endpoint", "status"])
+IN_FLIGHT = metrics.gauge("deepfake_requests_in_flight", "Analysis requests being processed.", ["endpoint"])
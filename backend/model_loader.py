@@ -0,0 +1,51 @@
+# model_loader.py
+# Builds the configured detector for a model name (shared by the server,
+# the batch runner and the tooling scripts). torch and the engines are
+# imported on the first load, not when the server starts.
+from config import MODEL_PATHS, SAMPLE_EVERY_N_FRAMES, CALIBRATION_FRAMES, WARMUP_ITERATIONS, SCHEDULER_MAX_BATCH
+from scheduler import InferenceScheduler
+from video_utils import sample_frames
+from metrics import FORWARD_SECONDS, FRAMES_SCORED, BATCHES
+from startup import startup
+
+
+def create_detector(model_name):
+    cfg = MODEL_PATHS[model_name]
+    if cfg.get("engine", "torch") == "onnx":
+        from onnx_detector import OnnxDeepfakeDetector
+        return OnnxDeepfakeDetector(cfg["onnx_path"])
+
+    with startup.phase("import_torch"):
+        import torch
+        from detector import DeepfakeDetector
+
+    runtime = cfg.get("runtime", "eager")
+    calibration_frames = None
+    if runtime == "int8" and cfg.get("calibration_video"):
+        calibration_frames = sample_frames(cfg["calibration_video"], every_n=SAMPLE_EVERY_N_FRAMES,
+                                           max_frames=CALIBRATION_FRAMES, resize=(224,224))
+    return DeepfakeDetector(
+        model_path=cfg["path"],
+        device="cuda" if torch.cuda.is_available() else "cpu",
+        runtime=runtime,
+        calibration_frames=calibration_frames,
+    )
+
+
+def load_scheduler(model_name, warmup=WARMUP_ITERATIONS, max_batch_size=SCHEDULER_MAX_BATCH, version=None):
+    """
+    Detector for model_name, warmed up and wrapped in an InferenceScheduler
+    that reports its batches to the metrics. `version` (of the checkpoint,
+    taken before loading it) is kept on the scheduler.
+    """
+    with startup.phase(f"load:{model_name}"):
+        det = create_detector(model_name)
+    with startup.phase(f"warmup:{model_name}"):
+        det.warmup(warmup)
+
+    def observe(frames, seconds):
+        FORWARD_SECONDS.observe(seconds, model_name)
+        FRAMES_SCORED.inc(frames, model_name)
+        BATCHES.inc(1, model_name)
+
+    return InferenceScheduler(det, max_batch_size=max_batch_size, observe=observe, version=version)
@@ -0,0 +1,65 @@
+# onnx_detector.py
+import json
+import os
+import numpy as np
+
+from config import BATCH_SIZE, ONNX_INTRA_OP_THREADS, ONNX_INTER_OP_THREADS
+from base_detector import BaseDetector
+
+
+def _read_metadata(session):
+    """
+    Preprocessing parameters written by export_onnx.py into the model's
+    metadata_props (absent for graphs exported elsewhere).
+    """
+    meta = session.get_modelmeta().custom_metadata_map
+    input_size = tuple(json.loads(meta["input_size"])) if "input_size" in meta else (224, 224)
+    normalize = json.loads(meta["normalize"]) if meta.get("normalize") else None
+    return input_size, normalize
+
+
+# --------------------------
+# OnnxDeepfakeDetector class
+# --------------------------
+class OnnxDeepfakeDetector(BaseDetector):
+    """
+    Deepfake detector running an exported ONNX graph (see export_onnx.py)
+    through ONNX Runtime on CPU. Same predict_frames/aggregate interface as
+    DeepfakeDetector, without PyTorch in the request path.
+    """
+    def __init__(self, model_path, batch_size=BATCH_SIZE,
+                 intra_op_threads=ONNX_INTRA_OP_THREADS, inter_op_threads=ONNX_INTER_OP_THREADS):
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(f"Model file not found: {model_path}")
+        import onnxruntime as ort
+
+        opts = ort.SessionOptions()
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        opts.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        opts.intra_op_num_threads = int(intra_op_threads)
+        opts.inter_op_num_threads = int(inter_op_threads)
+        self.session = ort.InferenceSession(model_path, sess_options=opts, providers=["CPUExecutionProvider"])
+
+        input_size, normalize = _read_metadata(self.session)
+        super().__init__(batch_size=batch_size, input_size=input_size, normalize=normalize)
+        self.device = "cpu"
+        self.model_path = model_path
+        self.runtime = "onnx"
+        self.input_name = self.session.get_inputs()[0].name
+
+        # Detect classifier type from the (batch, num_outputs) output shape
+        self.num_outputs = self.session.get_outputs()[0].shape[-1]
+        print(f"[INFO] Loaded ONNX model with {self.num_outputs} output(s).")
+
+    def memory_bytes(self) -> int:
+        # The session holds (roughly) one copy of the serialized weights
+        return os.path.getsize(self.model_path)
+
+    def score_batch(self, batch: np.ndarray) -> np.ndarray:
+        out = self.session.run(None, {self.input_name: batch})[0]
+        if self.num_outputs == 2:
+            # Softmax: probability of "fake"
+            e = np.exp(out - out.max(axis=1, keepdims=True))
+            return e[:, 1] / e.sum(axis=1)
+        # Sigmoid: direct probability
+        return (1.0 / (1.0 + np.exp(-out))).reshape(-1)
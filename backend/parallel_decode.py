@@ -0,0 +1,208 @@
+# parallel_decode.py
+# Segment-parallel frame sampling for long videos: the sampled frame
+# indices are split into contiguous segments, each decoded by a worker
+# process that seeks to its segment start and writes resized frames straight
+# into one shared-memory array, so no frame data is pickled back.
+#
+# The workers are long-lived decode_worker.py processes started with
+# subprocess rather than multiprocessing: spawn and forkserver children
+# re-run the parent's __main__, which would rebuild the whole Flask app (and
+# under serve.py import torch) in every worker. decode_worker.py imports
+# only cv2 and numpy.
+import json
+import os
+import queue
+import subprocess
+import sys
+import threading
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from config import BACKEND_DIR, DECODE_WORKERS, PARALLEL_DECODE_MIN_SPAN, SEEK_MIN_GAP
+from video_utils import iter_frames, plan_frame_indices, frame_count
+
+WORKER_SCRIPT = os.path.join(BACKEND_DIR, "decode_worker.py")
+
+
+class WorkerDied(Exception):
+    pass
+
+
+class DecodeWorker:
+    """
+    One decode_worker.py process; submit() sends a segment, result() waits
+    for its frame count. The process exits when its stdin closes.
+    """
+    def __init__(self):
+        self.proc = subprocess.Popen([sys.executable, WORKER_SCRIPT], cwd=BACKEND_DIR,
+                                     stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, bufsize=1)
+
+    def submit(self, **task):
+        try:
+            self.proc.stdin.write(json.dumps(task) + "\n")
+            self.proc.stdin.flush()
+        except (BrokenPipeError, OSError):
+            raise WorkerDied(f"decode worker {self.proc.pid} is gone")
+
+    def result(self):
+        line = self.proc.stdout.readline()
+        if not line:
+            raise WorkerDied(f"decode worker {self.proc.pid} exited ({self.proc.poll()})")
+        reply = json.loads(line)
+        if "error" in reply:
+            raise RuntimeError(reply["error"])
+        return reply["written"]
+
+    def kill(self):
+        try:
+            self.proc.kill()
+            self.proc.wait()
+        except OSError:
+            pass
+
+
+class DecodePool:
+    """
+    Up to `size` idle workers, started on demand. A call takes as many as
+    are free (never waits for one); dead workers are dropped and replaced
+    on a later call.
+    """
+    def __init__(self, size):
+        self.size = size
+        self._idle = queue.SimpleQueue()
+        self._started = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, n):
+        workers = []
+        while len(workers) < n:
+            try:
+                workers.append(self._idle.get_nowait())
+                continue
+            except queue.Empty:
+                pass
+            with self._lock:
+                if self._started >= self.size:
+                    break
+                self._started += 1
+            try:
+                workers.append(DecodeWorker())
+            except OSError:
+                with self._lock:
+                    self._started -= 1
+                break
+        return workers
+
+    def release(self, worker):
+        self._idle.put(worker)
+
+    def discard(self, worker):
+        worker.kill()
+        with self._lock:
+            self._started -= 1
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool(workers):
+    # One pool per process (a forked server worker starts its own) and per
+    # worker count
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid() or _pool.size != workers:
+            _pool = DecodePool(workers)
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def iter_frames_parallel(video_path, every_n=15, max_frames=40, resize=(256,256), spread=False,
+                         workers=DECODE_WORKERS, min_span=PARALLEL_DECODE_MIN_SPAN):
+    """
+    Drop-in for video_utils.iter_frames: yields (frame_index, frame) in the
+    same order as the sequential sampler, each segment as soon as it and
+    the ones before it are decoded. Short clips (sampled span < min_span
+    frames), workers <= 1, no `resize`, no free workers or a worker failure
+    fall back to the sequential path.
+    """
+    n_frames = frame_count(video_path) if workers > 1 and resize else 0
+    indices = plan_frame_indices(n_frames, every_n, max_frames, spread)
+    if len(indices) < 2 or indices[-1] - indices[0] < min_span:
+        yield from iter_frames(video_path, every_n, max_frames, resize, spread)
+        return
+
+    pool = _get_pool(workers)
+    procs = pool.acquire(min(workers, len(indices)))
+    if len(procs) < 2:
+        for w in procs:
+            pool.release(w)
+        yield from iter_frames(video_path, every_n, max_frames, resize, spread)
+        return
+
+    bounds = np.linspace(0, len(indices), len(procs) + 1).astype(int)
+    segments = [(int(bounds[i]), indices[bounds[i]:bounds[i + 1]]) for i in range(len(procs))]
+
+    w, h = resize
+    total = len(indices)
+    shm = shared_memory.SharedMemory(create=True, size=total * h * w * 3)
+    frames = np.ndarray((total, h, w, 3), dtype=np.uint8, buffer=shm.buf)
+    pending = []  # submitted, result not read yet
+    last = -1
+    failed = False
+    try:
+        for proc, (slot, seg) in zip(procs, segments):
+            if failed:
+                pool.release(proc)
+                continue
+            try:
+                proc.submit(video_path=video_path, indices=seg, resize=[w, h], shm_name=shm.name,
+                            total=total, slot=slot, seek_min_gap=SEEK_MIN_GAP)
+                pending.append((proc, (slot, seg)))
+            except WorkerDied as e:
+                # Died while idle
+                print(f"[WARN] {e}; decoding {video_path} sequentially.")
+                pool.discard(proc)
+                failed = True
+        while pending and not failed:
+            proc, (slot, seg) = pending.pop(0)
+            try:
+                written = proc.result()
+            except WorkerDied as e:
+                print(f"[WARN] {e}; decoding {video_path} sequentially.")
+                pool.discard(proc)
+                failed = True
+                break
+            except RuntimeError as e:
+                print(f"[WARN] Parallel decode of {video_path} failed ({e}); decoding sequentially.")
+                pool.release(proc)
+                failed = True
+                break
+            pool.release(proc)
+            for k in range(written):
+                last = seg[k]
+                yield seg[k], frames[slot + k].copy()
+            if written < len(seg):
+                # The video ended early (frame count overestimated); later
+                # segments lie past the end as well
+                break
+    finally:
+        # Collect the outstanding replies (also when the consumer stopped
+        # early) so the workers can be reused before the segment goes
+        for proc, _ in pending:
+            try:
+                proc.result()
+                pool.release(proc)
+            except WorkerDied:
+                pool.discard(proc)
+            except RuntimeError:
+                pool.release(proc)
+        del frames
+        shm.close()
+        shm.unlink()
+    if failed:
+        for index, frame in iter_frames(video_path, every_n, max_frames, resize, spread):
+            if index > last:
+                yield index, frame
@@ -0,0 +1,185 @@
+# pipeline.py
+# Streaming decode -> preprocess -> inference for one video. Each stage
+# runs in its own worker and hands work to the next through a bounded
+# queue, so batches start inferring as soon as they fill and peak memory
+# is bounded by the queue sizes rather than by the number of frames.
+import queue
+import threading
+import time
+
+from config import SAMPLE_EVERY_N_FRAMES, MAX_FRAMES, PIPELINE_QUEUE_BATCHES
+from base_detector import FrameBuffer
+from video_utils import iter_frames
+
+_DONE = object()
+
+
+class _StageError:
+    def __init__(self, error):
+        self.error = error
+
+
+class ScoredBatch:
+    """
+    One scored batch: sampled frame indices, the resized BGR frames and
+    their scores, in video order.
+    """
+    def __init__(self, indices, frames, scores):
+        self.indices = indices
+        self.frames = frames
+        self.scores = scores
+
+
+class PipelineStats:
+    def __init__(self):
+        self.frames_decoded = 0
+        self.frames_scored = 0
+        self.batches = 0
+        # Busy time of the decode and preprocess stages
+        self.decode_seconds = 0.0
+        self.preprocess_seconds = 0.0
+
+
+def _put(q, item, stop):
+    # Blocking put that gives up once the consumer has gone away
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _get(q, stop):
+    # Blocking get that gives up once the consumer has gone away
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            pass
+    return _DONE
+
+
+def _decode_stage(frame_source, frame_q, stop, stats):
+    try:
+        frames = iter(frame_source)
+        while True:
+            t0 = time.perf_counter()
+            item = next(frames, _DONE)
+            stats.decode_seconds += time.perf_counter() - t0
+            if item is _DONE or stop.is_set():
+                break
+            stats.frames_decoded += 1
+            if not _put(frame_q, item, stop):
+                return
+        _put(frame_q, _DONE, stop)
+    except Exception as e:
+        _put(frame_q, _StageError(e), stop)
+    finally:
+        # Release the capture right away when stopped early
+        close = getattr(frame_source, "close", None)
+        if close is not None:
+            close()
+
+
+def _preprocess_stage(frame_q, batch_q, buffers, batch_size, stop, stats):
+    ring = 0
+    indices, frames = [], []
+
+    def flush():
+        nonlocal ring, indices, frames
+        t0 = time.perf_counter()
+        # One batch per preprocessing target (input size, normalization)
+        batches = [buf.fill(frames) for buf in buffers[ring]]
+        stats.preprocess_seconds += time.perf_counter() - t0
+        ring = (ring + 1) % len(buffers)
+        ok = _put(batch_q, (indices, frames, batches), stop)
+        indices, frames = [], []
+        return ok
+
+    try:
+        while not stop.is_set():
+            item = _get(frame_q, stop)
+            if item is _DONE or isinstance(item, _StageError):
+                if frames and not flush():
+                    return
+                _put(batch_q, item, stop)
+                return
+            indices.append(item[0])
+            frames.append(item[1])
+            if len(frames) == batch_size and not flush():
+                return
+    except Exception as e:
+        _put(batch_q, _StageError(e), stop)
+
+
+def stream_preprocessed_batches(frame_source, targets, batch_size, queue_batches=PIPELINE_QUEUE_BATCHES,
+                                stats=None):
+    """
+    Generator yielding (indices, frames, batches) for each batch of frames
+    from `frame_source`, with one preprocessed NCHW batch per
+    (input_size, normalize) entry of `targets`, so frames decoded once can
+    feed several models. Decoding and preprocessing run in background
+    threads; closing the generator stops them. The preprocessed batches
+    live in a ring of reused buffers: they are only valid until the next
+    batch is requested, so callers must finish with (or copy) them first.
+    """
+    stats = stats if stats is not None else PipelineStats()
+    frame_q = queue.Queue(maxsize=queue_batches * batch_size)
+    batch_q = queue.Queue(maxsize=queue_batches)
+    # Queued batches + the one being filled + the one being scored
+    buffers = [[FrameBuffer(batch_size, size, normalize) for size, normalize in targets]
+               for _ in range(queue_batches + 2)]
+    stop = threading.Event()
+
+    workers = [
+        threading.Thread(target=_decode_stage, args=(frame_source, frame_q, stop, stats),
+                         name="pipeline-decode", daemon=True),
+        threading.Thread(target=_preprocess_stage, args=(frame_q, batch_q, buffers, batch_size, stop, stats),
+                         name="pipeline-preprocess", daemon=True),
+    ]
+    for w in workers:
+        w.start()
+
+    try:
+        while True:
+            item = batch_q.get()
+            if item is _DONE:
+                return
+            if isinstance(item, _StageError):
+                raise item.error
+            yield item
+    finally:
+        # Stages poll `stop` while blocked on their queues and exit promptly
+        stop.set()
+
+
+def stream_scored_batches(video_path, detector, score_fn=None, every_n=SAMPLE_EVERY_N_FRAMES,
+                          max_frames=MAX_FRAMES, spread=False, batch_size=None,
+                          queue_batches=PIPELINE_QUEUE_BATCHES, stats=None, frame_source=None):
+    """
+    Generator yielding a ScoredBatch for each batch of sampled frames as soon
+    as it is scored. Decoding and preprocessing run in background threads;
+    inference runs in the caller's thread through `score_fn` (a
+    predict_preprocessed callable, e.g. an InferenceScheduler's; defaults to
+    the detector's own). Closing the generator early stops decoding too.
+    `frame_source` replaces the default video_utils.iter_frames sampler.
+    """
+    batch_size = max(1, int(batch_size or detector.batch_size))
+    score_fn = score_fn or detector.predict_preprocessed
+    stats = stats if stats is not None else PipelineStats()
+    if frame_source is None:
+        frame_source = iter_frames(video_path, every_n=every_n, max_frames=max_frames,
+                                   resize=detector.input_size, spread=spread)
+
+    batches = stream_preprocessed_batches(frame_source, [(detector.input_size, detector.normalize)],
+                                          batch_size, queue_batches, stats)
+    try:
+        for indices, frames, (batch,) in batches:
+            scores = score_fn(batch)
+            stats.frames_scored += len(scores)
+            stats.batches += 1
+            yield ScoredBatch(indices, frames, scores)
+    finally:
+        batches.close()
@@ -0,0 +1,99 @@
+# procstats.py
+# Per-process memory figures from /proc (Linux). RSS counts every resident
+# page a process maps; PSS splits shared pages between the processes that
+# share them, so sum(PSS) << sum(RSS) across pre-forked workers shows the
+# model weights really are shared copy-on-write.
+import os
+
+_SMAPS_FIELDS = {
+    "Rss": "rss_bytes",
+    "Pss": "pss_bytes",
+    "Shared_Clean": "shared_clean_bytes",
+    "Shared_Dirty": "shared_dirty_bytes",
+    "Private_Clean": "private_clean_bytes",
+    "Private_Dirty": "private_dirty_bytes",
+}
+
+
+def process_memory(pid=None):
+    """
+    {"pid", "rss_bytes", "pss_bytes", "shared_*_bytes", "private_*_bytes"}
+    for `pid` (default: this process), or None where /proc is unavailable.
+    """
+    pid = pid or os.getpid()
+    mem = {"pid": pid}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                parts = line.split()
+                key = parts[0].rstrip(":")
+                if key in _SMAPS_FIELDS:
+                    mem[_SMAPS_FIELDS[key]] = int(parts[1]) * 1024
+    except OSError:
+        return rss_only(pid)
+    return mem
+
+
+def rss_only(pid=None):
+    pid = pid or os.getpid()
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            resident = int(f.read().split()[1])
+    except OSError:
+        return None
+    return {"pid": pid, "rss_bytes": resident * os.sysconf("SC_PAGE_SIZE")}
+
+
+def process_start_time(pid=None):
+    """
+    Wall-clock (epoch) time the process started, from its start time in
+    clock ticks since boot, or None where /proc is unavailable.
+    """
+    pid = pid or os.getpid()
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            # Field 22; the command name (field 2) may contain spaces
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/stat") as f:
+            boot = next(int(line.split()[1]) for line in f if line.startswith("btime"))
+    except (OSError, StopIteration, ValueError, IndexError):
+        return None
+    return boot + start_ticks / os.sysconf("SC_CLK_TCK")
+
+
+def child_pids(pid):
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            return [int(p) for p in f.read().split()]
+    except OSError:
+        return []
+
+
+def memory_report(pids):
+    """
+    Memory of each live pid plus totals; "sharing_ratio" is sum(RSS) /
+    sum(PSS), about the number of processes when nearly everything is shared
+    and 1.0 when nothing is.
+    """
+    rows = [m for m in (process_memory(p) for p in pids) if m is not None]
+    total_rss = sum(m.get("rss_bytes", 0) for m in rows)
+    total_pss = sum(m.get("pss_bytes", 0) for m in rows)
+    return {
+        "processes": rows,
+        "total_rss_bytes": total_rss,
+        "total_pss_bytes": total_pss,
+        "sharing_ratio": total_rss / total_pss if total_pss else None,
+    }
+
+
+def format_report(report):
+    lines = [f'{"pid":>8} {"rss MB":>10} {"pss MB":>10} {"shared MB":>10} {"private MB":>11}']
+    for m in report["processes"]:
+        shared = m.get("shared_clean_bytes", 0) + m.get("shared_dirty_bytes", 0)
+        private = m.get("private_clean_bytes", 0) + m.get("private_dirty_bytes", 0)
+        lines.append(f'{m["pid"]:>8} {m.get("rss_bytes", 0) / 2**20:>10.1f} {m.get("pss_bytes", 0) / 2**20:>10.1f} '
+                     f'{shared / 2**20:>10.1f} {private / 2**20:>11.1f}')
+    ratio = report["sharing_ratio"]
+    lines.append(f'{"total":>8} {report["total_rss_bytes"] / 2**20:>10.1f} {report["total_pss_bytes"] / 2**20:>10.1f}'
+                 f'   sharing ratio {ratio:.2f}' if ratio else f'{"total":>8} {report["total_rss_bytes"] / 2**20:>10.1f}')
+    return "\n".join(lines)
@@ -0,0 +1,129 @@
+# registry.py
+import threading
+import traceback
+from collections import OrderedDict
+
+
+class ModelRegistry:
+    """
+    Thread-safe registry of loaded models.
+
+    - each name is loaded exactly once, even under concurrent first requests
+      (one load lock per name, so loading one model never blocks another);
+    - entries are kept in LRU order and the least recently used ones are
+      evicted once the summed `size_of` exceeds `memory_budget_bytes`;
+    - `preload` loads (and, through the loader, warms up) a set of models
+      and flips `ready` when done so /health can report it.
+    """
+    def __init__(self, loader, size_of, memory_budget_bytes=0, on_evict=None):
+        self._loader = loader
+        self._size_of = size_of
+        self.memory_budget_bytes = int(memory_budget_bytes or 0)
+        self._on_evict = on_evict
+
+        self._entries = OrderedDict()  # name -> (value, nbytes)
+        self._lock = threading.Lock()
+        self._load_locks = {}
+        self._evictions = 0
+
+        self.ready = threading.Event()
+        self.preload_started = False
+        self.preload_errors = {}
+
+    # --------------------------
+    # Lookup / load
+    # --------------------------
+    def get(self, name):
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is not None:
+                self._entries.move_to_end(name)
+                return entry[0]
+            load_lock = self._load_locks.setdefault(name, threading.Lock())
+
+        with load_lock:
+            # Another thread may have finished loading while we waited
+            with self._lock:
+                entry = self._entries.get(name)
+                if entry is not None:
+                    self._entries.move_to_end(name)
+                    return entry[0]
+
+            value = self._loader(name)
+            nbytes = self._size_of(value)
+            with self._lock:
+                self._entries[name] = (value, nbytes)
+                evicted = self._evict_locked(keep=name)
+
+        for old_name, old_value in evicted:
+            print(f"[INFO] Evicted model '{old_name}' to stay within memory budget.")
+            if self._on_evict is not None:
+                self._on_evict(old_value)
+        return value
+
+    def _evict_locked(self, keep):
+        evicted = []
+        if self.memory_budget_bytes <= 0:
+            return evicted
+        while self._total_bytes_locked() > self.memory_budget_bytes and len(self._entries) > 1:
+            name = next(iter(self._entries))
+            if name == keep:
+                break
+            value, _ = self._entries.pop(name)
+            self._evictions += 1
+            evicted.append((name, value))
+        return evicted
+
+    def _total_bytes_locked(self):
+        return sum(nbytes for _, nbytes in self._entries.values())
+
+    def peek(self, name):
+        """
+        The loaded value for name, or None; neither loads nor touches the
+        LRU order.
+        """
+        with self._lock:
+            entry = self._entries.get(name)
+            return entry[0] if entry is not None else None
+
+    def loaded(self):
+        with self._lock:
+            return [(name, value) for name, (value, _) in self._entries.items()]
+
+    def sizes(self):
+        with self._lock:
+            return {name: nbytes for name, (_, nbytes) in self._entries.items()}
+
+    # --------------------------
+    # Startup preload
+    # --------------------------
+    def preload(self, names, on_done=None):
+        self.preload_started = True
+        for name in names:
+            try:
+                self.get(name)
+            except Exception as e:
+                traceback.print_exc()
+                self.preload_errors[name] = str(e)
+        self.ready.set()
+        if on_done is not None:
+            on_done()
+
+    def preload_async(self, names, on_done=None):
+        self.preload_started = True
+        t = threading.Thread(target=self.preload, args=(list(names), on_done), name="model-preload", daemon=True)
+        t.start()
+        return t
+
+    def is_ready(self):
+        # Lazy mode (no preload requested) is always ready
+        return self.ready.is_set() or not self.preload_started
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "loaded": list(self._entries.keys()),
+                "memory_bytes": self._total_bytes_locked(),
+                "memory_budget_bytes": self.memory_budget_bytes,
+                "evictions": self._evictions,
+            }
@@ -0,0 +1,160 @@
+# result_cache.py
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+def checkpoint_version(path):
+    """
+    Cheap fingerprint of a checkpoint file. Any rewrite of the file changes
+    its size or mtime, and with it every cache key built from it.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return "missing"
+    return f"{st.st_size}-{st.st_mtime_ns}"
+
+
+def make_key(upload_hash, model_name, version, **params):
+    """
+    Cache key for one analysis: upload content hash, model, checkpoint
+    version and every sampling/scoring parameter that changes the result.
+    """
+    payload = json.dumps({"upload": upload_hash, "model": model_name,
+                          "version": version, "params": params}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+# --------------------------
+# Two-tier result cache
+# --------------------------
+class ResultCache:
+    """
+    In-memory LRU of recent results in front of an on-disk JSON store.
+    The disk tier is bounded by `disk_bytes`; the least recently used files
+    (by mtime, refreshed on every hit) are deleted first. The directory
+    itself is the index, so processes sharing it (serve.py workers) see
+    each other's entries; usage is rescanned at least every `rescan_s`
+    seconds and whenever this process's estimate goes over budget.
+    """
+    def __init__(self, cache_dir, memory_entries=256, disk_bytes=512 * 1024 * 1024, rescan_s=10):
+        self.cache_dir = cache_dir
+        self.memory_entries = int(memory_entries)
+        self.disk_bytes = int(disk_bytes)
+        self.rescan_s = rescan_s
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "disk_evictions": 0}
+
+        os.makedirs(cache_dir, exist_ok=True)
+        # Directory usage as of the last scan, plus this process's stores
+        self._disk_total = 0
+        self._scanned = float("-inf")
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + ".json")
+
+    def _remember(self, key, value):
+        # Called with self._lock held
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key):
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self._counters["memory_hits"] += 1
+                return self._memory[key]
+
+        # Stored by any process, unless evicted meanwhile
+        try:
+            with open(self._path(key), "r") as f:
+                value = json.load(f)
+            os.utime(self._path(key))
+        except (OSError, ValueError):
+            value = None
+        with self._lock:
+            if value is None:
+                self._counters["misses"] += 1
+                return None
+            self._remember(key, value)
+            self._counters["disk_hits"] += 1
+        return value
+
+    def put(self, key, value):
+        data = json.dumps(value).encode("utf-8")
+        path = self._path(key)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+        with self._lock:
+            self._remember(key, value)
+            self._disk_total += len(data)
+            self._counters["stores"] += 1
+            now = time.monotonic()
+            if self._disk_total <= self.disk_bytes and now - self._scanned < self.rescan_s:
+                return
+            self._scanned = now
+        # Scan and delete outside the lock; memory hits go on meanwhile
+        total, evicted = self._evict_disk(keep=key)
+        with self._lock:
+            self._disk_total = total
+            self._counters["disk_evictions"] += evicted
+
+    def _scan(self):
+        # [(mtime, size, key)] of the files on disk
+        entries = []
+        try:
+            with os.scandir(self.cache_dir) as it:
+                for entry in it:
+                    if not entry.name.endswith(".json"):
+                        continue
+                    try:
+                        st = entry.stat()
+                    except OSError:
+                        continue
+                    entries.append((st.st_mtime, st.st_size, entry.name[:-len(".json")]))
+        except OSError:
+            pass
+        return entries
+
+    def _evict_disk(self, keep):
+        """
+        Deletes the least recently used files until the directory fits the
+        budget (never `keep`); returns (bytes left, files deleted).
+        """
+        entries = sorted(self._scan())
+        total = sum(size for _, size, _ in entries)
+        evicted = 0
+        for _, size, key in entries:
+            if total <= self.disk_bytes:
+                break
+            if key == keep:
+                continue
+            try:
+                os.remove(self._path(key))
+                evicted += 1
+            except OSError:
+                pass   # evicted by another process
+            total -= size
+        return total, evicted
+
+    def stats(self) -> dict:
+        entries = self._scan()
+        with self._lock:
+            lookups = self._counters["memory_hits"] + self._counters["disk_hits"] + self._counters["misses"]
+            hits = self._counters["memory_hits"] + self._counters["disk_hits"]
+            return dict(self._counters,
+                        hit_ratio=hits / lookups if lookups else 0.0,
+                        memory_entries=len(self._memory),
+                        disk_entries=len(entries),
+                        disk_bytes=sum(size for _, size, _ in entries),
+                        disk_budget_bytes=self.disk_bytes)
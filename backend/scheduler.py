@@ -0,0 +1,195 @@
+# scheduler.py
+import os
+import threading
+import time
+from collections import deque
+from typing import List
+
+import numpy as np
+
+from config import SCHEDULER_MAX_BATCH, SCHEDULER_MAX_WAIT_MS
+from base_detector import preprocess_frames_into
+
+
+class _PendingRequest:
+    """
+    Scores of one predict_frames() call, filled in batch by batch.
+    """
+    def __init__(self, n):
+        self.scores = [None] * n
+        self.remaining = n
+        self.error = None
+        self.done = threading.Event()
+
+    def set_score(self, i, score):
+        self.scores[i] = score
+        self.remaining -= 1
+        if self.remaining == 0:
+            self.done.set()
+
+    def fail(self, error):
+        if not self.done.is_set():
+            self.error = error
+            self.done.set()
+
+
+# --------------------------
+# Dynamic micro-batching
+# --------------------------
+class InferenceScheduler:
+    """
+    Sits in front of a DeepfakeDetector and merges frames from all in-flight
+    requests into one queue. A single worker thread forms batches of up to
+    `max_batch_size` frames, waiting at most `max_wait_ms` for a batch to
+    fill, and routes each score back to the request it came from.
+    `observe(frames, seconds)`, if given, is called after every batch.
+    """
+    def __init__(self, detector, max_batch_size=SCHEDULER_MAX_BATCH, max_wait_ms=SCHEDULER_MAX_WAIT_MS,
+                 observe=None, version=None):
+        self.detector = detector
+        self.observe = observe
+        # Checkpoint version the detector was loaded from (result cache keys)
+        self.version = version
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, max_wait_ms / 1000.0)
+
+        self._pending = deque()  # (request, frame index, frame)
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = None
+        self._pid = None
+
+        # Statistics
+        self._requests = 0
+        self._batches = 0
+        self._frames = 0
+        self._full_batches = 0
+        self._max_queue_depth = 0
+
+    def _ensure_worker(self):
+        # Called with self._cond held. The worker is started lazily (and
+        # again after a fork) because threads do not survive os.fork().
+        if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="inference-scheduler", daemon=True)
+            self._thread.start()
+
+    # --------------------------
+    # Detector interface
+    # --------------------------
+    def predict_frames(self, frames: List[np.ndarray]) -> List[float]:
+        """
+        Queue frames for batched inference and block until all of their
+        scores are available. Same contract as DeepfakeDetector.predict_frames.
+        """
+        return self._submit(frames, self.detector.predict_frames)
+
+    def predict_preprocessed(self, batch: np.ndarray) -> List[float]:
+        """
+        Same as predict_frames for an already preprocessed NCHW float32
+        batch (see pipeline.py). Rows are copied into the worker's own batch
+        buffer, so `batch` may be reused once this returns.
+        """
+        return self._submit(batch, self.detector.predict_preprocessed)
+
+    def _submit(self, samples, fallback):
+        if len(samples) == 0:
+            return []
+        req = _PendingRequest(len(samples))
+        with self._cond:
+            if self._closed:
+                return fallback(samples)
+            self._ensure_worker()
+            self._pending.extend((req, i, s) for i, s in enumerate(samples))
+            self._requests += 1
+            self._max_queue_depth = max(self._max_queue_depth, len(self._pending))
+            self._cond.notify()
+
+        req.done.wait()
+        if req.error is not None:
+            raise req.error
+        return req.scores
+
+    def aggregate(self, scores: List[float]) -> dict:
+        return self.detector.aggregate(scores)
+
+    # --------------------------
+    # Worker
+    # --------------------------
+    def _next_batch(self):
+        with self._cond:
+            while not self._pending and not self._closed:
+                self._cond.wait()
+            if not self._pending:
+                return None
+
+            # Give other requests a short window to top up the batch
+            deadline = time.monotonic() + self.max_wait
+            while len(self._pending) < self.max_batch_size and not self._closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            n = min(len(self._pending), self.max_batch_size)
+            return [self._pending.popleft() for _ in range(n)]
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            t0 = time.perf_counter()
+            try:
+                scores = self._score(batch)
+            except Exception as e:
+                for req, _, _ in batch:
+                    req.fail(e)
+            else:
+                if self.observe is not None:
+                    self.observe(len(batch), time.perf_counter() - t0)
+                for (req, i, _), score in zip(batch, scores):
+                    req.set_score(i, score)
+
+            with self._cond:
+                self._batches += 1
+                self._frames += len(batch)
+                if len(batch) == self.max_batch_size:
+                    self._full_batches += 1
+
+    def _score(self, batch):
+        # Raw uint8 frames and preprocessed float32 rows can share a batch
+        det = self.detector
+        buf = det.frame_buffer(self.max_batch_size)
+        rows = buf.batch[:len(batch)]
+        for j, (_, _, sample) in enumerate(batch):
+            if sample.dtype == np.uint8:
+                preprocess_frames_into([sample], rows[j:j + 1], det.input_size, buf.scratch, det.normalize)
+            else:
+                rows[j] = sample
+        return det.collect_scores([det.score_batch(rows)])
+
+    def close(self):
+        """
+        Stop accepting work; queued frames are still scored before the
+        worker exits. Later calls fall back to the detector directly.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def stats(self) -> dict:
+        with self._cond:
+            batches = self._batches
+            return {
+                "queue_depth": len(self._pending),
+                "max_queue_depth": self._max_queue_depth,
+                "requests": self._requests,
+                "batches": batches,
+                "frames": self._frames,
+                "full_batches": self._full_batches,
+                "mean_batch_size": self._frames / batches if batches else 0.0,
+                "mean_batch_fill": self._frames / (batches * self.max_batch_size) if batches else 0.0,
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000.0,
+            }
@@ -0,0 +1,68 @@
+# sequential.py
+# Early-exit rules for sequential frame scoring: frames are scored in small
+# batches and scoring stops once the video-level verdict is settled.
+import math
+from typing import List
+
+import numpy as np
+
+from config import EARLY_EXIT_METHOD, EARLY_EXIT_DELTA, EARLY_EXIT_MIN_FRAMES
+
+
+class HoeffdingRule:
+    """
+    Stops once the Hoeffding confidence interval of the mean frame score
+    (scores are bounded in [0, 1]) at level 1 - delta no longer contains
+    `threshold`.
+    """
+    def __init__(self, delta=0.05, min_frames=8, threshold=0.5):
+        self.delta = delta
+        self.min_frames = min_frames
+        self.threshold = threshold
+
+    def half_width(self, n):
+        return math.sqrt(math.log(2.0 / self.delta) / (2.0 * n))
+
+    def settled(self, scores: List[float]) -> bool:
+        n = len(scores)
+        if n < self.min_frames:
+            return False
+        return abs(float(np.mean(scores)) - self.threshold) >= self.half_width(n)
+
+
+class SPRTRule:
+    """
+    Wald's sequential probability ratio test on per-frame verdicts
+    (score > threshold). H0: a fraction p0 of frames look fake (real video),
+    H1: a fraction p1 do (fake video); alpha/beta are the error rates.
+    """
+    def __init__(self, p0=0.2, p1=0.8, alpha=0.05, beta=0.05, min_frames=8, threshold=0.5):
+        self.min_frames = min_frames
+        self.threshold = threshold
+        self.llr_fake = math.log(p1 / p0)
+        self.llr_real = math.log((1.0 - p1) / (1.0 - p0))
+        self.upper = math.log((1.0 - beta) / alpha)
+        self.lower = math.log(beta / (1.0 - alpha))
+
+    def settled(self, scores: List[float]) -> bool:
+        n = len(scores)
+        if n < self.min_frames:
+            return False
+        fake = int((np.asarray(scores) > self.threshold).sum())
+        llr = fake * self.llr_fake + (n - fake) * self.llr_real
+        return llr >= self.upper or llr <= self.lower
+
+
+EARLY_EXIT_METHODS = ("hoeffding", "sprt")
+
+
+def make_rule(method=EARLY_EXIT_METHOD, delta=EARLY_EXIT_DELTA, min_frames=EARLY_EXIT_MIN_FRAMES):
+    """
+    Builds the configured rule; `delta` is the Hoeffding miscoverage or
+    both SPRT error rates.
+    """
+    if method == "hoeffding":
+        return HoeffdingRule(delta=delta, min_frames=min_frames)
+    if method == "sprt":
+        return SPRTRule(alpha=delta, beta=delta, min_frames=min_frames)
+    raise ValueError(f"Unknown early-exit method '{method}'. Available: {EARLY_EXIT_METHODS}")
@@ -0,0 +1,278 @@
+"""
+Pre-fork production server. The master process loads and warms up the
+preloaded models once, binds the listening socket and forks SERVE_WORKERS
+workers that share the model weights copy-on-write. Each worker runs a
+threaded werkzeug server on the inherited socket with its own slice of the
+CPU cores for torch.
+
+Signals (to the master):
+    SIGHUP          graceful restart: fork fresh workers from the already
+                    loaded models, then let the old ones finish their
+                    in-flight requests and jobs and exit
+    SIGTERM/SIGINT  graceful stop
+    SIGUSR1         log RSS/PSS of the master and every worker
+
+Usage:
+python serve.py [--workers 4] [--port 8000] [--torch_threads 0]
+
+CPU only: CUDA cannot be used across fork(), so CUDA is hidden from the
+master and serve.py refuses to start if torch still sees a GPU; GPU hosts
+should keep using a single process. The upload reaper runs in its own
+child process, so the master stays single-threaded when it forks.
+
+Requests land on any worker. State that must outlive one request is kept
+in files the workers share: uploads (UPLOAD_DIR), the result cache
+(RESULT_CACHE_DIR), job records (JOB_DIR) and "url" thumbnails
+(THUMBNAIL_STORE_DIR). /metrics sums the counters and histograms of all
+workers (SERVE_METRICS_DIR). Admission limits apply per worker.
+"""
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+
+# Workers are forked after the models are loaded; keep CUDA uninitialised
+# (overriding any inherited setting, which would let the preload use it)
+if os.environ.get("CUDA_VISIBLE_DEVICES"):
+    print(f'[WARN] Ignoring CUDA_VISIBLE_DEVICES={os.environ["CUDA_VISIBLE_DEVICES"]}: serve.py is CPU only.')
+os.environ["CUDA_VISIBLE_DEVICES"] = ""
+
+from werkzeug.serving import make_server
+import torch
+
+from config import (SERVE_HOST, SERVE_PORT, SERVE_WORKERS, SERVE_TORCH_THREADS, SERVE_GRACEFUL_TIMEOUT_S,
+                    SERVE_MEMORY_REPORT_S, SERVE_METRICS_DIR, PRELOAD_MODELS, WARMUP_ITERATIONS, MODEL_PATHS)
+from procstats import memory_report, format_report
+import app as server
+
+
+def torch_threads_per_worker(workers, requested=SERVE_TORCH_THREADS):
+    if requested > 0:
+        return requested
+    return max(1, (os.cpu_count() or 1) // workers)
+
+
+# --------------------------
+# Worker
+# --------------------------
+def run_worker(sock, torch_threads):
+    """
+    Body of a forked worker; never returns.
+    """
+    for sig in (signal.SIGHUP, signal.SIGUSR1):
+        signal.signal(sig, signal.SIG_IGN)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the master handles Ctrl-C
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)  # until the server is up
+
+    torch.set_num_threads(torch_threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass  # already fixed by inference in the master
+
+    # Warm up this process's thread pools and allocator; the scheduler
+    # threads (started lazily after a fork) come up on the first request
+    for name, sched in server.registry.loaded():
+        sched.detector.warmup(WARMUP_ITERATIONS)
+
+    host, port = sock.getsockname()[:2]
+    srv = make_server(host, port, server.app, threaded=True, fd=sock.fileno())
+    # Non-daemon request threads so server_close() waits for in-flight requests
+    srv.daemon_threads = False
+
+    def stop(signum, frame):
+        threading.Thread(target=srv.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    server.metrics.start_flusher()
+    print(f"[INFO] Worker {os.getpid()} serving with {torch_threads} torch threads.")
+    try:
+        srv.serve_forever()
+        srv.server_close()
+        server.job_manager.close(wait=True)
+        server.metrics.flush()
+    finally:
+        os._exit(0)
+
+
+# --------------------------
+# Master
+# --------------------------
+class Master:
+    def __init__(self, sock, workers, torch_threads, graceful_timeout, memory_report_s):
+        self.sock = sock
+        self.num_workers = workers
+        self.torch_threads = torch_threads
+        self.graceful_timeout = graceful_timeout
+        self.memory_report_s = memory_report_s
+        self.workers = set()
+        self.retiring = {}  # pid -> SIGTERM time
+        self.reaper_pid = None
+        self._signals = []
+
+    def spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            run_worker(self.sock, self.torch_threads)
+        self.workers.add(pid)
+        return pid
+
+    def spawn_reaper(self):
+        """
+        Upload reaper in a child process of its own: a reaper thread in the
+        master would make every fork() a fork of a multi-threaded process.
+        """
+        pid = os.fork()
+        if pid == 0:
+            for sig in (signal.SIGHUP, signal.SIGUSR1, signal.SIGINT):
+                signal.signal(sig, signal.SIG_IGN)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            try:
+                server.upload_reaper.run_forever()
+            finally:
+                os._exit(0)
+        self.reaper_pid = pid
+        return pid
+
+    def retire(self, pids):
+        for pid in pids:
+            self.workers.discard(pid)
+            self.retiring[pid] = time.monotonic()
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            if pid in self.workers:
+                self.workers.discard(pid)
+                print(f"[WARN] Worker {pid} exited unexpectedly (status {status}); restarting.")
+                self.spawn()
+            elif pid == self.reaper_pid:
+                print(f"[WARN] Upload reaper {pid} exited unexpectedly (status {status}); restarting.")
+                self.spawn_reaper()
+            self.retiring.pop(pid, None)
+
+    def kill_stragglers(self):
+        now = time.monotonic()
+        for pid, since in list(self.retiring.items()):
+            if now - since > self.graceful_timeout:
+                print(f"[WARN] Worker {pid} did not stop within {self.graceful_timeout}s; killing it.")
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+                self.retiring[pid] = float("inf")
+
+    def log_memory(self):
+        pids = [os.getpid()] + sorted(self.workers)
+        print("[INFO] Memory per process:\n" + format_report(memory_report(pids)))
+
+    def run(self):
+        for sig in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT, signal.SIGUSR1):
+            signal.signal(sig, lambda signum, frame: self._signals.append(signum))
+
+        for _ in range(self.num_workers):
+            self.spawn()
+        self.spawn_reaper()
+        print(f"[INFO] Master {os.getpid()} started {self.num_workers} workers on "
+              f"{self.sock.getsockname()[0]}:{self.sock.getsockname()[1]}.")
+
+        next_report = time.monotonic() + self.memory_report_s if self.memory_report_s else None
+        while True:
+            while self._signals:
+                sig = self._signals.pop(0)
+                if sig == signal.SIGHUP:
+                    print("[INFO] Graceful restart.")
+                    old = list(self.workers)
+                    for _ in range(self.num_workers):
+                        self.spawn()
+                    self.retire(old)
+                elif sig == signal.SIGUSR1:
+                    self.log_memory()
+                else:
+                    print("[INFO] Shutting down.")
+                    reaper, self.reaper_pid = self.reaper_pid, None
+                    self.retire(list(self.workers) + ([reaper] if reaper else []))
+                    self.stop()
+                    return
+            self.reap()
+            self.kill_stragglers()
+            if next_report is not None and time.monotonic() >= next_report:
+                self.log_memory()
+                next_report = time.monotonic() + self.memory_report_s
+            time.sleep(0.2)
+
+    def stop(self):
+        while self.retiring:
+            self.reap()
+            self.kill_stragglers()
+            # Reap() only drops pids it sees exit; forget ones already gone
+            for pid in list(self.retiring):
+                try:
+                    os.kill(pid, 0)
+                except ProcessLookupError:
+                    self.retiring.pop(pid, None)
+            time.sleep(0.2)
+
+
+def main(args):
+    workers = max(1, args.workers)
+    torch_threads = torch_threads_per_worker(workers, args.torch_threads)
+
+    # One thread while loading: the master never serves, and an OpenMP pool
+    # started here would not survive fork()
+    if torch.cuda.is_available():
+        print("[ERROR] torch sees a CUDA device; serve.py forks after loading models and is CPU only.")
+        return 1
+    torch.set_num_threads(1)
+    t0 = time.perf_counter()
+    # ONNX Runtime's thread pools do not survive fork(); those models are
+    # loaded by each worker on first use
+    names = [n for n in PRELOAD_MODELS if MODEL_PATHS[n].get("engine", "torch") != "onnx"]
+    server.registry.preload(names)
+    if server.registry.preload_errors:
+        print(f"[WARN] Preload errors: {server.registry.preload_errors}")
+    print(f"[INFO] Loaded {names} in {time.perf_counter() - t0:.1f}s.")
+
+    sock = socket.create_server((args.host, args.port), backlog=2048)
+    sock.set_inheritable(True)
+    os.environ["SERVE_MASTER_PID"] = str(os.getpid())
+    # /metrics on any worker reports the sum over all workers
+    server.metrics.enable_multiprocess(SERVE_METRICS_DIR)
+    # UPLOAD_DIR is reaped by one child of the master (Master.spawn_reaper);
+    # workers' uploads hold shared locks
+
+    # Move everything allocated so far out of the GC's reach, so collections
+    # in the workers do not touch (and un-share) the master's pages
+    gc.collect()
+    gc.freeze()
+
+    master = Master(sock, workers, torch_threads, args.graceful_timeout, args.memory_report)
+    master.run()
+    sock.close()
+    return 0
+
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    p.add_argument('--host', type=str, default=SERVE_HOST)
+    p.add_argument('--port', '-p', type=int, default=SERVE_PORT)
+    p.add_argument('--workers', '-w', type=int, default=SERVE_WORKERS)
+    p.add_argument('--torch_threads', type=int, default=SERVE_TORCH_THREADS,
+                   help='torch intra-op threads per worker (0 = cores / workers)')
+    p.add_argument('--graceful_timeout', type=float, default=SERVE_GRACEFUL_TIMEOUT_S)
+    p.add_argument('--memory_report', type=float, default=SERVE_MEMORY_REPORT_S,
+                   help='log RSS/PSS every N seconds (0 = only on SIGUSR1)')
+    sys.exit(main(p.parse_args()))
@@ -0,0 +1,62 @@
+# startup.py
+# Timings of the server's startup phases (imports, app setup, per-model
+# load and warmup), kept for /stats/startup and the startup log. Import
+# this module first: its own import time is the reference point for the
+# "ready" milestones.
+import threading
+import time
+from contextlib import contextmanager
+
+from procstats import process_start_time
+
+
+class StartupTimer:
+    def __init__(self):
+        self.created = time.time()
+        self._t0 = time.perf_counter()
+        # Coarse (btime has 1s resolution); covers interpreter start-up
+        # before this module was imported
+        self.process_started = process_start_time()
+        self._phases = {}
+        self._milestones = {}
+        self._lock = threading.Lock()
+
+    def elapsed(self):
+        return time.perf_counter() - self._t0
+
+    def record(self, name, seconds):
+        # Only the first occurrence counts; later model reloads are not startup
+        with self._lock:
+            self._phases.setdefault(name, seconds)
+
+    @contextmanager
+    def phase(self, name):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - t0)
+
+    def mark(self, name):
+        """
+        Records milestone `name` as the seconds since this module was
+        imported, and logs it.
+        """
+        elapsed = self.elapsed()
+        with self._lock:
+            if name in self._milestones:
+                return
+            self._milestones[name] = elapsed
+        print(f"[INFO] Startup: {name} after {elapsed:.3f}s")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "started_at": self.created,
+                "before_import_s": (self.created - self.process_started) if self.process_started else None,
+                "phases_s": dict(self._phases),
+                "milestones_s": dict(self._milestones),
+            }
+
+
+startup = StartupTimer()
@@ -0,0 +1,80 @@
+# streaming.py
+# Incremental responses: an analysis runs in a background thread and
+# reports events through a queue, which the response generator drains and
+# writes out as Server-Sent Events or NDJSON lines as they arrive.
+import json
+import queue
+import threading
+import traceback
+
+STREAM_FORMATS = ("sse", "ndjson")
+STREAM_MIMETYPES = {"sse": "text/event-stream", "ndjson": "application/x-ndjson"}
+
+_END = object()
+
+
+class StreamClosed(Exception):
+    """
+    Raised inside the producer once the client has gone away.
+    """
+
+
+def format_event(event, data, fmt="sse"):
+    if fmt == "ndjson":
+        return json.dumps(dict(data, event=event)) + "\n"
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class EventStream:
+    """
+    Iterable of formatted events for a streaming Response. `produce(emit)`
+    starts right away in a worker thread and calls emit(event, data) for
+    each event; an exception ends the stream with an "error" event.
+    close() (called by the server when the client goes away, even before
+    the first event was sent) makes the next emit raise StreamClosed so the
+    producer unwinds and runs its cleanup. SSE streams get a comment line
+    every `heartbeat_s` seconds of silence to keep proxies from timing out.
+    """
+    def __init__(self, produce, fmt="sse", heartbeat_s=15.0):
+        self.fmt = fmt
+        self.heartbeat_s = heartbeat_s
+        self._events = queue.Queue()
+        self._closed = threading.Event()
+        self._produce = produce
+        threading.Thread(target=self._run, name="stream-producer", daemon=True).start()
+
+    def _emit(self, event, data):
+        if self._closed.is_set():
+            raise StreamClosed()
+        self._events.put((event, data))
+
+    def _run(self):
+        try:
+            self._produce(self._emit)
+        except StreamClosed:
+            pass
+        except Exception as e:
+            traceback.print_exc()
+            self._events.put(("error", {"error": str(e)}))
+        finally:
+            self._events.put(_END)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while not self._closed.is_set():
+            try:
+                item = self._events.get(timeout=self.heartbeat_s)
+            except queue.Empty:
+                if self.fmt == "sse":
+                    return ": keep-alive\n\n"
+                continue
+            if item is _END:
+                break
+            return format_event(item[0], item[1], self.fmt)
+        self._closed.set()
+        raise StopIteration
+
+    def close(self):
+        self._closed.set()
@@ -0,0 +1,192 @@
+# thumbnails.py
+import hashlib
+import heapq
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from config import (THUMBNAIL_COUNT, THUMBNAIL_SELECTION, THUMBNAIL_FORMAT, THUMBNAIL_SIZE,
+                    THUMBNAIL_QUALITY, THUMBNAIL_ENCODE_WORKERS, THUMBNAIL_STORE_MB, THUMBNAIL_STORE_DIR)
+from video_utils import encode_thumbnail, THUMBNAIL_MIME
+
+# cv2.imencode releases the GIL, so a few threads encode alongside inference
+_encoder_pool = ThreadPoolExecutor(max_workers=THUMBNAIL_ENCODE_WORKERS, thread_name_prefix="thumbnail")
+
+
+# --------------------------
+# Thumbnail selection
+# --------------------------
+class ThumbnailCollector:
+    """
+    Picks the thumbnail frames of one analysis while batches are scored:
+    the first `count` frames ("first") or the `count` highest-scoring ones
+    ("top"). In "first" mode every kept frame is final and is encoded right
+    away in the background pool, overlapping inference. In "top" mode the
+    heap holds the frames themselves (the decoder hands out a fresh array
+    per frame) and only the final top set is encoded, in parallel, by
+    results(); frames pushed out of the heap are never encoded.
+    """
+    def __init__(self, count=THUMBNAIL_COUNT, selection=THUMBNAIL_SELECTION, fmt=THUMBNAIL_FORMAT,
+                 size=THUMBNAIL_SIZE, quality=THUMBNAIL_QUALITY):
+        if selection not in ("first", "top"):
+            raise ValueError(f"Unknown thumbnail selection '{selection}'. Available: ('first', 'top')")
+        self.count = count
+        self.selection = selection
+        self.fmt = fmt
+        self.size = size
+        self.quality = quality
+        self._kept = []   # "first": list of encodes, "top": min-heap of (key, position, ..., frame)
+        self.encode_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def _timed_encode(self, frame):
+        t0 = time.perf_counter()
+        data = encode_thumbnail(frame, self.fmt, self.size, self.quality)
+        with self._lock:
+            self.encode_seconds += time.perf_counter() - t0
+        return data
+
+    def _encode(self, frame):
+        return _encoder_pool.submit(self._timed_encode, frame)
+
+    def add(self, position, frame_index, frame, score):
+        if self.count <= 0:
+            return
+        if self.selection == "first":
+            if len(self._kept) < self.count:
+                self._kept.append((score, position, frame_index, self._encode(frame)))
+            return
+        # Ties keep the earlier frame
+        key = (score, -position)
+        if len(self._kept) < self.count:
+            heapq.heappush(self._kept, (key, position, frame_index, frame))
+        elif key > self._kept[0][0]:
+            heapq.heapreplace(self._kept, (key, position, frame_index, frame))
+
+    def add_batch(self, first_position, frame_indices, frames, scores):
+        for k, (frame_index, frame, score) in enumerate(zip(frame_indices, frames, scores)):
+            self.add(first_position + k, frame_index, frame, score)
+
+    def results(self):
+        """
+        [{"index", "frame_index", "score", "data", "format"}] in position
+        order ("first") or by descending score ("top").
+        """
+        if self.selection == "first":
+            kept = [(score, pos, idx, fut) for score, pos, idx, fut in self._kept]
+        else:
+            kept = [(key[0], pos, idx, self._encode(frame))
+                    for key, pos, idx, frame in sorted(self._kept, key=lambda e: e[0], reverse=True)]
+        return [{"index": pos, "frame_index": idx, "score": score, "data": fut.result(), "format": self.fmt}
+                for score, pos, idx, fut in kept]
+
+
+# --------------------------
+# Content-addressed thumbnail store
+# --------------------------
+class ThumbnailStore:
+    """
+    Encoded thumbnails served on /thumbnails/<id>, one file each under
+    `root`, so every serve.py worker can serve any of them. Least recently
+    used files go once the directory exceeds `max_bytes`; usage is rescanned
+    at least every `rescan_s` seconds to see other processes' additions. Ids
+    are content hashes, so identical thumbnails share an entry and URLs stay
+    valid for as long as the entry survives.
+    """
+    def __init__(self, root=THUMBNAIL_STORE_DIR, max_bytes=THUMBNAIL_STORE_MB * 1024 * 1024, rescan_s=10):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.rescan_s = rescan_s
+        os.makedirs(root, exist_ok=True)
+        self._usage = 0
+        self._scanned = float("-inf")
+        self._lock = threading.Lock()
+
+    def _path(self, thumb_id):
+        m = re.fullmatch(r"[0-9a-f]{40}\.(\w+)", thumb_id)
+        if m is None or m.group(1) not in THUMBNAIL_MIME:
+            return None
+        return os.path.join(self.root, thumb_id)
+
+    def _touch(self, path):
+        # mtime is the LRU order
+        try:
+            os.utime(path)
+            return True
+        except OSError:
+            return False
+
+    def put(self, data, fmt=THUMBNAIL_FORMAT):
+        thumb_id = hashlib.sha1(data).hexdigest() + "." + fmt
+        path = self._path(thumb_id)
+        if self._touch(path):
+            return thumb_id
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        with self._lock:
+            self._usage += len(data)
+        self._trim()
+        return thumb_id
+
+    def get(self, thumb_id):
+        """
+        (data, mime) or None.
+        """
+        path = self._path(thumb_id)
+        if path is None:
+            return None
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        self._touch(path)
+        return data, THUMBNAIL_MIME[thumb_id.rsplit(".", 1)[1]]
+
+    def contains(self, thumb_id):
+        path = self._path(thumb_id)
+        return path is not None and self._touch(path)
+
+    def _scan(self):
+        entries = []
+        try:
+            with os.scandir(self.root) as it:
+                for entry in it:
+                    if entry.name.endswith(".tmp"):
+                        continue
+                    try:
+                        st = entry.stat()
+                    except OSError:
+                        continue
+                    entries.append((st.st_mtime, st.st_size, entry.path))
+        except OSError:
+            pass
+        return entries
+
+    def _trim(self):
+        with self._lock:
+            now = time.monotonic()
+            if self._usage <= self.max_bytes and now - self._scanned < self.rescan_s:
+                return
+            entries = sorted(self._scan())
+            usage = sum(size for _, size, _ in entries)
+            # The newest entry is always kept
+            for _, size, path in entries[:-1]:
+                if usage <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass   # removed by another process
+                usage -= size
+            self._usage = usage
+            self._scanned = now
+
+    def stats(self):
+        entries = self._scan()
+        return {"entries": len(entries), "bytes": sum(size for _, size, _ in entries),
+                "budget_bytes": self.max_bytes}
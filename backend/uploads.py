@@ -0,0 +1,367 @@
+# uploads.py
+# Upload handling: multipart file parts are streamed chunk by chunk straight
+# into UPLOAD_DIR (hashed and size-checked as they arrive), so the handler
+# gets a file that is already on disk instead of a temp copy to save again.
+# Files are deleted when the request finishes unless detached, and a
+# background reaper removes orphans and enforces the directory's disk budget.
+# Open uploads hold a shared flock, so a reaper in another process (see
+# serve.py) can tell they are still in use.
+import hashlib
+import os
+import threading
+import time
+import uuid
+
+from flask import Request
+from werkzeug.exceptions import HTTPException, RequestEntityTooLarge
+from werkzeug.utils import secure_filename
+
+try:
+    import fcntl
+except ImportError:  # Windows: in-process tracking only
+    fcntl = None
+
+from config import UPLOAD_DIR, UPLOAD_DIR_MAX_MB, UPLOAD_ORPHAN_TTL_S, UPLOAD_REAPER_INTERVAL_S
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+class InsufficientStorage(HTTPException):
+    # werkzeug has no 507 exception
+    code = 507
+    description = "The upload directory is full; try again later."
+
+# Uploads of this process that are still in use (open, or detached by their
+# owner): path -> open file holding the shared lock
+_active = {}
+_active_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    global _active_lock
+    _active_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _mark_active(path, f):
+    with _active_lock:
+        _active[path] = f
+
+
+def release(path):
+    """
+    Deletes a detached upload once its owner is done with it.
+    """
+    with _active_lock:
+        f = _active.pop(path, None)
+    if f is not None and not f.closed:
+        f.close()
+    try:
+        size = os.path.getsize(path)
+        os.remove(path)
+    except OSError:
+        return
+    upload_reaper.account(-size)
+
+
+def _locked_elsewhere(path):
+    # Probe for another process's shared lock without blocking
+    try:
+        with open(path, "rb") as f:
+            try:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return True
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    except OSError:
+        pass
+    return False
+
+
+def is_active(path):
+    with _active_lock:
+        if path in _active:
+            return True
+    return fcntl is not None and _locked_elsewhere(path)
+
+
+def dir_usage(directory=UPLOAD_DIR):
+    total = 0
+    for entry in os.scandir(directory):
+        if entry.is_file():
+            total += entry.stat().st_size
+    return total
+
+
+# --------------------------
+# Streamed upload file
+# --------------------------
+class UploadFile:
+    """
+    Writable/readable file in UPLOAD_DIR used as the stream of a werkzeug
+    FileStorage. Hashes (sha256) and counts bytes while they are written.
+    close() deletes the file unless detach() was called first.
+    """
+    def __init__(self, filename=None, directory=UPLOAD_DIR, max_bytes=None):
+        os.makedirs(directory, exist_ok=True)
+        name = secure_filename(filename or "") or "upload"
+        self.path = os.path.join(directory, f"{uuid.uuid4().hex[:8]}_{name}")
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._digest = hashlib.sha256()
+        self._detached = False
+        self._f = open(self.path, "w+b")
+        if fcntl is not None:
+            fcntl.flock(self._f.fileno(), fcntl.LOCK_SH)
+        _mark_active(self.path, self._f)
+
+    @property
+    def name(self):
+        return self.path
+
+    @property
+    def sha256(self):
+        return self._digest.hexdigest()
+
+    @property
+    def closed(self):
+        return self._f.closed
+
+    def write(self, data):
+        self.size += len(data)
+        if self.max_bytes is not None and self.size > self.max_bytes:
+            raise RequestEntityTooLarge()
+        self._digest.update(data)
+        written = self._f.write(data)
+        upload_reaper.account(len(data))
+        return written
+
+    def read(self, *args):
+        return self._f.read(*args)
+
+    def readline(self, *args):
+        return self._f.readline(*args)
+
+    def seek(self, *args):
+        return self._f.seek(*args)
+
+    def tell(self):
+        return self._f.tell()
+
+    def flush(self):
+        return self._f.flush()
+
+    def fileno(self):
+        return self._f.fileno()
+
+    def readable(self):
+        return True
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def __iter__(self):
+        return iter(self._f)
+
+    def detach(self):
+        """
+        Keeps the file (and its lock) after the request; the caller must
+        release(path).
+        """
+        self._detached = True
+        self._f.flush()
+        return self.path
+
+    def close(self):
+        # A detached file stays open until release() so it keeps its lock
+        if not self._detached:
+            release(self.path)
+
+
+class UploadRequest(Request):
+    """
+    Request class whose multipart file parts are UploadFile objects.
+    """
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        budget = UPLOAD_DIR_MAX_MB * 1024 * 1024
+        if budget and total_content_length and total_content_length > budget:
+            raise RequestEntityTooLarge()
+        if budget and not upload_reaper.ensure_space(total_content_length or 0):
+            raise InsufficientStorage()
+        upload = UploadFile(filename, max_bytes=self.max_content_length)
+        self.__dict__.setdefault("_upload_files", []).append(upload)
+        return upload
+
+    def _load_form_data(self):
+        try:
+            super()._load_form_data()
+        except BaseException:
+            # Parsing stopped mid-upload (client disconnected, size limit):
+            # the parts written so far never reach request.files, so the
+            # request's cleanup would not close and delete them
+            for upload in self.__dict__.pop("_upload_files", ()):
+                upload.close()
+            raise
+
+
+def upload_to_disk(file_storage):
+    """
+    Returns (path, sha256, size) for an uploaded file, streaming it to
+    UPLOAD_DIR first if it did not arrive through UploadRequest. The file
+    is removed when the request closes.
+    """
+    stream = file_storage.stream
+    if isinstance(stream, UploadFile):
+        stream.flush()
+        return stream.path, stream.sha256, stream.size
+
+    target = UploadFile(file_storage.filename)
+    try:
+        while True:
+            chunk = stream.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            target.write(chunk)
+        target.flush()
+    except BaseException:
+        target.close()
+        raise
+    # Let the request's cleanup close (and delete) the copy too
+    file_storage.stream = target
+    return target.path, target.sha256, target.size
+
+
+# --------------------------
+# Upload directory reaper
+# --------------------------
+class UploadReaper:
+    """
+    Periodically deletes inactive uploads older than `orphan_ttl` seconds
+    and, oldest first, inactive uploads beyond the `max_bytes` budget.
+    """
+    def __init__(self, directory=UPLOAD_DIR, max_bytes=UPLOAD_DIR_MAX_MB * 1024 * 1024,
+                 orphan_ttl=UPLOAD_ORPHAN_TTL_S, interval=UPLOAD_REAPER_INTERVAL_S):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.orphan_ttl = orphan_ttl
+        self.interval = interval
+        self.removed = 0
+        self._lock = threading.Lock()
+        # Running estimate of the directory usage: adjusted by this
+        # process's writes and deletions, and reset from a directory scan
+        # by every reaper pass (or when older than `interval`, which also
+        # picks up other processes' uploads)
+        self._usage = None
+        self._usage_at = 0.0
+        self._usage_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # The lock may have been held by the parent's reaper thread, which
+        # does not exist in the child
+        self._lock = threading.Lock()
+        self._usage_lock = threading.Lock()
+
+    def start(self):
+        if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self.run_forever, name="upload-reaper", daemon=True)
+            self._thread.start()
+
+    def run_forever(self):
+        while True:
+            try:
+                self.reap()
+            except OSError:
+                pass
+            time.sleep(self.interval)
+
+    def _files(self):
+        os.makedirs(self.directory, exist_ok=True)
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file():
+                st = entry.stat()
+                files.append((st.st_mtime, st.st_size, entry.path))
+        files.sort()
+        return files
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+            self.removed += 1
+            return True
+        except OSError:
+            return False
+
+    def account(self, delta):
+        with self._usage_lock:
+            if self._usage is not None:
+                self._usage = max(0, self._usage + delta)
+
+    def _set_usage(self, usage):
+        with self._usage_lock:
+            self._usage = usage
+            self._usage_at = time.monotonic()
+
+    def usage(self):
+        """
+        Cached directory usage; rescanned (stat only, no lock probing) when
+        older than the reaper interval.
+        """
+        with self._usage_lock:
+            if self._usage is not None and time.monotonic() - self._usage_at < self.interval:
+                return self._usage
+        os.makedirs(self.directory, exist_ok=True)
+        usage = dir_usage(self.directory)
+        self._set_usage(usage)
+        return usage
+
+    def reap(self, extra_bytes=0):
+        """
+        One pass; returns the directory usage afterwards.
+        """
+        with self._lock:
+            now = time.time()
+            usage = 0
+            kept = []
+            for mtime, size, path in self._files():
+                if not is_active(path) and now - mtime > self.orphan_ttl and self._remove(path):
+                    continue
+                usage += size
+                kept.append((mtime, size, path))
+            if self.max_bytes:
+                for mtime, size, path in kept:
+                    if usage + extra_bytes <= self.max_bytes:
+                        break
+                    if not is_active(path) and self._remove(path):
+                        usage -= size
+            self._set_usage(usage)
+            return usage
+
+    def ensure_space(self, nbytes):
+        """
+        Whether `nbytes` more fit in the budget. Checked against the cached
+        usage; only when that says no does the request pay for a reap pass.
+        """
+        if not self.max_bytes:
+            return True
+        if self.usage() + nbytes <= self.max_bytes:
+            return True
+        return self.reap(extra_bytes=nbytes) + nbytes <= self.max_bytes
+
+    def stats(self):
+        return {"directory": self.directory, "usage_bytes": dir_usage(self.directory) if os.path.isdir(self.directory) else 0,
+                "cached_usage_bytes": self._usage, "budget_bytes": self.max_bytes, "removed": self.removed}
+
+
+upload_reaper = UploadReaper()
@@ -1,38 +1,112 @@
 # video_utils.py
-import cv2
+# cv2 and PIL are imported where they are used, so importing this module
+# (e.g. for allowed_file at server start) stays cheap.
 import os
 import base64
-from PIL import Image
 from io import BytesIO
 
+from config import SEEK_MIN_GAP
+
 def allowed_file(filename, allowed_ext):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in allowed_ext
 
-def sample_frames(video_path, every_n=15, max_frames=40, resize=(256,256)):
+def plan_frame_indices(frame_count, every_n=15, max_frames=40, spread=False):
     """
-    Sample frames from video_path every `every_n` frames up to max_frames.
-    Returns list of frames in BGR (cv2) format.
+    Indices of the frames to sample from a video with `frame_count` frames.
+    stride: every `every_n`-th frame from the start, up to max_frames.
+    spread: max_frames indices spread evenly over the whole duration.
     """
-    cap = cv2.VideoCapture(video_path)
-    if not cap.isOpened():
+    if frame_count <= 0:
         return []
-    frames = []
-    idx = 0
+    if spread:
+        n = min(max_frames, frame_count)
+        if n == 1:
+            return [0]
+        step = (frame_count - 1) / (n - 1)
+        return sorted({int(round(i * step)) for i in range(n)})
+    return list(range(0, frame_count, every_n))[:max_frames]
+
+
+def iter_frames_at(cap, indices, resize=(256,256), seek_min_gap=SEEK_MIN_GAP, start_pos=0, every_n=15, max_frames=40):
+    """
+    Yields (frame_index, frame) from an open cv2.VideoCapture positioned at
+    frame `start_pos`, for the ascending frame `indices` (or, when indices
+    is None, every `every_n`-th frame up to max_frames). Skipped frames are
+    only grab()bed, so they are never converted to BGR; gaps of at least
+    `seek_min_gap` frames are crossed by seeking, which lets the decoder
+    jump to the nearest keyframe instead of decoding everything in between.
+    """
+    import cv2
+    pos = start_pos     # index of the frame the next grab() returns
     saved = 0
-    while cap.isOpened():
-        ret, frame = cap.read()
-        if not ret:
+    while saved < max_frames:
+        if indices is None:
+            target = saved * every_n
+        elif saved < len(indices):
+            target = indices[saved]
+        else:
             break
-        if idx % every_n == 0:
-            if resize:
-                frame = cv2.resize(frame, resize)
-            frames.append(frame)
-            saved += 1
-            if saved >= max_frames:
+
+        gap = target - pos
+        if seek_min_gap and gap >= seek_min_gap and cap.set(cv2.CAP_PROP_POS_FRAMES, target):
+            # The FFmpeg backend seeks to the preceding keyframe and
+            # decodes forward to the exact frame
+            gap = 0
+        ok = True
+        for _ in range(gap):
+            ok = cap.grab()
+            if not ok:
                 break
-        idx += 1
-    cap.release()
-    return frames
+        if not ok or not cap.grab():
+            break
+        pos = target + 1
+
+        ok, frame = cap.retrieve()
+        if not ok or frame is None:
+            break
+        if resize:
+            frame = cv2.resize(frame, resize)
+        yield target, frame
+        saved += 1
+
+
+def iter_frames(video_path, every_n=15, max_frames=40, resize=(256,256), spread=False, seek_min_gap=SEEK_MIN_GAP):
+    """
+    Yields (frame_index, frame) for the sampled frames of video_path in BGR
+    (cv2) format (see iter_frames_at). Falls back to a plain stride over the
+    stream when the container does not report a frame count.
+    """
+    import cv2
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        return
+    try:
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        if frame_count > 0:
+            indices = plan_frame_indices(frame_count, every_n, max_frames, spread)
+        else:
+            indices = None
+        yield from iter_frames_at(cap, indices, resize, seek_min_gap, every_n=every_n, max_frames=max_frames)
+    finally:
+        cap.release()
+
+
+def frame_count(video_path):
+    import cv2
+    cap = cv2.VideoCapture(video_path)
+    try:
+        return int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) if cap.isOpened() else 0
+    finally:
+        cap.release()
+
+
+def sample_frames(video_path, every_n=15, max_frames=40, resize=(256,256), spread=False):
+    """
+    Sample frames from video_path every `every_n` frames up to max_frames
+    (or max_frames spread over the whole video when `spread` is set).
+    Returns list of frames in BGR (cv2) format.
+    """
+    return [frame for _, frame in iter_frames(video_path, every_n, max_frames, resize, spread)]
 
 def bgr_to_rgb_pil(bgr_img):
     import cv2
@@ -50,3 +124,31 @@ def frame_to_base64_bgr(frame_bgr):
     pil = bgr_to_rgb_pil(frame_bgr)
     # optionally resize here
     return pil_to_base64(pil)
+
+
+THUMBNAIL_MIME = {"jpeg": "image/jpeg", "webp": "image/webp", "png": "image/png"}
+
+
+def encode_thumbnail(frame_bgr, fmt="jpeg", size=(128,128), quality=80):
+    """
+    Encodes a (downscaled) BGR frame directly with cv2.imencode, skipping
+    the PIL round trip. Returns the encoded bytes.
+    """
+    import cv2
+    if size and frame_bgr.shape[1::-1] != tuple(size):
+        frame_bgr = cv2.resize(frame_bgr, tuple(size), interpolation=cv2.INTER_AREA)
+    if fmt == "jpeg":
+        params = [cv2.IMWRITE_JPEG_QUALITY, int(quality)]
+    elif fmt == "webp":
+        params = [cv2.IMWRITE_WEBP_QUALITY, int(quality)]
+    else:
+        params = []
+    ok, buf = cv2.imencode("." + fmt, frame_bgr, params)
+    if not ok:
+        raise ValueError(f"could not encode thumbnail as {fmt}")
+    return buf.tobytes()
+
+
+def to_data_uri(data, fmt="jpeg"):
+    encoded = base64.b64encode(data).decode("utf-8")
+    return f"data:{THUMBNAIL_MIME[fmt]};base64,{encoded}"
@@ -63,7 +63,7 @@ function ResultPage() {
           {thumbnails?.map((thumb, idx) => (
             <div key={idx} className="frame-card">
               <img
-                src={`data:image/jpeg;base64,${thumb.img_b64}`}
+                src={thumb.url ? `http://localhost:8000${thumb.url}` : thumb.img_b64}
                 alt={`frame-${idx}`}
               />
               <p>Frame {thumb.index}</p>
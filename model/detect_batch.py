@@ -0,0 +1,369 @@
+"""
+Evaluates many videos (e.g. a whole FaceForensics++ split) with the
+xception network and writes one verdict per video.
+
+The model is loaded once. Worker processes decode the videos and localise
+faces (FaceTracker + get_boundingbox from detect_from_video.py), sending
+the face crops resized to the network input to the main process in chunks
+of --chunk crops through a bounded queue, so at most about
+--max_crops_in_flight crops (plus one chunk per worker) wait in memory
+however long the videos are. The main process takes chunks in the order
+they arrive, from any video, packs them into fixed-size batches,
+preprocesses them as tensors and runs them through the network. Verdicts
+are appended to a JSONL manifest as each video finishes; an interrupted
+run is resumed by starting it again with the same manifest.
+
+Usage:
+python detect_batch.py
+    -i <folder with video files, path to a video file, or .txt list of videos>
+    -m <path to model file>
+    -o <results manifest (.jsonl)>
+    [-b 64] [-w 4] [--every_n 1] [--max_frames 0] [--chunk 32]
+    [--max_crops_in_flight 512] [--cuda]
+"""
+import os
+import json
+import time
+import argparse
+import multiprocessing
+from collections import deque
+
+import cv2
+import numpy as np
+import torch
+import torch.nn as nn
+from tqdm import tqdm
+
+from detect_from_video import FaceTracker, get_boundingbox, load_model
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv')
+IMAGE_SIZE = 299
+
+
+def collect_videos(input_path):
+    """
+    :param input_path: video file, folder (searched recursively) or .txt
+    file with one video path per line
+    :return: sorted list of video paths
+    """
+    if input_path.endswith('.txt'):
+        with open(input_path) as f:
+            return [line.strip() for line in f if line.strip()]
+    if os.path.isfile(input_path):
+        return [input_path]
+    videos = []
+    for root, _, files in os.walk(input_path):
+        videos.extend(os.path.join(root, f) for f in files
+                      if f.lower().endswith(VIDEO_EXTENSIONS))
+    return sorted(videos)
+
+
+def video_key(path):
+    # Changes whenever the file is replaced or rewritten
+    st = os.stat(path)
+    return '{}:{}:{}'.format(os.path.abspath(path), st.st_size, st.st_mtime_ns)
+
+
+class ResultsManifest(object):
+    """
+    Append-only JSONL file of per-video results. Each line is flushed
+    as soon as it is written, so a killed run loses at most the videos
+    in flight.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.done = set()
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        row = json.loads(line)
+                    except ValueError:
+                        continue    # torn last line of an interrupted run
+                    if 'error' not in row:
+                        self.done.add(row['key'])
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._file = open(path, 'a')
+
+    def record(self, row):
+        self._file.write(json.dumps(row) + '\n')
+        self._file.flush()
+        if 'error' not in row:
+            self.done.add(row['key'])
+
+    def close(self):
+        self._file.close()
+
+
+# --------------------------
+# Worker processes: decode + face crops
+# --------------------------
+_tracker_args = None
+_results = None
+
+
+def _init_worker(detect_every, detect_width, track_confidence, results):
+    global _tracker_args, _results
+    _tracker_args = (detect_every, detect_width, track_confidence)
+    _results = results
+    # One process per core already; keep OpenCV from oversubscribing
+    cv2.setNumThreads(1)
+
+
+def extract_faces(task_id, video_path, every_n=1, max_frames=0, chunk=32):
+    """
+    Worker: decodes every `every_n`-th frame of video_path (up to
+    max_frames, 0 = all) and crops the face in each. The crops go to the
+    results queue as ('crops', task_id, uint8 RGB array of shape
+    [<= chunk, IMAGE_SIZE, IMAGE_SIZE, 3]) as soon as `chunk` of them are
+    ready (blocking while the queue is full), followed by
+    ('done', task_id, per-video counts).
+    """
+    started = time.time()
+    key = video_key(video_path)
+    tracker = FaceTracker(*_tracker_args)
+    reader = cv2.VideoCapture(video_path)
+    if not reader.isOpened():
+        raise IOError('could not open video')
+    frames, faces, crops = 0, 0, []
+    try:
+        frame_num = -1
+        while reader.isOpened():
+            if max_frames and frames >= max_frames:
+                break
+            frame_num += 1
+            if frame_num % every_n:
+                # Skipped frames are only grabbed, never converted to BGR
+                if not reader.grab():
+                    break
+                continue
+            _, image = reader.read()
+            if image is None:
+                break
+            frames += 1
+            # The tracker sees only the sampled frames; with every_n > 1
+            # it re-detects more often when faces move fast
+            face = tracker(image)
+            if face is None:
+                continue
+            height, width = image.shape[:2]
+            x, y, size = get_boundingbox(face, width, height)
+            if size <= 0:
+                continue
+            crop = cv2.resize(image[y:y+size, x:x+size], (IMAGE_SIZE, IMAGE_SIZE),
+                              interpolation=cv2.INTER_AREA if size > IMAGE_SIZE
+                              else cv2.INTER_LINEAR)
+            crops.append(cv2.cvtColor(crop, cv2.COLOR_BGR2RGB))
+            if len(crops) == chunk:
+                _results.put(('crops', task_id, np.stack(crops)))
+                faces += len(crops)
+                crops = []
+    finally:
+        reader.release()
+    if crops:
+        _results.put(('crops', task_id, np.stack(crops)))
+        faces += len(crops)
+    _results.put(('done', task_id, {'key': key, 'frames': frames, 'faces': faces,
+                                    'detections': tracker.detections,
+                                    'decode_seconds': time.time() - started}))
+
+
+def _safe_extract(args):
+    try:
+        extract_faces(*args)
+    except Exception as e:
+        _results.put(('error', args[0], '{}: {}'.format(type(e).__name__, e)))
+
+
+# --------------------------
+# Main process: batched inference
+# --------------------------
+def preprocess_batch(crops, device):
+    """
+    Tensor version of xception_default_data_transforms['test'] for crops
+    already resized to IMAGE_SIZE: uint8 [n, H, W, 3] RGB ->
+    normalized float [n, 3, H, W] on device.
+    """
+    batch = torch.from_numpy(crops).to(device, non_blocking=True)
+    batch = batch.permute(0, 3, 1, 2).float().div_(255.0)
+    return batch.sub_(0.5).div_(0.5)
+
+
+class PendingVideo(object):
+    def __init__(self, video):
+        self.info = {'video': video}
+        self.probs = []         # per scored slice of crops, in frame order
+        self.buffered = 0       # crops waiting in the scorer
+        self.finished = False   # all crops received
+        self.failed = False
+
+    def verdict(self, threshold=0.5):
+        info = self.info
+        row = {'video': info['video'], 'key': info['key'],
+               'frames': info['frames'], 'faces': info['faces'],
+               'detections': info['detections']}
+        if not self.probs:
+            row.update(verdict='no_face', mean_fake=None, fake_frames=0)
+            return row
+        fake = np.concatenate(self.probs)[:, 1]
+        mean_fake = float(fake.mean())
+        row.update(verdict='fake' if mean_fake > threshold else 'real',
+                   mean_fake=mean_fake,
+                   fake_frames=int((fake > threshold).sum()))
+        return row
+
+
+class BatchScorer(object):
+    """
+    Buffers face crops from any number of videos and scores them in
+    fixed-size batches; a video is passed to on_done(PendingVideo) once
+    finish() was called for it and all of its crops are scored.
+    """
+    def __init__(self, model, batch_size, device, on_done):
+        self.model = model
+        self.batch_size = batch_size
+        self.device = device
+        self.on_done = on_done
+        self.softmax = nn.Softmax(dim=1)
+        self._crops = deque()   # (PendingVideo, crops)
+        self._buffered = 0
+        self.batches = 0
+
+    def add(self, pending, crops):
+        pending.buffered += len(crops)
+        self._crops.append((pending, crops))
+        self._buffered += len(crops)
+        while self._buffered >= self.batch_size:
+            self._run(self.batch_size)
+
+    def finish(self, pending):
+        pending.finished = True
+        self._maybe_done(pending)
+
+    def flush(self):
+        while self._buffered:
+            self._run(min(self._buffered, self.batch_size))
+
+    def _maybe_done(self, pending):
+        if pending.finished and not pending.buffered and not pending.failed:
+            self.on_done(pending)
+
+    def _run(self, size):
+        # Take `size` crops from the head of the buffer
+        parts, owners, taken = [], [], 0
+        while taken < size:
+            pending, crops = self._crops.popleft()
+            n = min(len(crops), size - taken)
+            parts.append(crops[:n])
+            owners.append((pending, n))
+            if n < len(crops):
+                self._crops.appendleft((pending, crops[n:]))
+            taken += n
+        self._buffered -= taken
+
+        with torch.no_grad():
+            output = self.softmax(self.model(preprocess_batch(
+                np.concatenate(parts), self.device)))
+        probs = output.cpu().numpy()
+        self.batches += 1
+
+        offset = 0
+        for pending, n in owners:
+            pending.probs.append(probs[offset:offset + n])
+            offset += n
+            pending.buffered -= n
+            self._maybe_done(pending)
+
+
+def run(input_path, model_path, output, batch_size=64, workers=4, every_n=1,
+        max_frames=0, chunk=32, max_crops_in_flight=512, detect_every=5,
+        detect_width=640, track_confidence=7.0, cuda=False, threshold=0.5):
+    videos = collect_videos(input_path)
+    manifest = ResultsManifest(output)
+    # Missing files are kept so that they are reported as failures
+    todo = [v for v in videos
+            if not os.path.exists(v) or video_key(v) not in manifest.done]
+    print('{} videos, {} already done, {} to process'.format(
+        len(videos), len(videos) - len(todo), len(todo)))
+    if not todo:
+        manifest.close()
+        return
+
+    device = 'cuda' if cuda and torch.cuda.is_available() else 'cpu'
+    model = load_model(model_path, cuda=device == 'cuda')
+    pbar = tqdm(total=len(todo))
+
+    def on_done(pending):
+        manifest.record(dict(pending.verdict(threshold),
+                             decode_seconds=pending.info['decode_seconds']))
+        pbar.update(1)
+
+    scorer = BatchScorer(model, batch_size, device, on_done)
+    # "spawn": workers must not inherit the parent's torch/CUDA state
+    ctx = multiprocessing.get_context('spawn')
+    # Workers block once this many chunks wait, so decoded crops cannot pile
+    # up faster than the model consumes them
+    results = ctx.Queue(maxsize=max(1, max_crops_in_flight // chunk))
+    pool = ctx.Pool(workers, initializer=_init_worker,
+                    initargs=(detect_every, detect_width, track_confidence, results))
+    try:
+        # Videos are handed out one at a time as workers free up; their
+        # chunks are consumed in arrival order, so short videos never wait
+        # behind long ones
+        pool.map_async(_safe_extract, [(i, v, every_n, max_frames, chunk)
+                                       for i, v in enumerate(todo)], chunksize=1)
+        pending = {}
+        remaining = len(todo)
+        while remaining:
+            kind, i, payload = results.get()
+            if kind == 'crops':
+                if i not in pending:
+                    pending[i] = PendingVideo(todo[i])
+                scorer.add(pending[i], payload)
+            elif kind == 'done':
+                video = pending.pop(i, None) or PendingVideo(todo[i])
+                video.info.update(payload)
+                scorer.finish(video)
+                remaining -= 1
+            else:
+                video = pending.pop(i, None)
+                if video is not None:
+                    video.failed = True   # crops already buffered are ignored
+                print('Failed: {} ({})'.format(todo[i], payload))
+                manifest.record({'video': todo[i], 'key': None, 'error': payload})
+                pbar.update(1)
+                remaining -= 1
+        scorer.flush()
+    finally:
+        pool.terminate()
+        pool.join()
+        pbar.close()
+        manifest.close()
+    print('Finished! {} batches, results in {}'.format(scorer.batches, output))
+
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    p.add_argument('--input_path', '-i', type=str, required=True)
+    p.add_argument('--model_path', '-m', type=str, required=True)
+    p.add_argument('--output', '-o', type=str, default='results.jsonl')
+    p.add_argument('--batch_size', '-b', type=int, default=64)
+    p.add_argument('--workers', '-w', type=int, default=4,
+                   help='decode/face detection processes')
+    p.add_argument('--every_n', type=int, default=1,
+                   help='score every n-th frame')
+    p.add_argument('--max_frames', type=int, default=0,
+                   help='frames scored per video (0: all)')
+    p.add_argument('--chunk', type=int, default=32,
+                   help='face crops sent from a worker at a time')
+    p.add_argument('--max_crops_in_flight', type=int, default=512,
+                   help='decoded crops queued for the model at most')
+    p.add_argument('--detect_every', type=int, default=5)
+    p.add_argument('--detect_width', type=int, default=640)
+    p.add_argument('--track_confidence', type=float, default=7.0)
+    p.add_argument('--threshold', type=float, default=0.5,
+                   help='mean fake probability above which a video is fake')
+    p.add_argument('--cuda', action='store_true')
+    args = p.parse_args()
+    run(**vars(args))
@@ -7,11 +7,27 @@ python detect_from_video.py
     -i <folder with video files or path to video file>
     -m <path to model file>
     -o <path to output folder, will write one or multiple output videos there>
+    [--headless] [--no_video] [--score_log csv|json]
+    [--detect_every 5] [--detect_width 640] [--track_confidence 7]
+
+With --headless nothing is displayed and frames are processed as fast as
+decoding, face detection and inference allow; the per-frame score log
+(csv by default) is the primary output and the annotated video is
+optional (--no_video). Annotated frames are written by a background
+thread through a bounded queue.
+
+Faces are detected every --detect_every frames on a downscaled frame and
+tracked in between (see FaceTracker); --detect_every 1 --detect_width 0
+detects on every full-resolution frame.
 
 Author: Andreas Rössler
 """
 import os
+import csv
+import json
+import queue
 import argparse
+import threading
 from os.path import join
 import cv2
 import dlib
@@ -54,6 +70,25 @@ def get_boundingbox(face, width, height, scale=1.3, minsize=None):
     return x1, y1, size_bb
 
 
+def load_model(model_path, cuda=True):
+    """
+    Builds the xception network and loads the checkpoint at model_path.
+    :return: model in eval mode (on the GPU if cuda)
+    """
+    model = model_selection(modelname='xception', num_out_classes=2, dropout=0.5)
+    # Load model with proper device mapping
+    if cuda and torch.cuda.is_available():
+        model.load_state_dict(torch.load(model_path))
+    else:
+        model.load_state_dict(torch.load(model_path, map_location='cpu'))
+    if isinstance(model, torch.nn.DataParallel):
+        model = model.module
+    if cuda:
+        model = model.cuda()
+    model.eval()
+    return model
+
+
 def preprocess_image(image, cuda=True):
     """
     Preprocesses the image such that it can be fed into our network.
@@ -102,8 +137,170 @@ def predict_with_model(image, model, post_function=nn.Softmax(dim=1),
     return int(prediction), output
 
 
+class FaceTracker(object):
+    """
+    Localises one face per frame without running the dlib detector on every
+    frame: the detector runs on a grayscale frame downscaled to at most
+    `detect_width` pixels wide every `detect_every` frames (boxes are mapped
+    back to full resolution), and a dlib correlation tracker follows the
+    face in between. A detection is forced early when the tracker's
+    confidence (peak-to-sidelobe ratio) drops below `min_confidence`.
+    detect_every=1, detect_width=0 detects on every full frame.
+    """
+    def __init__(self, detect_every=5, detect_width=640, min_confidence=7.0,
+                 upsample=1):
+        self.detect_every = max(1, detect_every)
+        self.detect_width = detect_width
+        self.min_confidence = min_confidence
+        self.upsample = upsample
+        self.detector = dlib.get_frontal_face_detector()
+        self.tracker = None
+        self.since_detection = 0
+        self.detections = 0
+        self.tracked = 0
+
+    def detect(self, gray):
+        height, width = gray.shape[:2]
+        scale = 1.0
+        if self.detect_width and width > self.detect_width:
+            scale = self.detect_width / float(width)
+            gray = cv2.resize(gray, (self.detect_width, int(height * scale)),
+                              interpolation=cv2.INTER_AREA)
+        self.detections += 1
+        faces = self.detector(gray, self.upsample)
+        if not len(faces):
+            return None
+        # Only take the biggest face
+        face = max(faces, key=lambda f: f.width() * f.height())
+        return dlib.rectangle(int(face.left() / scale), int(face.top() / scale),
+                              int(face.right() / scale),
+                              int(face.bottom() / scale))
+
+    def __call__(self, image):
+        """
+        :param image: BGR frame
+        :return: dlib rectangle of the face in full-resolution coordinates,
+        or None
+        """
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        if self.tracker is not None and self.since_detection < self.detect_every:
+            confidence = self.tracker.update(gray)
+            self.since_detection += 1
+            if confidence >= self.min_confidence:
+                self.tracked += 1
+                pos = self.tracker.get_position()
+                return dlib.rectangle(int(round(pos.left())),
+                                      int(round(pos.top())),
+                                      int(round(pos.right())),
+                                      int(round(pos.bottom())))
+        elif self.tracker is None and 0 < self.since_detection < self.detect_every:
+            # No face at the last detection; wait for the next one
+            self.since_detection += 1
+            return None
+
+        face = self.detect(gray)
+        self.since_detection = 1
+        self.tracker = None
+        if face is not None:
+            self.tracker = dlib.correlation_tracker()
+            self.tracker.start_track(gray, face)
+        return face
+
+
+class AsyncVideoWriter(object):
+    """
+    cv2.VideoWriter fed from a bounded queue by a background thread, so
+    encoding overlaps with detection and inference. write() blocks once
+    `max_queue` frames are pending, which bounds memory use. The writer is
+    opened on the first frame (its size is not known before).
+    """
+    def __init__(self, path, fourcc, fps, max_queue=32):
+        self.path = path
+        self.fourcc = fourcc
+        self.fps = fps
+        self.frames_written = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name='video-writer',
+                                        daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        writer = None
+        try:
+            while True:
+                image = self._queue.get()
+                if image is None:
+                    break
+                if writer is None:
+                    height, width = image.shape[:2]
+                    writer = cv2.VideoWriter(self.path, self.fourcc, self.fps,
+                                             (width, height))
+                writer.write(image)
+                self.frames_written += 1
+        except Exception as e:
+            self._error = e
+            # Keep draining so write() never blocks on a dead thread
+            while self._queue.get() is not None:
+                pass
+        finally:
+            if writer is not None:
+                writer.release()
+
+    def write(self, image):
+        if self._error is not None:
+            raise self._error
+        self._queue.put(image)
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+
+class ScoreLog(object):
+    """
+    Per-frame prediction log. CSV rows are written as they come in; JSON is
+    written as one document on close().
+    """
+    FIELDS = ['frame', 'face', 'x', 'y', 'w', 'h', 'prob_real', 'prob_fake',
+              'prediction']
+
+    def __init__(self, path, fmt='csv', video_path=None):
+        self.path = path
+        self.fmt = fmt
+        self.video_path = video_path
+        self._rows = []
+        self._file = open(path, 'w', newline='')
+        self._csv = None
+        if fmt == 'csv':
+            self._csv = csv.DictWriter(self._file, fieldnames=self.FIELDS)
+            self._csv.writeheader()
+
+    def add(self, frame, box=None, output=None, prediction=None):
+        row = {'frame': frame, 'face': box is not None}
+        if box is not None:
+            row.update(x=box[0], y=box[1], w=box[2], h=box[3],
+                       prob_real=float(output[0]), prob_fake=float(output[1]),
+                       prediction='fake' if prediction == 1 else 'real')
+        if self._csv is not None:
+            self._csv.writerow(row)
+        else:
+            self._rows.append(row)
+
+    def close(self):
+        if self._csv is None:
+            json.dump({'video': self.video_path, 'frames': self._rows},
+                      self._file)
+        self._file.close()
+
+
 def test_full_image_network(video_path, model_path, output_path,
-                            start_frame=0, end_frame=None, cuda=True):
+                            start_frame=0, end_frame=None, cuda=True,
+                            headless=False, no_video=False, score_log=None,
+                            writer_queue=32, detect_every=5, detect_width=640,
+                            track_confidence=7.0):
     """
     Reads a video and evaluates a subset of frames with the a detection network
     that takes in a full frame. Outputs are only given if a face is present
@@ -114,6 +311,17 @@ def test_full_image_network(video_path, model_path, output_path,
     :param start_frame: first frame to evaluate
     :param end_frame: last frame to evaluate
     :param cuda: enable cuda
+    :param headless: no display; run as fast as possible
+    :param no_video: do not write the annotated output video
+    :param score_log: 'csv' or 'json' per-frame score log (default 'csv'
+    in headless mode, none otherwise)
+    :param writer_queue: frames buffered for the background video writer
+    :param detect_every: run the face detector every this many frames and
+    track the face in between (1: detect on every frame)
+    :param detect_width: downscale frames to this width for detection
+    (0: full resolution)
+    :param track_confidence: re-detect when the tracker's confidence falls
+    below this
     :return:
     """
     print('Starting: {}'.format(video_path))
@@ -121,27 +329,29 @@ def test_full_image_network(video_path, model_path, output_path,
     # Read and write
     reader = cv2.VideoCapture(video_path)
 
-    video_fn = video_path.split('/')[-1].split('.')[0]+'.avi'
+    video_name = video_path.split('/')[-1].split('.')[0]
     os.makedirs(output_path, exist_ok=True)
     fourcc = cv2.VideoWriter_fourcc(*'MJPG')
     fps = reader.get(cv2.CAP_PROP_FPS)
     num_frames = int(reader.get(cv2.CAP_PROP_FRAME_COUNT))
     writer = None
+    if not no_video:
+        writer = AsyncVideoWriter(join(output_path, video_name + '.avi'),
+                                  fourcc, fps, max_queue=writer_queue)
+    if score_log is None and headless:
+        score_log = 'csv'
+    log = None
+    if score_log:
+        log = ScoreLog(join(output_path, video_name + '.' + score_log),
+                       score_log, video_path)
+    # Boxes and labels are only drawn when someone will see them
+    annotate = not headless or writer is not None
 
     # Face detector
-    face_detector = dlib.get_frontal_face_detector()
+    face_tracker = FaceTracker(detect_every, detect_width, track_confidence)
 
     # Load model
-    model = model_selection(modelname='xception', num_out_classes=2, dropout=0.5)
-   # Load model with proper device mapping
-    if cuda and torch.cuda.is_available():
-        model.load_state_dict(torch.load(model_path))
-    else:
-        model.load_state_dict(torch.load(model_path, map_location='cpu'))
-    if isinstance(model, torch.nn.DataParallel):
-        model = model.module
-    if cuda:
-        model = model.cuda()
+    model = load_model(model_path, cuda)
 
     # Text variables
     font_face = cv2.FONT_HERSHEY_SIMPLEX
@@ -154,70 +364,82 @@ def test_full_image_network(video_path, model_path, output_path,
     end_frame = end_frame if end_frame else num_frames
     pbar = tqdm(total=end_frame-start_frame)
 
-    while reader.isOpened():
-        _, image = reader.read()
-        if image is None:
-            break
-        frame_num += 1
-
-        if frame_num < start_frame:
-            continue
-        pbar.update(1)
-
-        # Image size
-        height, width = image.shape[:2]
-
-        # Init output writer
-        if writer is None:
-            writer = cv2.VideoWriter(join(output_path, video_fn), fourcc, fps,
-                                     (height, width)[::-1])
-
-        # 2. Detect with dlib
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        faces = face_detector(gray, 1)
-        if len(faces):
-            # For now only take biggest face
-            face = faces[0]
-
-            # --- Prediction ---------------------------------------------------
-            # Face crop with dlib and bounding box scale enlargement
-            x, y, size = get_boundingbox(face, width, height)
-            cropped_face = image[y:y+size, x:x+size]
-
-            # Actual prediction using our model
-            prediction, output = predict_with_model(cropped_face, model,
-                                                    cuda=cuda)
-            # ------------------------------------------------------------------
-
-            # Text and bb
-            x = face.left()
-            y = face.top()
-            w = face.right() - x
-            h = face.bottom() - y
-            label = 'fake' if prediction == 1 else 'real'
-            color = (0, 255, 0) if prediction == 0 else (0, 0, 255)
-            output_list = ['{0:.2f}'.format(float(x)) for x in
-                           output.detach().cpu().numpy()[0]]
-            cv2.putText(image, str(output_list)+'=>'+label, (x, y+h+30),
-                        font_face, font_scale,
-                        color, thickness, 2)
-            # draw box over face
-            cv2.rectangle(image, (x, y), (x + w, y + h), color, 2)
-
-        if frame_num >= end_frame:
-            break
-
-        # Show
-        cv2.imshow('test', image)
-        cv2.waitKey(33)     # About 30 fps
-        writer.write(image)
+    processed = 0
+    with torch.no_grad():
+        while reader.isOpened():
+            if frame_num + 1 < start_frame:
+                # Skipped frames are only grabbed, never converted to BGR
+                if not reader.grab():
+                    break
+                frame_num += 1
+                continue
+            _, image = reader.read()
+            if image is None:
+                break
+            frame_num += 1
+            processed += 1
+            pbar.update(1)
+
+            # Image size
+            height, width = image.shape[:2]
+
+            # 2. Detect (or track) with dlib
+            face = face_tracker(image)
+            if face is not None:
+
+                # --- Prediction -----------------------------------------------
+                # Face crop with dlib and bounding box scale enlargement
+                x, y, size = get_boundingbox(face, width, height)
+                cropped_face = image[y:y+size, x:x+size]
+
+                # Actual prediction using our model
+                prediction, output = predict_with_model(cropped_face, model,
+                                                        cuda=cuda)
+                probs = output.cpu().numpy()[0]
+                # --------------------------------------------------------------
+
+                # Text and bb
+                x = face.left()
+                y = face.top()
+                w = face.right() - x
+                h = face.bottom() - y
+                if log is not None:
+                    log.add(frame_num, (x, y, w, h), probs, prediction)
+                if annotate:
+                    label = 'fake' if prediction == 1 else 'real'
+                    color = (0, 255, 0) if prediction == 0 else (0, 0, 255)
+                    output_list = ['{0:.2f}'.format(float(p)) for p in probs]
+                    cv2.putText(image, str(output_list)+'=>'+label,
+                                (x, y+h+30), font_face, font_scale,
+                                color, thickness, 2)
+                    # draw box over face
+                    cv2.rectangle(image, (x, y), (x + w, y + h), color, 2)
+            elif log is not None:
+                log.add(frame_num)
+
+            if frame_num >= end_frame:
+                break
+
+            # Show
+            if not headless:
+                cv2.imshow('test', image)
+                cv2.waitKey(33)     # About 30 fps
+            if writer is not None:
+                # The writer owns the frame from here on
+                writer.write(image)
     pbar.close()
+    reader.release()
+    print('Face detector ran on {} of {} frames'.format(
+        face_tracker.detections, processed))
+    if log is not None:
+        log.close()
+        print('Scores saved to {}'.format(log.path))
     if writer is not None:
-        writer.release()
-        print('Finished! Output saved under {}'.format(output_path))
-    else:
+        writer.close()
+    if not processed:
         print('Input video file was empty')
-
+    else:
+        print('Finished! Output saved under {}'.format(output_path))
 
 if __name__ == '__main__':
     p = argparse.ArgumentParser(
@@ -229,6 +451,21 @@ if __name__ == '__main__':
     p.add_argument('--start_frame', type=int, default=0)
     p.add_argument('--end_frame', type=int, default=None)
     p.add_argument('--cuda', action='store_true')
+    p.add_argument('--headless', action='store_true',
+                   help='no display; process as fast as possible')
+    p.add_argument('--no_video', action='store_true',
+                   help='do not write the annotated output video')
+    p.add_argument('--score_log', type=str, default=None,
+                   choices=['csv', 'json'],
+                   help='per-frame score log (csv by default when headless)')
+    p.add_argument('--writer_queue', type=int, default=32,
+                   help='frames buffered for the background video writer')
+    p.add_argument('--detect_every', type=int, default=5,
+                   help='run the face detector every K frames, track between')
+    p.add_argument('--detect_width', type=int, default=640,
+                   help='frame width for face detection (0: full size)')
+    p.add_argument('--track_confidence', type=float, default=7.0,
+                   help='re-detect when tracking confidence drops below this')
     args = p.parse_args()
 
     video_path = args.video_path